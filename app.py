@@ -1,45 +1,18 @@
 import streamlit as st
 import streamlit_nested_layout
-from typing import NamedTuple 
-from typing import List
 import numpy as np
 import pandas as pd
 
 from funcs import st_plot
+from funcs.result import failed
+from funcs import catalog
+from funcs.catalog import BatteryCell
 from methods import monotype
 from methods import treshold
 from methods import optimal
 from funcs import plotting
 from methods import aeneas
 
-class BatteryCell(NamedTuple):  # Class for defining battery cells
-    capacity:   float   # Rated capacity (Ah)
-    voltage:    float   # Nominal voltage (V)
-    dis_rate:   float   # Maximum discharge rate (A/Ah)
-    chg_rate:   float   # Maximum charge rate (A/Ah)
-    resistance: float   # Internal resistance (Ohm)
-    weight:     float   # Cell weight (kg)
-    cost_spec:  float   # Specific cost (€/kWh)
-    OCV: List[float]        # Open-circuit voltage (V)
-    OCV_SOC: List[float]    # State of Charge (0-1)
-    aging: List[float]      # fitting parameters for aging model (a, b, c, d)
-
-    @property
-    def energy(self):       # Energy Capacity (kWh)
-        return self.capacity * self.voltage / 1000
-    
-    @property
-    def cost(self):         # Cost per cell (€)
-        return self.energy * self.cost_spec
-    
-    @property
-    def dis_current(self):  # Maximum discharge current (A)
-        return self.dis_rate * self.capacity
-    
-    @property
-    def chg_current(self):  # Maximum charge current (A)
-        return self.chg_rate * self.capacity
-
 st.set_page_config(
     page_title="AENAES Sizing Tool",
     page_icon=":battery:",
@@ -85,57 +58,11 @@ select_HP = cols[1].selectbox("Battery Cell Technology", CELL_TECHS, index=3)
 
 
 
-cell_NMC = BatteryCell(
-    capacity    = 50.0,
-    voltage     = 3.67,
-    dis_rate    = 1.0,
-    chg_rate    = 1.0,
-    cost_spec   = 150.0,
-    resistance  = 1.5 / 1000,
-    weight      = 1000*0.885, 
-    OCV         = [3.427, 3.508, 3.588, 3.621, 3.647, 3.684, 3.761, 3.829, 3.917, 4.019, 4.135],
-    OCV_SOC     = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1],
-    aging       = [694700, -0.1770, 52790, -0.0356],
-)
-
-cell_LTO = BatteryCell(
-    capacity    = 23.0,
-    voltage     = 2.3,
-    dis_rate    = 4.0,
-    chg_rate    = 4.0,
-    cost_spec   = 380.0,
-    resistance  = 1.1 / 1000, 
-    weight      = 1000*0.55,
-    OCV         = [2.067, 2.113, 2.151, 2.183, 2.217, 2.265, 2.326, 2.361, 2.427, 2.516, 2.653],
-    OCV_SOC     = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1],
-    aging       = [6881000, -0.1950, 426500, -0.0418],
-) 
-
-cell_SSB = BatteryCell(
-    capacity    = 106.0,
-    voltage     = 3.55,
-    dis_rate    = 0.33,
-    chg_rate    = 0.33,
-    cost_spec   = 150.0*100,
-    resistance  = 1.2 / 1000,
-    weight      = 1000*1.083, 
-    OCV         = [2.5, 3.025, 3.55, 3.9, 4.25],
-    OCV_SOC     = [0, 0.25, 0.5, 0.75, 1],
-    aging       = [6881000, -0.1950, 426500, -0.0418],
-)
-
-cell_SC = BatteryCell(
-    capacity    = 0.75,
-    voltage     = 1.95,
-    dis_rate    = 173.3,
-    chg_rate    = 173.3,
-    cost_spec   = 54700.0,
-    resistance  = 0.2 / 1000,
-    weight      = 1000*0.542, 
-    OCV         = [1.5, 1.75, 1.95, 2, 2.4],
-    OCV_SOC     = [0, 0.33, 0.56, 0.61, 1],
-    aging       = [6881000, -0.1950, 426500, -0.0418],
-)
+cells = catalog.load()
+cell_NMC = cells.cell("NMC")
+cell_LTO = cells.cell("LTO")
+cell_SSB = cells.cell("SSB")
+cell_SC = cells.cell("SC")
 
 cell_HE = cell_NMC if select_HE == CELL_TECHS[0] else cell_SSB
 cell_HP = cell_LTO if select_HP == CELL_TECHS[2] else cell_SC
@@ -198,22 +125,37 @@ if run:
     with st.spinner("Calculation in progress..."):
         st.toast("Calculating monotype HE solution...", icon="⌛")
         dict_mono_HE = monotype.monotype2(loads=loads, cell=cell_HE, V_bus=V_bus, cycles=cycles if bool_aging else [0]*len(loads))
+        if failed(dict_mono_HE):
+            st.error(f"Monotype HE optimization failed ({dict_mono_HE['return_status']}), largest constraint violations: {dict_mono_HE['infeasibilities']}")
+            st.stop()
         st.toast(f"[{dict_mono_HE['time']/1000:,.2f}s] Monotype HE solution found!", icon="✅")
 
         st.toast("Calculating monotype HP solution...", icon="⌛")
         dict_mono_HP = monotype.monotype2(loads=loads, cell=cell_HP, V_bus=V_bus, cycles=cycles if bool_aging else [0]*len(loads))
+        if failed(dict_mono_HP):
+            st.error(f"Monotype HP optimization failed ({dict_mono_HP['return_status']}), largest constraint violations: {dict_mono_HP['infeasibilities']}")
+            st.stop()
         st.toast(f"[{dict_mono_HP['time']/1000:,.2f}s] Monotype HP solution found!", icon="✅")
 
         st.toast("Calculating AENEAS solution...", icon="⌛")
         dict_aeneas = aeneas.aeneas_opti(loads=loads, cell_HE=cell_HE, cell_HP=cell_HP, V_bus=V_bus, cycles=cycles if bool_aging else [0]*len(loads), limit=limit, dict_initial=None)
+        if failed(dict_aeneas):
+            st.error(f"AENEAS optimization failed ({dict_aeneas['return_status']}), largest constraint violations: {dict_aeneas['infeasibilities']}")
+            st.stop()
         st.toast(f"[{dict_aeneas['time']/1000:,.2f}s] AENEAS solution found!", icon="✅")
 
         st.toast("Calculating AENEAS 2 solution...", icon="⌛")
         dict_aeneas_energy = aeneas.aeneas_opti_energy(loads=loads, cell_HE=cell_HE, cell_HP=cell_HP, V_bus=V_bus, cycles=cycles if bool_aging else [0]*len(loads), limit=limit, dict_initial=dict_aeneas)
+        if failed(dict_aeneas_energy):
+            st.error(f"AENEAS 2 optimization failed ({dict_aeneas_energy['return_status']}), largest constraint violations: {dict_aeneas_energy['infeasibilities']}")
+            st.stop()
         st.toast(f"[{dict_aeneas['time']/1000:,.2f}s] AENEAS 2 solution found!", icon="✅")
 
         st.toast("Calculating AENEAS 2 solution...", icon="⌛")
         dict_aeneas_HP = aeneas.aeneas_opti_HP(loads=loads, cell_HE=cell_HE, cell_HP=cell_HP, V_bus=V_bus, cycles=cycles if bool_aging else [0]*len(loads), limit=limit, dict_initial=dict_aeneas)
+        if failed(dict_aeneas_HP):
+            st.error(f"AENEAS 2 optimization failed ({dict_aeneas_HP['return_status']}), largest constraint violations: {dict_aeneas_HP['infeasibilities']}")
+            st.stop()
         st.toast(f"[{dict_aeneas['time']/1000:,.2f}s] AENEAS 2 solution found!", icon="✅")
 
         # st.toast("Calculating rule-based hybrid solution...", icon="⌛")
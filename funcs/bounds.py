@@ -0,0 +1,96 @@
+import numpy as np
+import itertools
+
+from funcs import ocv
+
+"""
+Lower bound on the cost of a hybrid pack, to skip the configurations that cannot beat the best one solved so far (see sweep.sweep)
+
+    Lower bound: every sizing NLP keeps the SOC of both packs in [0.1, 0.9] from SOC_0 = 0.9 and the current of a pack (with its Joule losses) below
+    N*dis_current, with V = M*OCV(SOC). With x = M*N cells and the OCV at its maximum (the Joule losses left out), a pack delivers at most
+    x*dis_current*OCV_max (W) and at most 0.8*x*energy (kWh, times the aging factor at its best) from its initial SOC. The two packs together must
+    cover the peak power and the largest energy drawn from the start of every load, a linear program in (x_HE, x_HP) solved at the vertices of
+    its feasible set. Its optimum is below the cost of every feasible sizing
+"""
+
+maxima = {}     # OCV table (OCV_SOC, OCV) -> highest OCV of its interpolant
+
+
+def power(cell):
+    '''
+    Maximum discharge power of one cell (W): maximum current at the highest OCV, over the SOC window of the NLPs and the OCV table
+    '''
+    key = (tuple(cell.OCV_SOC), tuple(cell.OCV))
+    if key not in maxima:
+        SOC = np.linspace(0.1, 0.9, 801)
+        maxima[key] = max(np.max(ocv.lookup(cell)(SOC).full()), np.max(cell.OCV)) # The bspline of the NLPs can overshoot the table
+
+    return cell.dis_current * maxima[key]
+
+
+def energy(cell, cycles, aging=True):
+    '''
+    Maximum energy one cell delivers from SOC 0.9 to 0.1 (J), at EOL after cycles if aging
+    The number of cycles to EOL is a sum of exponentials of the DOD, convex, so its maximum over DOD in [0, 100] is at one end
+    '''
+    E = 0.8 * cell.energy * 3.6e6
+    if not aging:
+        return E
+
+    N_cycles = max(cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) for DOD in (0, 100))
+    return E * max(1 - 0.2 * (cycles/N_cycles), 0)
+
+
+def requirements(P, t):
+    '''
+    Peak power (W) and largest energy drawn from the start of the load (J), with the time steps of the NLPs (dt of the sample)
+    '''
+    dt = np.diff(np.append(t, t[-1] + (t[-1] - t[-2]))) # s
+    return max(np.max(P), 0), max(np.max(np.cumsum(P * dt)), 0)
+
+
+def linear(c, A, r):
+    '''
+    Minimum of c @ x over x >= 0 (2 variables) with A @ x >= r, from the vertices of the feasible set, inf if it is empty
+    '''
+    candidates = [np.zeros(2)]
+    for k in range(2):     # On the axes
+        a = A[:, k]
+        if np.all((a > 0) | (r <= 0)):
+            x = np.zeros(2)
+            x[k] = np.max(np.divide(r, a, out=np.zeros_like(r), where=a > 0), initial=0)
+            candidates.append(x)
+    for i, j in itertools.combinations(range(len(r)), 2):   # At the intersections of two constraints
+        A_ij = A[[i, j]]
+        if abs(np.linalg.det(A_ij)) > 1e-12 * np.abs(A_ij).max()**2:
+            candidates.append(np.linalg.solve(A_ij, r[[i, j]]))
+
+    costs = [c @ x for x in candidates if np.all(x >= 0) and np.all(A @ x >= r * (1 - 1e-9))]
+    return min(costs, default=np.inf)
+
+
+def lower(loads, cell_HE, cell_HP, cycles, limit=None, aging=True):
+    '''
+    Lower bound on the cost (€) of the HE and HP packs sized for all loads (see the module docstring), cycles: number of cycles of every load
+
+    limit: power treshold (W) of a fixed split (aeneas, aeneas_opti), the packs then cover their own share of the loads
+    aging: the aged energy of the packs is sized for the cycles (all methods except the aeneas NLPs, which size at BOL)
+    '''
+    p = np.array([power(cell_HE), power(cell_HP)])
+    A, r = [], []
+    for load, N in zip(loads, cycles):
+        P = load["P"].values # W
+        t = load["t"].values # s
+        q = np.array([energy(cell_HE, N, aging), energy(cell_HP, N, aging)])
+        if limit == None:
+            P_max, E_max = requirements(P, t)
+            A += [p, q]
+            r += [P_max, E_max]
+        else:
+            P_HE = np.minimum(P, limit)
+            (P_HE_max, E_HE_max), (P_HP_max, E_HP_max) = requirements(P_HE, t), requirements(P - P_HE, t)
+            A += [[p[0], 0], [q[0], 0], [0, p[1]], [0, q[1]]]
+            r += [P_HE_max, E_HE_max, P_HP_max, E_HP_max]
+
+    return linear(np.array([cell_HE.cost, cell_HP.cost]), np.array(A, dtype=float), np.array(r, dtype=float))
+
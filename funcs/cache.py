@@ -0,0 +1,226 @@
+import numpy as np
+import pandas as pd
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
+import types
+
+from funcs.result import Result, failed
+
+"""
+On-disk cache of the results of the sizing methods
+
+    A result is stored under a hash of the inputs of the call: method, loads (bytes of the DataFrames), cells (fields of BatteryCell), V_bus, cycles,
+    options (initial guesses included) and the source code of the method module and of the modules of the repository it imports, so editing a method
+    or a function it uses gives a new entry while editing main.py or the plots does not
+    An entry is two files: <key>.npy holds the trajectories of the Result (one row per trajectory, see result.Result) and is loaded memory-mapped,
+    <key>.pkl holds everything else. The least recently used entries are removed when the cache grows above SIZE. Failed solves are not stored
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))    # Repository, its modules are part of the code version
+CACHE = os.path.join(ROOT, ".cache", "results")  # Directory of the cached results, read at every call
+SIZE = 2**30    # Maximum size of the cache on disk (bytes)
+
+stats = {"hits": 0, "misses": 0, "time_load": 0.0, "time_saved": 0.0}
+versions = {}   # Module name -> hash of the sources it depends on
+
+
+def version(module):
+    '''
+    Hash of the source files of module and of every module of the repository it imports, directly (import) or through a name (from ... import)
+    '''
+    if module.__name__ in versions:
+        return versions[module.__name__]
+
+    files = {}
+    stack = [module]
+    while stack:
+        module_i = stack.pop()
+        path = getattr(module_i, "__file__", None)
+        if path == None or not os.path.abspath(path).startswith(ROOT + os.sep) or "site-packages" in path or path in files:
+            continue
+        with open(path, "rb") as file:
+            files[path] = file.read()
+        for value in vars(module_i).values():
+            if isinstance(value, types.ModuleType):
+                stack.append(value)
+            elif isinstance(value, (types.FunctionType, type)) and value.__module__ in sys.modules:
+                stack.append(sys.modules[value.__module__])
+
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        digest.update(os.path.relpath(path, ROOT).encode() + files[path])
+    versions[module.__name__] = digest.hexdigest()
+    return versions[module.__name__]
+
+
+def update(digest, value):
+    '''
+    Add value to the hash digest: arrays by their bytes, DataFrames by their content, results and dicts by their items, cells by their fields,
+    functions by their name
+    '''
+    if isinstance(value, np.ndarray):
+        digest.update(f"array{value.dtype}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, pd.DataFrame):
+        digest.update(f"frame{list(value.columns)}".encode())
+        digest.update(pd.util.hash_pandas_object(value).values.tobytes())
+    elif isinstance(value, (dict, Result)):
+        digest.update(f"dict{len(value)}".encode())
+        for key in sorted(value, key=str):
+            update(digest, key)
+            update(digest, value[key])
+    elif isinstance(value, tuple) and hasattr(value, "_fields"):   # NamedTuple (BatteryCell)
+        digest.update(f"{type(value).__name__}{value._fields}".encode())
+        for item in value:
+            update(digest, item)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            update(digest, item)
+    elif isinstance(value, (types.FunctionType, type)):  # By name, the repr holds its address
+        digest.update(f"function:{value.__module__}.{value.__qualname__}".encode())
+    else:
+        digest.update(f"{type(value).__name__}:{value!r}".encode())
+
+
+def key(function, args, kwargs):
+    '''
+    Name of the entry of a call: hash of the method, its arguments and the version of its code
+    '''
+    digest = hashlib.sha256(f"{function.__module__}.{function.__qualname__}|{version(sys.modules[function.__module__])}".encode())
+    update(digest, list(args))
+    update(digest, kwargs)
+
+    return f"{function.__name__}_{digest.hexdigest()[:24]}"
+
+
+def load(name, directory=None):
+    '''
+    Cached result name, memory-mapped, None if it is not in the cache
+    '''
+    directory = CACHE if directory == None else directory
+    path = os.path.join(directory, name)
+    try:
+        with open(f"{path}.pkl", "rb") as file:
+            index = pickle.load(file)
+        data = np.load(f"{path}.npy", mmap_mode="r")
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+
+    os.utime(f"{path}.pkl")     # Most recently used
+    return Result.restore(index, data)
+
+
+def save(name, result, directory=None):
+    '''
+    Store result as name, the .pkl file is written last so a partly written entry is never loaded
+    '''
+    directory = CACHE if directory == None else directory
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    try:
+        index = pickle.dumps(result.index, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as error:
+        print(f"[WARNING] Result of {name} not cached ({error})")
+        return
+
+    with tempfile.TemporaryDirectory(dir=directory) as build:
+        np.save(os.path.join(build, "data.npy"), np.asarray(result.data))
+        with open(os.path.join(build, "index.pkl"), "wb") as file:
+            file.write(index)
+        os.replace(os.path.join(build, "data.npy"), f"{path}.npy")
+        os.replace(os.path.join(build, "index.pkl"), f"{path}.pkl")
+
+    evict(directory=directory)
+
+
+def entries(directory=None):
+    '''
+    Entries in the cache: list of (last use, size in bytes, name), least recently used first
+    '''
+    directory = CACHE if directory == None else directory
+    if not os.path.isdir(directory):
+        return []
+
+    found = []
+    for file in os.listdir(directory):
+        if file.endswith(".pkl"):
+            name = file[:-4]
+            path = os.path.join(directory, name)
+            try:
+                found.append((os.path.getmtime(f"{path}.pkl"), os.path.getsize(f"{path}.pkl") + os.path.getsize(f"{path}.npy"), name))
+            except OSError:
+                continue
+
+    return sorted(found)
+
+
+def evict(size=None, directory=None):
+    '''
+    Remove the least recently used entries until the cache holds at most size bytes (default SIZE)
+    '''
+    size = SIZE if size == None else size
+    directory = CACHE if directory == None else directory
+    found = entries(directory)
+    total = sum(nbytes for _, nbytes, _ in found)
+    for _, nbytes, name in found:
+        if total <= size:
+            break
+        for extension in (".pkl", ".npy"):  # .pkl first, an entry without it is not loaded
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except OSError:
+                pass
+        total -= nbytes
+
+
+def call(function, *args, **kwargs):
+    '''
+    function(*args, **kwargs) with its result cached on disk (see the module docstring)
+    '''
+    start_time = time.time()
+    name = key(function, args, kwargs)
+    result = load(name)
+    if result != None:
+        stats["hits"] += 1
+        stats["time_load"] += (time.time() - start_time)*1000
+        stats["time_saved"] += result.get("time", 0)
+        print(f"Cached {name} [{(time.time() - start_time)*1000:0.2f} ms]")
+        return result
+
+    stats["misses"] += 1
+    result = function(*args, **kwargs)
+    if isinstance(result, Result) and not failed(result):
+        save(name, result)
+
+    return result
+
+
+def cached(function):
+    '''
+    function with its results cached on disk, e.g. optimal_aging = cache.cached(optimal.optimal_aging)
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return call(function, *args, **kwargs)
+
+    return wrapper
+
+
+def report(directory=None):
+    '''
+    Cache statistics: hits, misses, load time and solve time saved by the hits (ms), number of entries and size on disk (bytes)
+    '''
+    directory = CACHE if directory == None else directory
+    found = entries(directory)
+    return {**stats, "entries": len(found), "bytes": sum(nbytes for _, nbytes, _ in found)}
+
+
+def clear(directory=None):
+    evict(0, directory)
+    stats.update({"hits": 0, "misses": 0, "time_load": 0.0, "time_saved": 0.0})
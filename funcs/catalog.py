@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+from typing import List
+import json
+import os
+import time
+from scipy.integrate import cumulative_trapezoid
+
+from funcs import simulation
+
+"""
+Catalog of battery cells
+
+    The cells are read from a JSON file (cells/catalog.json, one entry per cell name with the fields of BatteryCell). The catalog keeps the derived
+    properties of all cells as arrays (one value per cell), so many cells are compared at once
+    Screening of HE x HP pairs: for a power treshold, the rule-based sizing (see treshold.sweep) of each pack only depends on its own cell, so every cell is
+    sized once as HE and once as HP on a grid of tresholds and the cost of every pair is the sum of two cost curves. n cells need 2n sizings, not n^2
+"""
+
+CATALOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cells", "catalog.json")
+
+COLUMNS = ["HE", "HP", "cost", "cost_BOL", "limit", "M_HE", "N_HE", "M_HP", "N_HP", "E_HE", "E_HP", "weight"]
+
+
+## -- Class definition
+class BatteryCell(NamedTuple):  # Class for defining battery cells
+    capacity:   float   # Rated capacity (Ah)
+    voltage:    float   # Nominal voltage (V)
+    dis_rate:   float   # Maximum discharge rate (A/Ah)
+    chg_rate:   float   # Maximum charge rate (A/Ah)
+    resistance: float   # Internal resistance (Ohm)
+    weight:     float   # Cell weight (kg)
+    cost_spec:  float   # Specific cost (€/kWh)
+    OCV: List[float]        # Open-circuit voltage (V)
+    OCV_SOC: List[float]    # State of Charge (0-1)
+    aging: List[float]      # fitting parameters for aging model (a, b, c, d)
+
+    @property
+    def energy(self):       # Energy Capacity (kWh)
+        return self.capacity * self.voltage / 1000
+
+    @property
+    def cost(self):         # Cost per cell (€)
+        return self.energy * self.cost_spec
+
+    @property
+    def dis_current(self):  # Maximum discharge current (A)
+        return self.dis_rate * self.capacity
+
+    @property
+    def chg_current(self):  # Maximum charge current (A)
+        return self.chg_rate * self.capacity
+
+
+class Catalog(NamedTuple):  # Cells of a catalog and their properties, one value per cell
+    names: List[str]
+    cells: List[BatteryCell]
+    description: List[str]
+    voltage:     np.ndarray  # Nominal voltage (V)
+    weight:      np.ndarray  # Cell weight (kg)
+    energy:      np.ndarray  # Energy Capacity (kWh)
+    cost:        np.ndarray  # Cost per cell (€)
+    dis_current: np.ndarray  # Maximum discharge current (A)
+    chg_current: np.ndarray  # Maximum charge current (A)
+
+    def cell(self, name):
+        return self.cells[self.names.index(name)]
+
+    def dict(self):         # name -> BatteryCell, e.g. the cells of sweep.sweep
+        return dict(zip(self.names, self.cells))
+
+
+def catalog(cells, description=None):
+    '''
+    Catalog of cells (dict name -> BatteryCell), description: dict name -> description of the cell
+    '''
+    names = list(cells)
+    cells = list(cells.values())
+    description = [(description or {}).get(name, "") for name in names]
+
+    return Catalog(names, cells, description, *(np.array([getattr(cell, key) for cell in cells], dtype=float)
+                                                 for key in ["voltage", "weight", "energy", "cost", "dis_current", "chg_current"]))
+
+
+def load(path=CATALOG):
+    '''
+    Catalog of the cells in the JSON file path
+    '''
+    with open(path) as file:
+        entries = json.load(file)
+
+    cells = {name: BatteryCell(**{key: entry[key] for key in BatteryCell._fields}) for name, entry in entries.items()}
+    return catalog(cells, {name: entry.get("description", "") for name, entry in entries.items()})
+
+
+def curves(P, t_soc, catalog, index, V_bus, cycles, tol):
+    '''
+    Rule-based sizing of one pack (P, tresholds x samples) for the cells index of the catalog, returns M (cells), N at BOL and the factor of the energy
+    added for aging (see treshold.treshold), both cells x tresholds
+    '''
+    t = t_soc[:-1]
+    E_req = np.max(cumulative_trapezoid(P/1000, t/3600, initial=0, axis=-1), axis=-1)/0.8 # kWh
+
+    M = V_bus / catalog.voltage[index]
+    N = np.empty((len(index), len(P)))
+    factor = np.empty((len(index), len(P)))
+    for k, i in enumerate(index):
+        cell = catalog.cells[i]
+        N[k], sim = simulation.size_strings(P, t_soc, cell, M[k], E_req / (M[k] * cell.energy), tol=tol)
+
+        DOD = 100*(np.max(sim["SOC"], axis=-1) - np.min(sim["SOC"], axis=-1))   # Depth of Discharge [0-100]
+        N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD)
+        factor[k] = 1 + 0.2 * (cycles/N_cycles)    # Energy lost due to degradation at EOL is added to the pack
+
+    return M, N, factor
+
+
+def screen(loads, catalog, V_bus, cycles, HE=None, HP=None, points=51, tol=1e-2, top=None):
+    '''
+    Rule-based sizing (see treshold.treshold) of every HE x HP pair of cells of the catalog on a load, ranked by cost
+
+    HE, HP: names of the candidate cells of each pack (default: all cells), points: number of power tresholds between 0 and the peak power
+    Every pair takes the treshold of its cheapest sizing at BOL, then its packs get the energy lost to aging, as in treshold.treshold
+    Returns a DataFrame with one row per pair (the top ones if given), sorted by cost (€), with the treshold (W), sizes and weight (kg) of the packs
+    The best pairs can then be sized with the optimal methods, e.g. sweep.grid(methods, zip(pairs["HE"], pairs["HP"]), ...)
+    '''
+    start_time = time.time()
+
+    P = loads[0]["P"].values # W
+    t = loads[0]["t"].values # s
+    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
+
+    index_HE = [catalog.names.index(name) for name in (catalog.names if HE == None else HE)]
+    index_HP = [catalog.names.index(name) for name in (catalog.names if HP == None else HP)]
+
+    limit = np.linspace(0, np.max(P), points)
+    P_HE, P_HP = simulation.split(P, limit[:, None])
+
+    M_HE, N_HE, factor_HE = curves(P_HE, t_soc, catalog, index_HE, V_bus, cycles[0], tol)
+    M_HP, N_HP, factor_HP = curves(P_HP, t_soc, catalog, index_HP, V_bus, cycles[0], tol)
+    cost_HE = M_HE[:, None]*N_HE*catalog.cost[index_HE, None]  # Cost curves (cells x tresholds)
+    cost_HP = M_HP[:, None]*N_HP*catalog.cost[index_HP, None]
+
+    # Cheapest treshold of every pair (HE x HP x tresholds)
+    index = np.argmin(cost_HE[:, None, :] + cost_HP[None, :, :], axis=-1)
+    i, j = np.meshgrid(np.arange(len(index_HE)), np.arange(len(index_HP)), indexing="ij")
+
+    cost_BOL = cost_HE[i, index] + cost_HP[j, index]
+    N_HE = N_HE[i, index] * factor_HE[i, index]
+    N_HP = N_HP[j, index] * factor_HP[j, index]
+    M_HE = M_HE[i]
+    M_HP = M_HP[j]
+    i, j = np.asarray(index_HE)[i], np.asarray(index_HP)[j]
+
+    pairs = pd.DataFrame({
+        "HE": np.array(catalog.names)[i].ravel(),
+        "HP": np.array(catalog.names)[j].ravel(),
+        "cost": (M_HE*N_HE*catalog.cost[i] + M_HP*N_HP*catalog.cost[j]).ravel(),
+        "cost_BOL": cost_BOL.ravel(),
+        "limit": limit[index].ravel(),
+        "M_HE": M_HE.ravel(),
+        "N_HE": N_HE.ravel(),
+        "M_HP": M_HP.ravel(),
+        "N_HP": N_HP.ravel(),
+        "E_HE": (M_HE*N_HE*catalog.energy[i]).ravel(),
+        "E_HP": (M_HP*N_HP*catalog.energy[j]).ravel(),
+        "weight": (M_HE*N_HE*catalog.weight[i] + M_HP*N_HP*catalog.weight[j]).ravel(),
+    }, columns=COLUMNS).sort_values("cost", ignore_index=True)
+
+    print(f"Screened {len(pairs)} pairs of cells [{(time.time() - start_time)*1000:0.2f} ms]")
+    return pairs if top == None else pairs.head(top)
@@ -0,0 +1,117 @@
+import casadi as ca
+import hashlib
+import os
+import subprocess
+import tempfile
+import time
+import weakref
+
+"""
+Compiled NLP callbacks
+
+    The Opti methods evaluate the objective, the constraints and their derivatives in the CasADi virtual machine. With compiled=True the callbacks the solver
+    needs (nlp_f, nlp_g, nlp_grad_f, nlp_jac_g, nlp_hess_l) are generated as C code and compiled into a shared object, which the solver then loads
+    The shared objects are cached on disk, named after a hash of the C code of the NLP, so every later solve of the same NLP (multi-start, a template with
+    new parameter values, a new run) loads them instead of compiling again. Values set with opti.set_value are parameters and share the shared object,
+    the profile, cells and sizes written as numbers in the formulation are part of the NLP and give a new one
+"""
+
+CACHE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "codegen") # Directory of the compiled NLPs
+COMPILER = os.environ.get("CC", "gcc")
+FLAGS = ["-O1", "-fPIC", "-shared"]     # -O0 compiles about 8 times faster, the callbacks are then about 2 times slower
+
+stats = {"hits": 0, "misses": 0, "time_compile": 0.0}
+keys = weakref.WeakKeyDictionary()    # Opti -> (size of its NLP, plugin, key), an Opti solved again (template, multi-start) is not hashed again
+
+
+def key(opti, plugin):
+    '''
+    Name of the shared object of the NLP of opti: hash of the C code of the NLP, solver plugin, compiler flags and CasADi version
+    The serialized NLP would be cheaper to hash but it changes with the derivatives CasADi caches in the functions it calls (the OCV interpolants),
+    so the key is generated once per Opti instead and kept while its number of variables, constraints and parameters is the same
+    '''
+    size = (opti.nx, opti.ng, opti.np)
+    if opti in keys and keys[opti][:2] == (size, plugin):
+        return keys[opti][2]
+
+    code = ca.CodeGenerator("nlp")
+    code.add(ca.Function("nlp", [opti.x, opti.p], [opti.f, opti.g]).expand())
+    digest = hashlib.sha256("|".join([code.dump(), plugin, " ".join(FLAGS), ca.__version__]).encode())
+    keys[opti] = (size, plugin, f"nlp_{digest.hexdigest()[:20]}")
+
+    return keys[opti][2]
+
+
+def library(opti, plugin, directory=CACHE):
+    '''
+    Path of the shared object with the callbacks of the NLP of opti, generated and compiled if it is not in the cache
+    '''
+    name = key(opti, plugin)
+    path = os.path.join(directory, f"{name}.so")
+    if os.path.exists(path):
+        stats["hits"] += 1
+    else:
+        start_compile = time.time()
+        os.makedirs(directory, exist_ok=True)
+        nlp = {"x": opti.x, "p": opti.p, "f": opti.f, "g": opti.g}
+        generator = ca.nlpsol(name, plugin, nlp, {"expand": True})
+        code = ca.CodeGenerator(f"{name}.c")
+        code.add(generator.oracle())    # The solver loads the NLP (nlp) and the callbacks it needs (nlp_f, nlp_jac_g, ...) from the shared object
+        for function in generator.get_function():
+            code.add(generator.get_function(function))
+        with tempfile.TemporaryDirectory(dir=directory) as build:
+            code.generate(build + os.sep)
+            subprocess.run([COMPILER, *FLAGS, os.path.join(build, f"{name}.c"), "-o", os.path.join(build, f"{name}.so")], check=True)
+            os.replace(os.path.join(build, f"{name}.so"), path) # Atomic, a worker solving the same NLP never loads a partial file
+        stats["misses"] += 1
+        stats["time_compile"] += (time.time() - start_compile)*1000
+        print(f"Compiled {name} [{(time.time() - start_compile)*1000:0.2f} ms]")
+
+    return path
+
+
+class Solution:
+    '''
+    Solution of a compiled solve, with the value and stats methods of the OptiSol of opti.solve()
+    '''
+    def __init__(self, opti, solution, stats):
+        self.opti = opti
+        self.values = [symbol == value for symbol, value in zip(opti.x.primitives(), opti.x.split_primitives(solution["x"]))] \
+                    + [symbol == value for symbol, value in zip(opti.lam_g.primitives(), opti.lam_g.split_primitives(solution["lam_g"]))]
+        self.solver_stats = stats
+
+    def value(self, expression):
+        return self.opti.value(expression, self.values)
+
+    def stats(self):
+        return self.solver_stats
+
+
+def load(opti, plugin="ipopt", options={}, directory=CACHE):
+    '''
+    Solver of the NLP of opti with the compiled callbacks (see library), options: solver options as for opti.solver, expand is implied
+    A template solved for many parameter values keeps its solver and passes it to solve, which saves hashing the NLP at every solve
+    '''
+    return ca.nlpsol("solver", plugin, library(opti, plugin, directory), {key: value for key, value in options.items() if key != "expand"})
+
+
+def solve(opti, plugin="ipopt", options={}, solver=None, directory=CACHE):
+    '''
+    Solve opti with the compiled callbacks, with the solver of load if not given. Falls back on opti.solve() if the compiled solve fails, so a failure
+    has the usual opti.debug
+    '''
+    if solver == None:
+        solver = load(opti, plugin, options, directory)
+    solution = solver(
+        x0=opti.value(opti.x, opti.initial()),
+        p=opti.value(opti.p) if opti.np > 0 else ca.DM(0, 1),
+        lbg=opti.value(opti.lbg),
+        ubg=opti.value(opti.ubg),
+        lam_g0=opti.value(opti.lam_g, opti.initial()),
+    )
+    if solver.stats()["success"]:
+        return Solution(opti, solution, solver.stats())
+
+    print(f"[WARNING] Compiled solve failed ({solver.stats()['return_status']}), solving with the Opti solver")
+    opti.solver(plugin, options)
+    return opti.solve()
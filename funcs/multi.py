@@ -0,0 +1,101 @@
+import numpy as np
+import casadi as ca
+import os
+
+from funcs import simulation
+
+"""
+Multi-profile sizing NLPs
+
+    A pack sized for several mission profiles at once has one size (N) and, per profile, its own SOC trajectories, depth of discharge and aged energy
+    (every profile has its own number of cycles). The profiles are padded to the same length (see simulation.stack) and stored as the columns of matrix
+    decision variables, the constraints of one profile are one CasADi Function that is mapped over the columns, so the NLP is built once for all profiles
+"""
+
+PARALLELIZATION = "serial"      # Evaluation of the mapped profiles, "thread" or "openmp" evaluates them in parallel (the NLP is then not expanded to SX)
+THREADS = os.cpu_count()        # Threads of the "thread" evaluation
+
+
+def pack(cell, n, SOC_0=0.9):
+    '''
+    Constraints of one pack of cell on one profile of n samples, as a CasADi Function to map over the profiles
+
+    Inputs: P, dt (n, the power (W) of the pack and the time steps (s)), SOC, SOC_aged (n, SOC after every sample, the SOC before the first one is SOC_0),
+    SOC_used (SOC after the last sample counted in the DOD, see used), N, M (strings in parallel, cells in series), E_aged (kWh), DOD [0-100] and cycles
+    The DOD follows from the SOC (see simulation.used), a sum of P*dt would be a dense Jacobian row that CasADi differentiates in a time quadratic in n
+    Outputs: equality residuals (SOC dynamics at BOL and EOL, aged energy, DOD), current margins (<= 0, BOL and EOL), V, I and P_joule at BOL and EOL
+    '''
+    P = ca.MX.sym("P", n)
+    dt = ca.MX.sym("dt", n)
+    SOC = ca.MX.sym("SOC", n)
+    SOC_aged = ca.MX.sym("SOC_aged", n)
+    SOC_used = ca.MX.sym("SOC_used")
+    N, M, E_aged, DOD, cycles = ca.MX.sym("N"), ca.MX.sym("M"), ca.MX.sym("E_aged"), ca.MX.sym("DOD"), ca.MX.sym("cycles")
+
+    E = M*N*cell.energy # kWh
+    SOC_full = ca.vertcat(SOC_0, SOC)
+    SOC_aged_full = ca.vertcat(SOC_0, SOC_aged)
+    sim = simulation.outputs(P, SOC_full, cell, M)
+    sim_aged = simulation.outputs(P, SOC_aged_full, cell, M)
+    N_cycles = cell.aging[0]*ca.exp(cell.aging[1]*DOD) + cell.aging[2]*ca.exp(cell.aging[3]*DOD) # Number of cycles before the pack has lost 20% of its energy
+
+    equality = ca.vertcat(
+        SOC - ca.if_else(N == 0, SOC_full[:-1], SOC_full[:-1] - (P*dt)/(E*3.6e6)),
+        SOC_aged - (SOC_aged_full[:-1] - (P*dt)/(E_aged*3.6e6)),
+        E_aged - E * (1 - 0.2 * (cycles/N_cycles)),
+        DOD - (SOC_0 - SOC_used)*100,
+    )
+    margin = ca.vertcat(sim["I"] + sim["I_joule"] - cell.dis_current*N, sim_aged["I"] + sim_aged["I_joule"] - cell.dis_current*N)
+
+    return ca.Function("pack", [P, dt, SOC, SOC_aged, SOC_used, N, M, E_aged, DOD, cycles],
+                       [equality, margin, sim["V"], sim["I"], sim["P_joule"], sim_aged["V"], sim_aged["I"], sim_aged["P_joule"]])
+
+
+def single(loads, method):
+    '''
+    Raise a ValueError if method, which sizes the packs for one load, is given several loads (it would silently size them for the first one only)
+    '''
+    if len(loads) > 1:
+        raise ValueError(f"{method} sizes the packs for a single load, got {len(loads)} loads (optimal_aging and monotype2 size several loads together)")
+
+
+def mapped(function, K):
+    '''
+    function mapped over K profiles with the parallelization set by PARALLELIZATION
+    '''
+    if PARALLELIZATION == "thread":
+        return function.map(K, "thread", THREADS)
+    return function.map(K, PARALLELIZATION)
+
+
+def expand():
+    '''
+    Solver option expand: expanding the NLP to SX speeds up serial evaluations but removes the parallel map
+    '''
+    return PARALLELIZATION == "serial"
+
+
+def used(SOC, lengths, used_last=True, SOC_0=0.9):
+    '''
+    SOC (1 x profiles) after the last sample of every profile counted in the used energy, from the SOC after every sample (samples x profiles)
+    The last sample of a profile is left out if not used_last, like the single-profile methods that integrate the used energy up to the last sample
+    '''
+    rows = lengths - (1 if used_last else 2)
+
+    return ca.horzcat(*[SOC[row, k] if row >= 0 else ca.DM(SOC_0) for k, row in enumerate(rows)])
+
+
+def trim(values, lengths, extra=0):
+    '''
+    Split matrix values (samples x profiles) into one array per profile without the padding, extra: samples beyond the length (1 for SOC)
+    '''
+    values = np.reshape(values, (-1, len(lengths)))
+
+    return [values[:n+extra, k] for k, n in enumerate(lengths)]
+
+
+def pad(arrays, n, extra=0, mode="edge"):
+    '''
+    Stack one array per profile into a matrix (samples x profiles) of n+extra rows, padded with their last value (mode="edge", for SOC) or with zeros (mode="constant", for powers)
+    '''
+    return np.column_stack([np.pad(np.asarray(a, dtype=float), (0, n + extra - len(a)), mode=mode) for a in arrays])
@@ -0,0 +1,103 @@
+import numpy as np
+import functools
+import multiprocessing
+import time
+
+from funcs import resolution
+from funcs.result import failed
+from methods import monotype, treshold
+
+"""
+Multi-start solution of the Opti methods
+
+    The sizing NLPs are nonconvex (OCV lookup, aging exponentials, if_else on N == 0), so the optimum IPOPT reaches depends on the initial guess and a bad
+    one makes the solve fail. The method is solved from several starts in a process pool: the rule-based sizing, the two monotype sizings and random
+    perturbations of the rule-based sizing. The best result is kept, the remaining solves are cancelled once a result is close enough to the lower bound
+    of the cost or, without a bound, once the best cost has been found by several starts
+"""
+
+
+def starts(loads, cell_HE, cell_HP, V_bus, cycles, n=4, seed=0, sigma=0.3):
+    '''
+    n initial guesses (dict name -> initial guess) on the first load: rule-based, HE and HP monotype and n-3 perturbed rule-based starts
+
+    The monotype starts size both packs to carry the whole load on their own and give all the power to one of them, so they are feasible.
+    The perturbed starts scale the sizes and the HE power of every sample of the rule-based start by lognormal factors of deviation sigma, seeded by seed
+    All starts are simulated on the time grid of the load, so their trajectories satisfy the dynamics of the NLP
+    '''
+    load = loads[0]
+    rule = treshold.treshold(loads, cell_HE, cell_HP, V_bus, cycles)
+    mono_HE = monotype.monotype(loads, cell_HE, V_bus, cycles)
+    mono_HP = monotype.monotype(loads, cell_HP, V_bus, cycles)
+
+    def start(P_HE, N_HE, N_HP, E_HE_aged, E_HP_aged):
+        guess = {key: rule[key] for key in ("t", "t_soc", "P", "M_HE", "M_HP")}
+        guess.update({"P_HE": P_HE, "N_HE": N_HE, "N_HP": N_HP, "E_HE_aged": E_HE_aged, "E_HP_aged": E_HP_aged})
+        return resolution.refine(guess, load, cell_HE, cell_HP)
+
+    P = rule["P"] # W
+    dict_starts = {
+        "rule-based": start(rule["P_HE"], rule["N_HE"], rule["N_HP"], rule["E_HE_aged"], rule["E_HP_aged"]),
+        "monotype HE": start(P, mono_HE["N"], mono_HP["N"], mono_HE["E_aged"], mono_HP["E_aged"]),
+        "monotype HP": start(np.zeros(len(P)), mono_HE["N"], mono_HP["N"], mono_HE["E_aged"], mono_HP["E_aged"]),
+    }
+
+    rng = np.random.default_rng(seed)
+    for i in range(n - len(dict_starts)):
+        scale_HE, scale_HP = rng.lognormal(0, sigma, 2)
+        P_HE = rule["P_HE"] * rng.lognormal(0, sigma, len(P)) # W, clipped to [0, P] by refine
+        dict_starts[f"perturbed {i+1}"] = start(P_HE, scale_HE*rule["N_HE"], scale_HP*rule["N_HP"], scale_HE*rule["E_HE_aged"], scale_HP*rule["E_HP_aged"])
+
+    return dict(list(dict_starts.items())[:n])
+
+
+def run(method, loads, cell_HE, cell_HP, args, kwargs, start):
+    '''
+    Solve from start (name, initial guess) in a worker process, returns the name and the result, None if the solve fails or raises
+    '''
+    name, dict_initial = start
+    try:
+        result = method(loads, cell_HE, cell_HP, *args, dict_initial=dict_initial, **kwargs)
+    except Exception as error:
+        print(f"[WARNING] Start {name} failed: {error!r}")
+        return name, None
+    return name, None if failed(result) else result
+
+
+def solve(method, loads, cell_HE, cell_HP, V_bus, cycles, *args, n=4, seed=0, workers=None, bound=None, gap=1e-3, confirm=2, **kwargs):
+    '''
+    Solve method (e.g. optimal.optimal_aging) from n starts (see starts) in a pool of workers processes (default: one per CPU)
+
+    The solves are stopped as soon as the best cost is within a relative gap of bound (a lower bound of the cost) or, without a bound,
+    as soon as confirm starts have reached the best cost within gap. The result is the best one, with the name of its start, the costs of
+    all finished starts and the total time; None if every start failed
+    '''
+    start_time = time.time()
+    dict_starts = starts(loads, cell_HE, cell_HP, V_bus, cycles, n=n, seed=seed)
+
+    best = None
+    costs = {}
+    # Leaving the pool terminates its workers, so the starts still running or queued are stopped after a break or an exception
+    with multiprocessing.Pool(workers) as pool:
+        task = functools.partial(run, method, loads, cell_HE, cell_HP, (V_bus, cycles, *args), kwargs)
+        for name, result in pool.imap_unordered(task, dict_starts.items()):
+            costs[name] = result["cost"] if result != None else np.nan
+            if result != None and (best == None or result["cost"] < best["cost"]):
+                best = result
+                best["start"] = name
+            print(f"Start {name}: " + (f"cost € {result['cost']:,.2f}" if result != None else "failed"))
+
+            if best == None:
+                continue
+            if bound != None:
+                converged = best["cost"] - bound <= gap * abs(best["cost"])
+            else:
+                converged = np.sum(np.array(list(costs.values())) <= best["cost"] * (1 + gap)) >= confirm
+            if converged and len(costs) < len(dict_starts):
+                print(f"Target gap reached, cancelling {len(dict_starts) - len(costs)} starts")
+                break
+
+    if best != None:
+        best["costs"] = costs
+        best["time"] = (time.time() - start_time)*1000
+    return best
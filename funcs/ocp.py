@@ -0,0 +1,64 @@
+import casadi as ca
+import numpy as np
+
+"""
+Stage-structured optimal control problems
+
+    The sizing problems are a SOC recursion over the samples of the profile plus a few global sizes (N, E_aged, DOD). Written as an OCP, with the global sizes
+    as states that are copied from stage to stage, every constraint only couples stage k and k+1, so the KKT system is block-banded and a structure-exploiting
+    solver (fatrop) factorizes it in a time linear in the length of the profile
+    Fatrop detects the stages from the order of the decision variables (x_0, u_0, x_1, u_1, ..., x_n) and of the constraints, so both have to be created stage by stage
+"""
+
+ACCEPTABLE = 2   # fatrop return flag of a solution within the acceptable tolerance, CasADi reports it as a failure
+TOL_ACCEPTABLE = 1e-4   # Without scaling, the dual infeasibility of fatrop can stall above its tolerance once the optimum is reached
+
+SOLVER = "fatrop" if ca.has_nlpsol("fatrop") else "ipopt"  # Default solver, fatrop is not in every CasADi build
+
+
+def stages(opti, n, nx, nu):
+    '''
+    Decision variables of an OCP with n stages, in stage order: returns the states (n+1 columns of size nx) and controls (n columns of size nu) as lists
+    '''
+    X = []
+    U = []
+    for k in range(n+1):
+        X.append(opti.variable(nx))
+        if k < n:
+            U.append(opti.variable(nu))
+
+    return X, U
+
+
+def solve(opti, solver=SOLVER, max_iter=3000, print_level=0):
+    '''
+    Solve with fatrop if requested and available, with IPOPT otherwise or if fatrop fails; returns the solution and the solver used
+
+    fatrop does not stop on NaN evaluations like IPOPT does, so a problem that is not finite at the initial guess goes to IPOPT directly
+    '''
+    if solver == "fatrop" and ca.has_nlpsol("fatrop") and finite(opti):
+        opti.solver("fatrop", {"structure_detection": "auto", "expand": True, "debug": False, "equality": equality(opti), "fatrop": {"print_level": print_level, "max_iter": max_iter, "tol_acceptable": TOL_ACCEPTABLE, "acceptable_iter": 5}})
+        try:
+            return opti.solve(), "fatrop"
+        except RuntimeError:
+            if opti.stats()["fatrop"]["return_flag"] == ACCEPTABLE:
+                return opti.debug, "fatrop"
+            print("[WARNING] fatrop failed, solving with IPOPT")
+
+    opti.solver("ipopt", {"expand": True, "ipopt": {"print_level": print_level, "max_iter": max_iter}})
+    return opti.solve(), "ipopt"
+
+
+def equality(opti):
+    '''
+    Equality flags of the constraints: Opti only flags == constraints, the rows of a bounded constraint with equal bounds are equalities as well
+    (fatrop needs them to detect the dynamics of every stage)
+    '''
+    return list(np.ravel(opti.value(opti.lbg) == opti.value(opti.ubg)))
+
+
+def finite(opti):
+    '''
+    True if the objective and the constraints are finite at the initial guess
+    '''
+    return np.all(np.isfinite(opti.value(ca.vertcat(opti.f, opti.g), opti.initial())))
@@ -0,0 +1,84 @@
+import numpy as np
+import casadi as ca
+import time
+from typing import NamedTuple
+
+"""
+Cache of compiled open-circuit voltage models, shared by the NumPy simulation and the CasADi optimizations
+
+    Models are keyed by the OCV table of the cell (OCV_SOC, OCV), so every cell with the same table reuses the same arrays and CasADi interpolant
+"""
+
+UNIFORM_MIN_SIZE = 10000 # Arrays smaller than this use np.interp, the uniform-grid lookup only pays off on large (batched) arrays
+
+class OCVModel(NamedTuple):
+    SOC: np.ndarray         # State of Charge breakpoints [0-1], contiguous
+    OCV: np.ndarray         # Open-circuit voltage (V), contiguous
+    step: float             # Breakpoint spacing if the table is uniform, None otherwise
+    slope: np.ndarray       # OCV slope per segment (V per unit SOC)
+    LUT: ca.Function        # CasADi bspline interpolant SOC -> OCV
+    time_build: float       # Time needed to build the model (ms)
+
+cache = {}
+stats = {"hits": 0, "misses": 0, "time_build": 0.0}
+
+
+def get(cell):
+    '''
+    Compiled OCV model of a cell, built on the first call for its OCV table
+    '''
+    key = (tuple(cell.OCV_SOC), tuple(cell.OCV))
+    model = cache.get(key)
+    if model != None:
+        stats["hits"] += 1
+        return model
+
+    start_time = time.time()
+    SOC = np.ascontiguousarray(cell.OCV_SOC, dtype=float)
+    OCV = np.ascontiguousarray(cell.OCV, dtype=float)
+
+    spacing = np.diff(SOC)
+    step = spacing[0] if np.allclose(spacing, spacing[0], rtol=1e-9, atol=0) else None
+
+    LUT = ca.interpolant('LUT', 'bspline', [cell.OCV_SOC], cell.OCV)
+
+    duration = (time.time() - start_time)*1000
+    model = OCVModel(SOC, OCV, step, np.diff(OCV) / spacing, LUT, duration)
+    cache[key] = model
+    stats["misses"] += 1
+    stats["time_build"] += duration
+
+    return model
+
+
+def lookup(cell):
+    '''
+    CasADi interpolant SOC -> OCV of a cell, to be used in the Opti formulations
+    '''
+    return get(cell).LUT
+
+
+def interp(SOC, cell):
+    '''
+    Piecewise-linear OCV (V) at the given State of Charge, same result as np.interp(SOC, cell.OCV_SOC, cell.OCV)
+    '''
+    model = get(cell)
+    if model.step == None or np.size(SOC) < UNIFORM_MIN_SIZE:
+        return np.interp(SOC, model.SOC, model.OCV)
+
+    # O(1) lookup on a uniform grid: segment index from the spacing, clamped to the table like np.interp
+    u = (np.clip(SOC, model.SOC[0], model.SOC[-1]) - model.SOC[0]) / model.step
+    index = np.minimum(u.astype(np.intp), len(model.SOC) - 2)
+    return model.OCV[index] + (u - index) * model.step * model.slope[index]
+
+
+def report():
+    '''
+    Cache statistics: hits, misses, number of models and total build time (ms)
+    '''
+    return {**stats, "models": len(cache)}
+
+
+def clear():
+    cache.clear()
+    stats.update({"hits": 0, "misses": 0, "time_build": 0.0})
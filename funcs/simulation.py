@@ -0,0 +1,172 @@
+import numpy as np
+import casadi as ca
+
+from funcs import ocv
+
+"""
+Vectorized forward simulation of a battery pack for a given power profile
+
+    SOC is the cumulative sum of P*dt/E, after which the OCV lookup, current and Joule losses are evaluated on the whole trajectory at once
+"""
+
+
+def stack(loads):
+    '''
+    Stack mission profiles of different lengths into padded 2D arrays (profiles x samples)
+
+    Padded samples have P = 0 and dt = 0, so they draw no current and leave the SOC unchanged
+    Returns P (W), t (s), t_soc (s) and the number of samples of every profile
+    '''
+    lengths = np.array([len(load) for load in loads])
+    P = np.zeros((len(loads), np.max(lengths)))
+    t = np.zeros((len(loads), np.max(lengths)))
+    t_soc = np.zeros((len(loads), np.max(lengths)+1))
+
+    for i in range(len(loads)):
+        n = lengths[i]
+        P[i, :n] = loads[i]["P"].values # W
+        t[i, :n] = loads[i]["t"].values # s
+        t[i, n:] = t[i, n-1]
+        t_soc[i, :n+1] = np.append(t[i, :n], t[i, n-1] + (t[i, n-1] - t[i, n-2])) # s
+        t_soc[i, n+1:] = t_soc[i, n]
+
+    return P, t, t_soc, lengths
+
+
+def split(P, P_limit):
+    '''
+    Rule-based power split: the HE pack delivers the power up to P_limit, the HP pack delivers the rest
+    '''
+    P_HE = np.where(P > P_limit, P_limit, P)     # Power from HE battery (W)
+    P_HP = np.where(P > P_limit, P - P_limit, 0) # Power from HP battery (W)
+
+    return P_HE, P_HP
+
+
+def simulate(P, t_soc, E, cell, M, SOC_0=0.9):
+    '''
+    Simulate a pack of energy E (kWh) made of M cells in series, returns all trajectories as arrays
+
+    P can also be a 2D array (profiles x samples) with E a vector holding one pack energy per profile,
+    or a single profile with E a vector of pack energies (e.g. BOL and EOL), the trajectories are then stacked along the first axis
+    '''
+    dt = np.diff(t_soc, axis=-1) # s
+    E = np.expand_dims(np.asarray(E, dtype=float), -1) * 3.6e6 # J
+    SOC_0 = np.expand_dims(np.asarray(SOC_0, dtype=float), -1)
+
+    E_used = np.cumsum(P * dt, axis=-1) # J
+    dSOC = np.divide(E_used, E, out=np.zeros(np.broadcast_shapes(E_used.shape, E.shape)), where=E != 0)
+
+    SOC_0 = np.broadcast_to(SOC_0, dSOC.shape[:-1] + (1,))
+    SOC = np.concatenate((SOC_0, SOC_0 - dSOC), axis=-1) # State of Charge [0-1]
+    V = M * ocv.interp(SOC[..., :-1], cell) # Voltage (V)
+    I = P / V                                           # Current (A)
+    P_joule = cell.resistance * (I**2)                  # Joule losses (W)
+    I_joule = P_joule / V                               # Additional current drawn due to joule losses (A)
+
+    return {
+        "SOC": SOC,
+        "V": V,
+        "I": I,
+        "P_joule": P_joule,
+        "I_joule": I_joule,
+    }
+
+
+def expressions(P, dt, E, cell, M, SOC_0=0.9):
+    '''
+    Symbolic counterpart of simulate for the condensed Opti formulations
+
+    P (W) and E (kWh) are CasADi expressions of the decision variables and dt (s) a column vector, the trajectories are returned as expressions of them
+    '''
+    dSOC = ca.if_else(E == 0, 0, ca.cumsum(P * dt) / (E * 3.6e6))
+    SOC = ca.vertcat(SOC_0, SOC_0 - dSOC) # State of Charge [0-1]
+
+    return {"SOC": SOC, **outputs(P, SOC, cell, M)}
+
+
+def outputs(P, SOC, cell, M):
+    '''
+    Voltage, current and Joule losses as CasADi expressions of the power P (W) and the State of Charge trajectory SOC (one sample longer than P)
+    '''
+    V = M * ocv.lookup(cell)(SOC[:-1].T).T              # Voltage (V)
+    I = P / V                                           # Current (A)
+    P_joule = cell.resistance * (I**2)                  # Joule losses (W)
+    I_joule = P_joule / V                               # Additional current drawn due to joule losses (A)
+
+    return {
+        "V": V,
+        "I": I,
+        "P_joule": P_joule,
+        "I_joule": I_joule,
+    }
+
+
+def used(SOC, E):
+    '''
+    Energy (kWh) a pack of energy E (kWh) delivers over all samples but the last one, from its SOC trajectory (CasADi expressions, one sample longer than P)
+
+    Equal to the sum of P*dt over these samples once the SOC dynamics hold, but a function of two SOC samples only: the sum is a dense row of the constraint
+    Jacobian, which makes CasADi color it with one direction per sample and build the Jacobian in a time quadratic in the length of the profile
+    '''
+    return (SOC[0] - SOC[-2]) * E
+
+
+def simulate_life(P, t_soc, E, E_aged, cell, M, states=2, SOC_0=0.9):
+    '''
+    Simulate the pack at BOL (energy E), EOL (energy E_aged) and states-2 evenly spaced intermediate states of health in one pass
+
+    Row 0 of every trajectory is BOL and row -1 is EOL
+    '''
+    E_life = np.linspace(E, E_aged, states) # kWh
+
+    return simulate(P, t_soc, E_life, cell, M, SOC_0=SOC_0)
+
+
+def peak_current(sim):
+    '''
+    Peak current (A) including the Joule losses, per profile or state of health
+    '''
+    return np.max(sim["I"] + sim["I_joule"], axis=-1)
+
+
+def size_strings(P, t_soc, cell, M, N, tol=1e-3):
+    '''
+    Smallest number of parallel strings (at least N) for which the peak current, including the Joule losses, stays within N*dis_current
+
+    The peak current decreases with N, so the peak current at N gives an upper bracket; the solution is then found by bisection to a tolerance tol
+    P can also be a 2D array (profiles x samples) with N a vector, all profiles are then sized together
+    '''
+    P_2D = np.atleast_2d(P)
+    N = np.broadcast_to(np.asarray(N, dtype=float), P_2D.shape[:1])
+
+    def feasible(N, rows):
+        sim = simulate(P_2D[rows], t_soc[rows] if np.ndim(t_soc) == 2 else t_soc, M * N * cell.energy, cell, M)
+        I_max = peak_current(sim)
+        return I_max <= N*cell.dis_current, I_max
+
+    ok, I_max = feasible(N, slice(None))
+    N_low = N.copy()
+    N_high = np.where(ok, N, I_max / cell.dis_current)
+
+    # Bracket the solution
+    rows = ~ok
+    while rows.any():
+        index = np.flatnonzero(rows)
+        ok, I_max = feasible(N_high[index], index)
+        N_low[index[~ok]] = N_high[index[~ok]]
+        N_high[index[~ok]] = np.maximum(I_max[~ok] / cell.dis_current, 2*N_high[index[~ok]])
+        rows[index[ok]] = False
+
+    # Bisection, N_high is always a feasible number of strings
+    rows = N_high - N_low > tol
+    while rows.any():
+        index = np.flatnonzero(rows)
+        N_mid = (N_low[index] + N_high[index]) / 2
+        ok, _ = feasible(N_mid, index)
+        N_high[index[ok]] = N_mid[ok]
+        N_low[index[~ok]] = N_mid[~ok]
+        rows = N_high - N_low > tol
+
+    N = N_high if np.ndim(P) == 2 else N_high[0]
+    return N, simulate(P, t_soc, M * N * cell.energy, cell, M)
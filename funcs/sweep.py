@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import collections
+import contextlib
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from funcs import bounds
+from funcs.result import failed
+from methods import treshold, optimal, aeneas
+
+"""
+Parallel sweep over design scenarios
+
+    A scenario is one configuration to size: method, HE and HP cell (names in a dict of cells), bus voltage V_bus, number of cycles of every load and, for the
+    aeneas methods, the power treshold limit (W). The scenarios are solved in a pool of worker processes that receive the loads and cells once. Every worker
+    keeps the NLP templates it builds (aeneas, the bus voltage, cycles and treshold are parameters) and the compiled solvers (compiled=True, see codegen),
+    so the scenarios after the first one of a template only set new parameter values
+    Every finished scenario is appended to a CSV file, an interrupted sweep is resumed from it
+    With prune=True the scenarios are solved by increasing lower bound on their cost (see bounds) and a scenario whose lower bound is above the best cost
+    found for its method and cycles (solved scenarios only, the rule-based costs do not satisfy the constraints of the NLPs) is skipped
+"""
+
+METHODS = {
+    "treshold": treshold.treshold,
+    "treshold_opti": treshold.treshold_opti,
+    "optimal_aging": optimal.optimal_aging,
+    "optimal_aging_ocp": optimal.optimal_aging_ocp,
+    "aeneas": aeneas.aeneas,
+    "aeneas_opti": aeneas.aeneas_opti,
+    "aeneas_opti_energy": aeneas.aeneas_opti_energy,
+    "aeneas_opti_HP": aeneas.aeneas_opti_HP,
+}
+LIMIT = ("aeneas", "aeneas_opti", "aeneas_opti_energy", "aeneas_opti_HP")  # Methods with a power treshold
+SPLIT = ("aeneas", "aeneas_opti")   # Methods with the power split fixed by the treshold
+HEURISTICS = ("treshold", "aeneas") # Rule-based methods, cheaper than their bounds, never pruned
+RTOL = 1e-4     # A scenario is pruned if its lower bound is above the best cost by more than RTOL (relative), the solver tolerances are far below
+
+SCENARIO = ["method", "HE", "HP", "V_bus", "cycles", "limit"]
+OUTPUTS = ["cost", "M_HE", "N_HE", "M_HP", "N_HP", "E_HE", "E_HP", "iterations", "time"]
+COLUMNS = ["scenario", *SCENARIO, "status", *OUTPUTS]
+
+worker = {}     # Loads, cells and options of a worker process, see init
+
+
+def grid(methods, pairs, V_bus, cycles, limits=[None]):
+    '''
+    Scenarios of every combination of methods, cell pairs (HE name, HP name), V_bus (V), cycles and, for the aeneas methods, limits (W)
+    '''
+    scenarios = []
+    for method, (HE, HP), V, N in itertools.product(methods, pairs, V_bus, cycles):
+        for limit in (limits if method in LIMIT else [None]):
+            scenarios.append({"method": method, "HE": HE, "HP": HP, "V_bus": V, "cycles": N, "limit": limit})
+
+    return scenarios
+
+
+def name(scenario):
+    '''
+    Key of a scenario in the CSV file
+    '''
+    return "|".join(str(scenario[key]) for key in SCENARIO)
+
+
+def init(loads, cells, options, verbose):
+    worker.update({"loads": loads, "cells": cells, "options": options, "verbose": verbose})
+
+
+def run(scenario):
+    '''
+    Solve a scenario in a worker process, returns its row (see COLUMNS), status "error: ..." if the method raises
+    '''
+    start_time = time.time()
+    loads = worker["loads"]
+    kwargs = dict(worker["options"])
+    if scenario["method"] in LIMIT:
+        kwargs["limit"] = scenario["limit"]
+
+    row = dict.fromkeys(COLUMNS, np.nan)
+    row.update({"scenario": name(scenario), **scenario})
+    try:
+        with contextlib.nullcontext() if worker["verbose"] else contextlib.redirect_stdout(io.StringIO()):
+            result = METHODS[scenario["method"]](loads, worker["cells"][scenario["HE"]], worker["cells"][scenario["HP"]], scenario["V_bus"],
+                                                 [scenario["cycles"]]*len(loads), **kwargs)
+    except Exception as error:
+        row.update({"status": f"error: {error!r}", "time": (time.time() - start_time)*1000})
+        return row
+
+    row["status"] = "failed" if failed(result) else "solved"
+    row.update({key: result.get(key, np.nan) for key in OUTPUTS})
+    return row
+
+
+def bound(loads, cells, scenarios):
+    '''
+    Lower bound (€) of every scenario (see bounds.lower), returns the scenarios sorted by lower bound and the lower bounds by name
+    '''
+    start_bound = time.time()
+    lower = {name(scenario): bounds.lower(loads, cells[scenario["HE"]], cells[scenario["HP"]], [scenario["cycles"]]*len(loads),
+                                          limit=scenario["limit"] if scenario["method"] in SPLIT else None, aging=scenario["method"] not in LIMIT)
+             for scenario in scenarios}
+    scenarios = sorted(scenarios, key=lambda scenario: lower[name(scenario)])
+
+    print(f"Bounds: {len(scenarios)} scenarios [{(time.time() - start_bound)*1000:0.2f} ms]")
+    return scenarios, lower
+
+
+def sweep(loads, cells, scenarios, path=None, workers=None, verbose=False, prune=False, **options):
+    '''
+    Solve the scenarios (see grid) on the loads in a pool of workers processes (default: one per CPU)
+
+    cells: dict name -> BatteryCell, options: keyword arguments of every method (e.g. compiled=True), verbose: keep the prints of the methods
+    prune: skip the scenarios that cannot beat the best cost solved for their method and cycles (status "pruned: ...")
+    Every finished scenario is appended to the CSV file path, the scenarios already in it are not solved again
+    Returns a DataFrame with one row per scenario, in the order of scenarios: the scenario, its status ("solved", "failed" or the error), cost (€),
+    sizes, iterations and time (ms)
+    '''
+    start_time = time.time()
+    done = pd.read_csv(path) if path != None and os.path.exists(path) else pd.DataFrame(columns=COLUMNS)
+    names = list(dict.fromkeys(name(scenario) for scenario in scenarios))
+    todo = list({name(scenario): scenario for scenario in scenarios if name(scenario) not in set(done["scenario"])}.values())
+    print(f"Sweep: {len(names)} scenarios, {len(names) - len(todo)} in {path}")
+
+    best = {}   # (method, cycles) -> best cost (€)
+    for row in done.to_dict("records"):
+        if row["status"] == "solved":
+            best[(row["method"], row["cycles"])] = min(best.get((row["method"], row["cycles"]), np.inf), row["cost"])
+    if prune:
+        todo, lower = bound(loads, cells, todo)
+
+    rows = []
+    def record(row):
+        rows.append(row)
+        if path != None:
+            pd.DataFrame([row], columns=COLUMNS).to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+        if row["status"] == "solved":
+            best[(row["method"], row["cycles"])] = min(best.get((row["method"], row["cycles"]), np.inf), row["cost"])
+        print(f"Scenario {len(rows)}/{len(todo)}: {row['scenario']}\t{row['status']}\t€ {row['cost']:,.2f}\t[{row['time']:0.2f} ms]")
+
+    # Scenarios are submitted when a worker is free, so the pruning uses the best cost found up to then
+    pending = collections.deque(todo)
+    running = set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init, initargs=(loads, cells, options, verbose)) as executor:
+        while pending or running:
+            while pending and len(running) < (workers or os.cpu_count()):
+                scenario = pending.popleft()
+                group = (scenario["method"], scenario["cycles"])
+                if prune and scenario["method"] not in HEURISTICS and lower[name(scenario)] > best.get(group, np.inf) * (1 + RTOL):
+                    row = dict.fromkeys(COLUMNS, np.nan)
+                    row.update({"scenario": name(scenario), **scenario, "status": f"pruned: lower bound € {lower[name(scenario)]:,.2f} > € {best[group]:,.2f}"})
+                    record(row)
+                else:
+                    running.add(executor.submit(run, scenario))
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record(future.result())
+
+    results = pd.DataFrame(done.to_dict("records") + rows, columns=COLUMNS).drop_duplicates("scenario", keep="last")
+    print(f"Sweep finished [{(time.time() - start_time)*1000:0.2f} ms]")
+    return results.set_index("scenario").loc[names].reset_index()
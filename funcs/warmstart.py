@@ -0,0 +1,90 @@
+import numpy as np
+
+"""
+Primal-dual warm start of the Opti formulations
+
+    Constraints are registered under a name (e.g. "SOC_HE" for the SOC dynamics of the HE pack), a solution stores its multipliers per name
+    A later formulation with the same objective whose constraints all appear in the previous one (the same problem, or the same problem with constraints removed)
+    starts from these multipliers and IPOPT is run in warm-start mode from the barrier parameter the previous solve ended with (within MU_RANGE) and with its
+    other IPOPT options, a start close to the optimum then only needs a few iterations
+    Any other formulation (e.g. a free power split after a fixed treshold) is started from the primal values only, a warm start from a point that is not
+    close to its optimum takes more iterations than a cold start
+"""
+
+MU_INIT = 1e-6  # Initial barrier parameter of a warm start if the previous solve did not report one, IPOPT uses 0.1 for a cold start
+MU_RANGE = (1e-9, 1e-2)     # Bounds of the initial barrier parameter of a warm start, a barrier close to 0 would pin the iterates to their bounds
+OWN = ("print_level", "max_iter")   # IPOPT options of the formulation being solved, not taken from the previous solve
+
+OPTIONS = {
+    "warm_start_init_point": "yes",
+    "mu_init": MU_INIT,
+    "warm_start_bound_push": 1e-9,
+    "warm_start_bound_frac": 1e-9,
+    "warm_start_slack_bound_push": 1e-9,
+    "warm_start_slack_bound_frac": 1e-9,
+    "warm_start_mult_bound_push": 1e-9,
+}
+
+
+def subject_to(opti, blocks, constraints):
+    '''
+    Add the constraints (dict name -> constraint) to opti, blocks keeps the rows of every name in g
+    '''
+    start = max(stop for _, stop in blocks.values()) if blocks else opti.ng # opti.ng is slow, only read it once
+    for name, constraint in constraints.items():
+        opti.subject_to(constraint)
+        blocks[name] = (start, start + constraint.numel())
+        start += constraint.numel()
+
+
+def usable(dict_initial, objective, blocks):
+    '''
+    Warm start of dict_initial if it can be used for a formulation with the given objective and constraints, None otherwise
+    '''
+    warm_start = dict_initial.get("warm_start") if dict_initial != None else None
+    if warm_start == None or warm_start["objective"] != objective:
+        return None
+
+    for name, (start, stop) in blocks.items():
+        lam = warm_start["lam_g"].get(name)
+        if lam is None or len(lam) != stop - start:
+            return None
+    return warm_start
+
+
+def initial(opti, blocks, dict_initial, objective):
+    '''
+    Set the primal and dual initial guess from the warm start of dict_initial, returns the IPOPT options to use: the options of the previous solve
+    (except OWN), the warm-start options and its last barrier parameter as mu_init
+    '''
+    warm_start = usable(dict_initial, objective, blocks)
+    if warm_start == None:
+        return {}
+
+    if warm_start["shape"] == (opti.nx, opti.ng):
+        opti.set_initial(opti.x, warm_start["x"])
+
+    lam_g = np.zeros(opti.ng)
+    for name, (start, stop) in blocks.items():
+        lam_g[start:stop] = warm_start["lam_g"][name]
+    opti.set_initial(opti.lam_g, lam_g)
+
+    options = {key: value for key, value in warm_start["options"].items() if key not in OWN}
+    return {**options, **OPTIONS, "mu_init": float(np.clip(warm_start["mu"], *MU_RANGE))}
+
+
+def save(opti, sol, blocks, objective, options):
+    '''
+    Warm start of a solution: primal values, multipliers per constraint name and the IPOPT barrier settings
+    '''
+    lam_g = np.atleast_1d(sol.value(opti.lam_g))
+    mu = sol.stats()["iterations"]["mu"]
+
+    return {
+        "x": np.atleast_1d(sol.value(opti.x)),
+        "lam_g": {name: lam_g[start:stop] for name, (start, stop) in blocks.items()},
+        "shape": (opti.nx, opti.ng),
+        "objective": objective,
+        "mu": mu[-1] if len(mu) > 0 else MU_INIT,
+        "options": options,
+    }
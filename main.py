@@ -1,7 +1,5 @@
 import numpy as np
 import pandas as pd
-from typing import NamedTuple 
-from typing import List
 import casadi as ca
 import csv
 
@@ -9,87 +7,16 @@ from methods import monotype
 from methods import treshold
 from methods import optimal
 from funcs import plotting
+from funcs import catalog
+from funcs import cache
+from funcs.result import failed
 
-## -- Class definition
-class BatteryCell(NamedTuple):  # Class for defining battery cells
-    capacity:   float   # Rated capacity (Ah)
-    voltage:    float   # Nominal voltage (V)
-    dis_rate:   float   # Maximum discharge rate (A/Ah)
-    chg_rate:   float   # Maximum charge rate (A/Ah)
-    resistance: float   # Internal resistance (Ohm)
-    weight:     float   # Cell weight (kg)
-    cost_spec:  float   # Specific cost (€/kWh)
-    OCV: List[float]        # Open-circuit voltage (V)
-    OCV_SOC: List[float]    # State of Charge (0-1)
-    aging: List[float]      # fitting parameters for aging model (a, b, c, d)
-
-    @property
-    def energy(self):       # Energy Capacity (kWh)
-        return self.capacity * self.voltage / 1000
-    
-    @property
-    def cost(self):         # Cost per cell (€)
-        return self.energy * self.cost_spec
-    
-    @property
-    def dis_current(self):  # Maximum discharge current (A)
-        return self.dis_rate * self.capacity
-    
-    @property
-    def chg_current(self):  # Maximum charge current (A)
-        return self.chg_rate * self.capacity
-
-cell_HE = BatteryCell(
-    capacity    = 50,
-    voltage     = 3.67,
-    dis_rate    = 1,
-    chg_rate    = 1,
-    cost_spec   = 150,
-    resistance  = 1.5 / 1000,
-    weight      = 1000*0.885, 
-    OCV         = [3.427, 3.508, 3.588, 3.621, 3.647, 3.684, 3.761, 3.829, 3.917, 4.019, 4.135],
-    OCV_SOC     = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1],
-    aging       = [694700, -0.1770, 52790, -0.0356],
-)
-
-cell_HP = BatteryCell(
-    capacity    = 23,
-    voltage     = 2.3,
-    dis_rate    = 4,
-    chg_rate    = 4,
-    cost_spec   = 380,
-    resistance  = 1.1 / 1000, 
-    weight      = 1000*0.55,
-    OCV         = [2.067, 2.113, 2.151, 2.183, 2.217, 2.265, 2.326, 2.361, 2.427, 2.516, 2.653],
-    OCV_SOC     = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1],
-    aging       = [6881000, -0.1950, 426500, -0.0418],
-) 
-
-cell_SSB = BatteryCell(
-    capacity    = 106,
-    voltage     = 3.55,
-    dis_rate    = 0.33,
-    chg_rate    = 0.33,
-    cost_spec   = 150*100,
-    resistance  = 1.2 / 1000,
-    weight      = 1000*1.083, 
-    OCV         = [2.5, 3.025, 3.55, 3.9, 4.25],
-    OCV_SOC     = [0, 0.25, 0.5, 0.75, 1],
-    aging       = [6881000, -0.1950, 426500, -0.0418],
-)
-
-cell_SC = BatteryCell(
-    capacity    = 0.75,
-    voltage     = 1.95,
-    dis_rate    = 173.3,
-    chg_rate    = 173.3,
-    cost_spec   = 54700,
-    resistance  = 0.2 / 1000,
-    weight      = 1000*0.542, 
-    OCV         = [1.5, 1.75, 1.95, 2, 2.4],
-    OCV_SOC     = [0, 0.33, 0.56, 0.61, 1],
-    aging       = [6881000, -0.1950, 426500, -0.0418],
-)
+## -- Battery cells (see cells/catalog.json)
+cells = catalog.load()
+cell_HE = cells.cell("NMC")
+cell_HP = cells.cell("LTO")
+cell_SSB = cells.cell("SSB")
+cell_SC = cells.cell("SC")
 
 V_bus = 1000 # Nominal pack voltage (V)
 loads = [pd.read_csv("loads/paper/boat_imagine.csv")]
@@ -110,16 +37,26 @@ cycles = [5000] #10950 & 520
 
 
 # Calculate rule-based treshold sizing
-dict_mono_HE = monotype.monotype2(loads, cell_HE, V_bus, cycles=cycles)
+# The results are cached on disk (see funcs/cache.py), a new run only solves the stages whose inputs or code changed
+dict_mono_HE = cache.call(monotype.monotype2, loads, cell_HE, V_bus, cycles=cycles)
+if failed(dict_mono_HE):
+    print(f"Infeasibilities: {dict_mono_HE['infeasibilities']}")
+    exit()
 print("\n\n MONO FINISHED \n \n")
-dict_treshold = treshold.treshold(loads, cell_HE, cell_HP, V_bus, cycles=cycles)
+dict_treshold = cache.call(treshold.treshold, loads, cell_HE, cell_HP, V_bus, cycles=cycles)
 print("\n\n TRESH1 FINISHED \n \n")
 print(f"NHE = {dict_treshold['N_HE']}")
 print(f"NHP = {dict_treshold['N_HP']}")
 #plotting.plot_power(dict_treshold)
-dict_treshold_opti = treshold.treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles=cycles, dict_initial=dict_treshold)
+dict_treshold_opti = cache.call(treshold.treshold_opti, loads, cell_HE, cell_HP, V_bus, cycles=cycles, dict_initial=dict_treshold)
+if failed(dict_treshold_opti):
+    print(f"Infeasibilities: {dict_treshold_opti['infeasibilities']}")
+    exit()
 print("\n\n OPTI TRESH FINISHED \n \n")
-dict_opti = optimal.optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles=cycles, bool_intercharge=False, dict_initial=dict_treshold_opti)
+dict_opti = cache.call(optimal.optimal_aging, loads, cell_HE, cell_HP, V_bus, cycles=cycles, bool_intercharge=False, dict_initial=dict_treshold_opti)
+if failed(dict_opti):
+    print(f"Infeasibilities: {dict_opti['infeasibilities']}")
+    exit()
 print("\n\n OPTI FINISHED \n \n")
 #dict_opti2 = optimal.optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles=cycles, bool_intercharge=True, dict_initial=dict_opti)
 # print("\n\n OPTI INTERCH FINISHED \n \n")
@@ -131,6 +68,7 @@ print(f"Optimised (no intercharging):\t€ {dict_opti['cost']:,.2f}\t\t{dict_opt
 #print(f"Optimised (intercharging):\t€ {dict_opti2['cost']:,.2f}\t\t{dict_opti2['M_HE']:.2f} x {dict_opti2['N_HE']:.2f}\t\t{dict_opti2['M_HP']:.2f} x {dict_opti2['N_HP']:.2f}\t\t{dict_opti2['time']:.2f} ms")
 
 print(f"\nDOD_HE: {dict_treshold_opti['DOD_HE']:.2f}%\t\tDOD_HP: {dict_treshold_opti['DOD_HP']:.2f}%")
+print(f"Cache: {cache.report()}")
 
 #plotting.plot_all(dict_treshold)
 plotting.plot_power(dict_opti)
@@ -3,7 +3,14 @@ from scipy.integrate import cumtrapz
 import time
 import casadi as ca
 
-def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
+from funcs import simulation
+from funcs import ocv
+from funcs import warmstart
+from funcs import multi
+from funcs import codegen
+from funcs.result import Result, SPLIT, failure, failed
+
+def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit, tol=1e-3):
     start_time = time.time()
 
     P = loads[0]["P"].values # W
@@ -11,19 +18,6 @@ def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
     t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
 
     ## -- Rule Based Initial Solution
-    P_HE = np.empty(len(t))
-    P_HP = np.empty(len(t))
-    P_HE_joule = np.empty(len(t))
-    P_HP_joule = np.empty(len(t))
-    I_HE_joule = np.empty(len(t))
-    I_HP_joule = np.empty(len(t))
-    SOC_HE = np.full(len(t_soc), 0.9)
-    SOC_HP = np.full(len(t_soc), 0.9)
-    V_HE = np.empty(len(t))
-    V_HP = np.empty(len(t))
-    I_HE = np.empty(len(t))
-    I_HP = np.empty(len(t))
-
     #cost = np.empty(int(np.max(P)/1000))
     resolution = 1000*3*2*2*2*2/8
     resolution = int(np.max(P)/200)
@@ -35,13 +29,7 @@ def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
     M_HP = V_bus/cell_HP.voltage
 
     ############################################ hier begon de for loop
-    for i in range(len(t)):
-        if P[i] > P_limit:
-            P_HE[i] = P_limit
-            P_HP[i] = P[i] - P_limit
-        else:
-            P_HE[i] = P[i]
-            P_HP[i] = 0
+    P_HE, P_HP = simulation.split(P, P_limit)
 
     E_HE = cumtrapz(P_HE/1000, t/3600, initial=0) # kWh
     E_HP = cumtrapz(P_HP/1000, t/3600, initial=0) # kWh
@@ -51,29 +39,9 @@ def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
     N_HE = E_HE_req1 / (M_HE * cell_HE.energy) 
     N_HP = E_HP_req1 / (M_HP * cell_HP.energy) 
 
-    while True:
-        E_HE = M_HE * N_HE * cell_HE.energy
-        E_HP = M_HP * N_HP * cell_HP.energy
-
-        for i in range(len(t)):
-            SOC_HE[i+1] = SOC_HE[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE*3.6e6)) if E_HE_req1 != 0 else SOC_HE[i]
-            SOC_HP[i+1] = SOC_HP[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP*3.6e6)) if E_HP_req1 != 0 else SOC_HP[i]
-
-            V_HE[i] = V_bus/cell_HE.voltage * np.interp(SOC_HE[i], cell_HE.OCV_SOC, cell_HE.OCV)
-            V_HP[i] = V_bus/cell_HP.voltage * np.interp(SOC_HP[i], cell_HP.OCV_SOC, cell_HP.OCV)
-
-            I_HE[i] = P_HE[i]/V_HE[i]
-            I_HP[i] = P_HP[i]/V_HP[i]
-
-            P_HE_joule[i] = cell_HE.resistance * (I_HE[i]**2)
-            P_HP_joule[i] = cell_HP.resistance * (I_HP[i]**2)
-
-            I_HE_joule[i] = P_HE_joule[i] / V_HE[i]
-            I_HP_joule[i] = P_HP_joule[i] / V_HP[i]
-        
-        if np.max(I_HE + I_HE_joule) > N_HE*cell_HE.dis_current: N_HE += 1e-2
-        if np.max(I_HP + I_HP_joule) > N_HP*cell_HP.dis_current: N_HP += 1e-2
-        if np.max(I_HE + I_HE_joule) <= N_HE*cell_HE.dis_current and np.max(I_HP + I_HP_joule) <= N_HP*cell_HP.dis_current: break
+    # Increase number of parallel strings until the current limits of both packs are not exceeded
+    N_HE, _ = simulation.size_strings(P_HE, t_soc, cell_HE, M_HE, N_HE, tol=tol)
+    N_HP, _ = simulation.size_strings(P_HP, t_soc, cell_HP, M_HP, N_HP, tol=tol)
 
 
     
@@ -87,30 +55,9 @@ def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
     ########################################
 
 
-    for i in range(len(t)):
-        if P[i] > P_limit:
-            P_HE[i] = P_limit
-            P_HP[i] = P[i] - P_limit
-        else:
-            P_HE[i] = P[i]
-            P_HP[i] = 0
-
     E_HE = M_HE * N_HE * cell_HE.energy
     E_HP = M_HP * N_HP * cell_HP.energy
 
-    for i in range(len(t)):
-        SOC_HE[i+1] = SOC_HE[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE*3.6e6)) if E_HE != 0 else SOC_HE[i]
-        SOC_HP[i+1] = SOC_HP[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP*3.6e6)) if E_HP != 0 else SOC_HP[i]
-
-        V_HE[i] = V_bus/cell_HE.voltage * np.interp(SOC_HE[i], cell_HE.OCV_SOC, cell_HE.OCV)
-        V_HP[i] = V_bus/cell_HP.voltage * np.interp(SOC_HP[i], cell_HP.OCV_SOC, cell_HP.OCV)
-
-        I_HE[i] = P_HE[i]/V_HE[i]
-        I_HP[i] = P_HP[i]/V_HP[i]
-
-        P_HE_joule[i] = cell_HE.resistance * I_HE[i]**2
-        P_HP_joule[i] = cell_HP.resistance * I_HP[i]**2
-
 
 
     # Calculate cell degradation (aging)
@@ -132,44 +79,17 @@ def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
     N_HE = E_HE / (M_HE * cell_HE.energy)
     N_HP = E_HP / (M_HP * cell_HP.energy)
 
-    SOC_HE_aged = np.full(len(t_soc), 0.9)
-    V_HE_aged = np.empty(len(t))
-    I_HE_aged = np.empty(len(t))
-    P_HE_joule_aged = np.empty(len(t))
-    I_HE_joule_aged = np.empty(len(t))
-
-    SOC_HP_aged = np.full(len(t_soc), 0.9)
-    V_HP_aged = np.empty(len(t))
-    I_HP_aged = np.empty(len(t))
-    P_HP_joule_aged = np.empty(len(t))
-    I_HP_joule_aged = np.empty(len(t))
-    # E_HE_used = np.zeros(len(t_soc))
-    # E_HP_used = np.zeros(len(t_soc))
-
+    sim_HE = simulation.simulate_life(P_HE, t_soc, E_HE, E_HE_aged, cell_HE, M_HE) # BOL and EOL in one pass
+    sim_HP = simulation.simulate_life(P_HP, t_soc, E_HP, E_HP_aged, cell_HP, M_HP)
 
-    for i in range(len(t)):
-        SOC_HE[i+1] = SOC_HE[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE*3.6e6)) if E_HE != 0 else SOC_HE[i]
-        SOC_HP[i+1] = SOC_HP[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP*3.6e6)) if E_HP != 0 else SOC_HP[i]
-        SOC_HE_aged[i+1] = SOC_HE_aged[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE_aged*3.6e6)) if E_HE_aged != 0 else SOC_HE_aged[i]
-        SOC_HP_aged[i+1] = SOC_HP_aged[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP_aged*3.6e6)) if E_HP_aged != 0 else SOC_HP_aged[i]
-
-        # E_HE_used[i+1] = E_HE_used[i] + (P_HE[i]*(t_soc[i+1]-t_soc[i])/3.6e6)
-        # E_HP_used[i+1] = E_HP_used[i] + (P_HP[i]*(t_soc[i+1]-t_soc[i])/3.6e6)
-
-        V_HE[i] = M_HE * np.interp(SOC_HE[i], cell_HE.OCV_SOC, cell_HE.OCV)
-        V_HP[i] = M_HP * np.interp(SOC_HP[i], cell_HP.OCV_SOC, cell_HP.OCV)
-        V_HE_aged[i] = M_HE * np.interp(SOC_HE_aged[i], cell_HE.OCV_SOC, cell_HE.OCV)
-        V_HP_aged[i] = M_HP * np.interp(SOC_HP_aged[i], cell_HP.OCV_SOC, cell_HP.OCV)
-
-        I_HE[i] = P_HE[i]/V_HE[i]
-        I_HP[i] = P_HP[i]/V_HP[i]
-        I_HE_aged[i] = P_HE[i]/V_HE_aged[i]
-        I_HP_aged[i] = P_HP[i]/V_HP_aged[i]
-
-        P_HE_joule[i] = cell_HE.resistance * I_HE[i]**2
-        P_HP_joule[i] = cell_HP.resistance * I_HP[i]**2
-        P_HE_joule_aged[i] = cell_HE.resistance * I_HE_aged[i]**2
-        P_HP_joule_aged[i] = cell_HP.resistance * I_HP_aged[i]**2
+    SOC_HE, SOC_HE_aged = sim_HE["SOC"]
+    V_HE, V_HE_aged = sim_HE["V"]
+    I_HE, I_HE_aged = sim_HE["I"]
+    P_HE_joule, P_HE_joule_aged = sim_HE["P_joule"]
+    SOC_HP, SOC_HP_aged = sim_HP["SOC"]
+    V_HP, V_HP_aged = sim_HP["V"]
+    I_HP, I_HP_aged = sim_HP["I"]
+    P_HP_joule, P_HP_joule_aged = sim_HP["P_joule"]
 
 
 
@@ -191,8 +111,6 @@ def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
         "t": t,
         "t_soc": t_soc,
         "P": P,
-        "P_HE": P_HE,
-        "P_HP": P_HP,
         "P_HE_joule": P_HE_joule,
         "P_HP_joule": P_HP_joule,
         "SOC_HE": SOC_HE,
@@ -229,712 +147,356 @@ def aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit):
         "method": "aeneas",
     }
 
-    return result
-
-def aeneas_opti(loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial=None):
-    start_time = time.time()
-    if dict_initial == None:
-        dict_initial = aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit=limit)
-
-    opti = ca.Opti()
-
-    P = loads[0]["P"].values # W
-    t = loads[0]["t"].values # s
-    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
-
-    # Parameters
-    M_HE = opti.parameter()
-    M_HP = opti.parameter()
-    P_limit = opti.parameter()
-
-    # Decision variables    
-    P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
-    P_HP = opti.variable(len(t),1)      # Power from HP battery       [W]
-    P_HE_joule = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE = opti.variable(len(t), 1)
-    V_HP = opti.variable(len(t), 1)
-    I_HE = opti.variable(len(t), 1)
-    I_HP = opti.variable(len(t), 1)
-
-    P_HE_joule_aged = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule_aged = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE_aged = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP_aged = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE_aged = opti.variable(len(t), 1)
-    V_HP_aged = opti.variable(len(t), 1)
-    I_HE_aged = opti.variable(len(t), 1)
-    I_HP_aged = opti.variable(len(t), 1)
-
-    E_HE_aged = opti.variable(1, 1)
-    E_HP_aged = opti.variable(1, 1)
-    # DOD_HE = opti.variable(1, 1)
-    # DOD_HP = opti.variable(1, 1)
-    E_HE_used = opti.variable(1, 1)
-    E_HP_used = opti.variable(1, 1)
-    
-    # Objective function
-    obj = (M_HE*N_HE*cell_HE.energy) + (M_HP*N_HP*cell_HP.energy)
-
-    # Constraintss
-    opti.subject_to([
-        N_HE > 0, # May not be 0 to avoid division by 0
-        N_HP > 0,
-        
-        SOC_HE <= 0.9,
-        SOC_HP <= 0.9,
-        SOC_HE >= 0.1,
-        SOC_HP >= 0.1,
-        SOC_HE_aged <= 0.9,
-        SOC_HP_aged <= 0.9,
-        SOC_HE_aged >= 0.1,
-        SOC_HP_aged >= 0.1,
-
-        E_HE_used > 0,
-        E_HP_used > 0,
-
-        E_HE_aged > 0,
-        E_HP_aged > 0,
-
-        # DOD_HE < 100,
-        # DOD_HP < 100,
-        # DOD_HE > 0,
-        # DOD_HP > 0,
-
-        P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
-        P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
-
-        E_HE_aged == (M_HE*N_HE*cell_HE.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
-        E_HP_aged == (M_HP*N_HP*cell_HP.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
-
-
-        # DOD_HE == (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
-        # DOD_HP == (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
-        ])
-
-    SOC_HE[0] = ca.DM(0.9)
-    SOC_HP[0] = ca.DM(0.9)
-    SOC_HE_aged[0] = ca.DM(0.9)
-    SOC_HP_aged[0] = ca.DM(0.9)
-    SOC_TO_OCV_HE = ca.interpolant('LUT', 'bspline', [cell_HE.OCV_SOC], cell_HE.OCV)
-    SOC_TO_OCV_HP = ca.interpolant('LUT', 'bspline', [cell_HP.OCV_SOC], cell_HP.OCV)
-
-    for i in range(len(t)):
-        opti.subject_to(P_HE[i] == ca.if_else(P[i] > P_limit, P_limit, P[i]))
-        opti.subject_to(P_HP[i] == ca.if_else(P[i] > P_limit, P[i]-P_limit, 0))
-
-        opti.subject_to(SOC_HE[i+1] == SOC_HE[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((M_HE*N_HE*cell_HE.energy*3.6e6))))
-        opti.subject_to(SOC_HP[i+1] == SOC_HP[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((M_HP*N_HP*cell_HP.energy*3.6e6))))
-        opti.subject_to(SOC_HE_aged[i+1] == SOC_HE_aged[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((E_HE_aged*3.6e6))))
-        opti.subject_to(SOC_HP_aged[i+1] == SOC_HP_aged[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((E_HP_aged*3.6e6))))
-
-
-        opti.subject_to(V_HE[i] == M_HE*SOC_TO_OCV_HE(SOC_HE[i]))
-        opti.subject_to(V_HP[i] == M_HP*SOC_TO_OCV_HP(SOC_HP[i]))
-        opti.subject_to(V_HE_aged[i] == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[i]))
-        opti.subject_to(V_HP_aged[i] == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[i]))
-
-        opti.subject_to(I_HE[i] == P_HE[i]/V_HE[i])
-        opti.subject_to(I_HP[i] == P_HP[i]/V_HP[i])
-        opti.subject_to(I_HE_aged[i] == P_HE[i]/V_HE_aged[i])
-        opti.subject_to(I_HP_aged[i] == P_HP[i]/V_HP_aged[i])
-
-        opti.subject_to(I_HE[i] + P_HE_joule[i]/V_HE[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP[i] + P_HP_joule[i]/V_HP[i] <= cell_HP.dis_current*N_HP)
-        opti.subject_to(I_HE_aged[i] + P_HE_joule_aged[i]/V_HE_aged[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP_aged[i] + P_HP_joule_aged[i]/V_HP_aged[i] <= cell_HP.dis_current*N_HP)
-
-    opti.subject_to(E_HE_used == sum(P_HE[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-    opti.subject_to(E_HP_used == sum(P_HP[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-
-    # Set initial values
-    opti.set_value(M_HE, V_bus/cell_HE.voltage)
-    opti.set_value(M_HP, V_bus/cell_HP.voltage)
-    opti.set_value(P_limit, limit)
-
-    if dict_initial != None:
-        opti.set_initial(P_HE, dict_initial["P_HE"])
-        opti.set_initial(P_HP, dict_initial["P_HP"])
-        opti.set_initial(N_HE, dict_initial["N_HE"] if dict_initial["N_HE"] != 0 else 1e-9)
-        opti.set_initial(N_HP, dict_initial["N_HP"] if dict_initial["N_HP"] != 0 else 1e-9)
-        opti.set_initial(SOC_HE, dict_initial["SOC_HE"])
-        opti.set_initial(SOC_HP, dict_initial["SOC_HP"])
-        opti.set_initial(V_HE, dict_initial["V_HE"])
-        opti.set_initial(V_HP, dict_initial["V_HP"])
-        opti.set_initial(I_HE, dict_initial["I_HE"])
-        opti.set_initial(I_HP, dict_initial["I_HE"])
-        opti.set_initial(P_HE_joule, dict_initial["P_HE_joule"])
-        opti.set_initial(P_HP_joule, dict_initial["P_HP_joule"])
-        opti.set_initial(SOC_HE_aged, dict_initial["SOC_HE_aged"])
-        opti.set_initial(SOC_HP_aged, dict_initial["SOC_HP_aged"])
-        opti.set_initial(V_HE_aged, dict_initial["V_HE_aged"])
-        opti.set_initial(V_HP_aged, dict_initial["V_HP_aged"])
-        opti.set_initial(I_HE_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(I_HP_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(P_HE_joule_aged, dict_initial["P_HE_joule_aged"])
-        opti.set_initial(P_HP_joule_aged, dict_initial["P_HP_joule_aged"])
-        opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
-        opti.set_initial(E_HP_aged, dict_initial["E_HP_aged"])
-        opti.set_initial(E_HE_used, dict_initial["E_HE_used"])
-        opti.set_initial(E_HP_used, dict_initial["E_HP_used"])
-
-
-    # Start optimization
-    opti.minimize(obj)
-    options = {"ipopt": {"print_level": 1, "max_iter":3000}} #level5
-    opti.solver('ipopt', options)
-    try:
-        sol = opti.solve()
-    except:
-        opti.debug.show_infeasibilities()
-        print("[ERROR] Optimization Failed!")
-        # opti.debug.x_describe(index)
-        # opti.debug.g_describe(index)
-        exit()
-
-
-    zero_HE = sol.value(N_HE) < 1e-3    # Check if there are HE cells in the solutions, to remove artifacts
-    zero_HP = sol.value(N_HP) < 1e-3    # Check if there are HP cells in the solutions, to remove artifacts
-
-    duration = (time.time() - start_time)*1000
-    result = {
-        "t": t,
-        "t_soc": t_soc,
-        "P": P,
-        "P_HE": sol.value(P_HE),
-        "P_HP": sol.value(P_HP),
-        "P_HE_joule": sol.value(P_HE_joule),
-        "P_HP_joule": sol.value(P_HP_joule),
-        "SOC_HE": np.full(len(t_soc), 0.9) if zero_HE else sol.value(SOC_HE),
-        "SOC_HP": np.full(len(t_soc), 0.9) if zero_HP else sol.value(SOC_HP),
-        "V_HE": np.full(len(t), sol.value(V_HE[0])) if zero_HE else sol.value(V_HE),
-        "V_HP": np.full(len(t), sol.value(V_HP[0])) if zero_HP else sol.value(V_HP),
-        "I_HE": sol.value(I_HE),
-        "I_HP": sol.value(I_HP),
-        "M_HE": sol.value(M_HE),
-        "M_HP": sol.value(M_HP),
-        "N_HE": sol.value(N_HE),
-        "N_HP": sol.value(N_HP),
-        "cost": sol.value(M_HE) * sol.value(N_HE) * cell_HE.cost + sol.value(M_HP) * sol.value(N_HP) * cell_HP.cost,
-        "losses": 0 + 0,
-        "efficiency": 0,
-        "P_HE_joule_aged": sol.value(P_HE_joule_aged),
-        "P_HP_joule_aged": sol.value(P_HP_joule_aged),
-        "SOC_HE_aged": np.full(len(t_soc), 0.9) if zero_HE else sol.value(SOC_HE_aged),
-        "SOC_HP_aged": np.full(len(t_soc), 0.9) if zero_HP else sol.value(SOC_HP_aged),
-        "V_HE_aged": np.full(len(t), sol.value(V_HE[0])) if zero_HE else sol.value(V_HE_aged),
-        "V_HP_aged": np.full(len(t), sol.value(V_HP[0])) if zero_HP else sol.value(V_HP_aged),
-        "I_HE_aged": sol.value(I_HE_aged),
-        "I_HP_aged": sol.value(I_HP_aged),
-        "E_HE": sol.value(M_HE) * sol.value(N_HE) * cell_HE.energy,
-        "E_HP": sol.value(M_HP) * sol.value(N_HP) * cell_HP.energy,
-        "E_HE_aged": sol.value(E_HE_aged),
-        "E_HP_aged": sol.value(E_HP_aged),
-        "E_HE_used": sol.value(E_HE_used),
-        "E_HP_used": sol.value(E_HP_used),
-        "I_HE_rated": sol.value(N_HE)*cell_HE.dis_current,
-        "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
-        "DOD_HE": 0,
-        "DOD_HP": 0,
-        "time": duration,
-        "method": "optimal"
-        #"limit": None
-    }
-
-    return result
-
-
-
-
-
+    return Result(result, derived=SPLIT)
 
 
+# Parametric NLP templates of the aeneas_opti family, keyed by (profile length, cell pair, objective kind)
+templates = {}
+stats = {"hits": 0, "misses": 0, "time_build": 0.0}
 
 
+def cell_key(cell):
+    return tuple(tuple(value) if isinstance(value, list) else value for value in cell)
 
 
+def template(kind, n, cell_HE, cell_HP, warm=False):
+    '''
+    Opti problem for a profile of n samples, built on the first call and reused for every new load, time step and power treshold
+    The packs are sized at BOL, the aging terms of the aged energies are left out as in aeneas (the cycles are not a parameter)
 
-def aeneas_opti_energy(loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial=None):
-    start_time = time.time()
-    if dict_initial == None:
-        dict_initial = aeneas_opti(loads, cell_HE, cell_HP, V_bus, cycles, limit=limit, dict_initial=None)
+    kind: "split" (aeneas_opti), "energy" (aeneas_opti_energy) or "HP" (aeneas_opti_HP), warm: solver set up for a primal-dual warm start
+    Returns a dict with the Opti instance, its parameters, its decision variables and their default initial values (x0, lam_g0)
+    '''
+    key = (n, cell_key(cell_HE), cell_key(cell_HP), kind, warm)
+    nlp = templates.get(key)
+    if nlp != None:
+        stats["hits"] += 1
+        return nlp
 
+    start_build = time.time()
     opti = ca.Opti()
-
-    P = loads[0]["P"].values # W
-    t = loads[0]["t"].values # s
-    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
+    blocks = {}
 
     # Parameters
     M_HE = opti.parameter()
     M_HP = opti.parameter()
     P_limit = opti.parameter()
+    P_load = opti.parameter(n, 1)   # Load profile [W]
+    dt = opti.parameter(n, 1)       # Time step [s]
 
     # Decision variables    
-    P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
-    P_HP = opti.variable(len(t),1)      # Power from HP battery       [W]
-    P_HE_joule = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
+    P_HE = opti.variable(n,1)      # Power from HE battery       [W]
+    P_HP = opti.variable(n,1)      # Power from HP battery       [W]
+    P_HE_joule = opti.variable(n,1)      # Joule losses from HE battery       [W]
+    P_HP_joule = opti.variable(n,1)      # Joule losses from HP battery       [W]
     N_HE = opti.variable(1,1)           # Number of parallel HE strings []
     N_HP = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE = opti.variable(len(t), 1)
-    V_HP = opti.variable(len(t), 1)
-    I_HE = opti.variable(len(t), 1)
-    I_HP = opti.variable(len(t), 1)
-
-    P_HE_joule_aged = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule_aged = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE_aged = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP_aged = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE_aged = opti.variable(len(t), 1)
-    V_HP_aged = opti.variable(len(t), 1)
-    I_HE_aged = opti.variable(len(t), 1)
-    I_HP_aged = opti.variable(len(t), 1)
+    SOC_HE = opti.variable(n+1, 1)   # State of Charge of HE batttery [0-1]
+    SOC_HP = opti.variable(n+1, 1)   # State of Charge of HP batttery [0-1]
+    V_HE = opti.variable(n, 1)
+    V_HP = opti.variable(n, 1)
+    I_HE = opti.variable(n, 1)
+    I_HP = opti.variable(n, 1)
+
+    P_HE_joule_aged = opti.variable(n,1)      # Joule losses from HE battery       [W]
+    P_HP_joule_aged = opti.variable(n,1)      # Joule losses from HP battery       [W]
+    SOC_HE_aged = opti.variable(n+1, 1)   # State of Charge of HE batttery [0-1]
+    SOC_HP_aged = opti.variable(n+1, 1)   # State of Charge of HP batttery [0-1]
+    V_HE_aged = opti.variable(n, 1)
+    V_HP_aged = opti.variable(n, 1)
+    I_HE_aged = opti.variable(n, 1)
+    I_HP_aged = opti.variable(n, 1)
 
     E_HE_aged = opti.variable(1, 1)
     E_HP_aged = opti.variable(1, 1)
-    # DOD_HE = opti.variable(1, 1)
-    # DOD_HP = opti.variable(1, 1)
     E_HE_used = opti.variable(1, 1)
     E_HP_used = opti.variable(1, 1)
     
     # Objective function
-    obj = (M_HE*N_HE*cell_HE.energy) + (M_HP*N_HP*cell_HP.energy) 
+    if kind == "HP":
+        obj = N_HP * cell_HP.dis_rate + N_HE * cell_HE.dis_rate
+    else:
+        obj = (M_HE*N_HE*cell_HE.energy) + (M_HP*N_HP*cell_HP.energy)
 
     # Constraintss
-    opti.subject_to([
-        N_HE > 0, # May not be 0 to avoid division by 0
-        N_HP > 0,
-
-        P_HE <= P_limit,
-        P_HE + P_HP == P,
-        P_HE >= 0,
-        
-        SOC_HE <= 0.9,
-        SOC_HP <= 0.9,
-        SOC_HE >= 0.1,
-        SOC_HP >= 0.1,
-        SOC_HE_aged <= 0.9,
-        SOC_HP_aged <= 0.9,
-        SOC_HE_aged >= 0.1,
-        SOC_HP_aged >= 0.1,
-
-        E_HE_used > 0,
-        E_HP_used > 0,
-
-        E_HE_aged > 0,
-        E_HP_aged > 0,
-
-        # DOD_HE < 100,
-        # DOD_HP < 100,
-        # DOD_HE > 0,
-        # DOD_HP > 0,
-
-        P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
-        P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
-
-        E_HE_aged == (M_HE*N_HE*cell_HE.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
-        E_HP_aged == (M_HP*N_HP*cell_HP.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
-
-
-        # DOD_HE == (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
-        # DOD_HP == (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
-        ])
+    warmstart.subject_to(opti, blocks, {
+        "N_HE_min": N_HE > 0, # May not be 0 to avoid division by 0
+        "N_HP_min": N_HP > 0,
+        })
+
+    # Free power split, the HE power is limited by the treshold
+    if kind != "split":
+        warmstart.subject_to(opti, blocks, {
+            "P_HE_max": P_HE <= P_limit,
+            "P": P_HE + P_HP == P_load,
+            "P_HE_min": P_HE >= 0,
+            })
+
+    warmstart.subject_to(opti, blocks, {
+        "SOC_HE_max": SOC_HE <= 0.9,
+        "SOC_HP_max": SOC_HP <= 0.9,
+        "SOC_HE_min": SOC_HE >= 0.1,
+        "SOC_HP_min": SOC_HP >= 0.1,
+        "SOC_HE_aged_max": SOC_HE_aged <= 0.9,
+        "SOC_HP_aged_max": SOC_HP_aged <= 0.9,
+        "SOC_HE_aged_min": SOC_HE_aged >= 0.1,
+        "SOC_HP_aged_min": SOC_HP_aged >= 0.1,
+
+        "E_HE_used_min": E_HE_used > 0,
+        "E_HP_used_min": E_HP_used > 0,
+
+        "E_HE_aged_min": E_HE_aged > 0,
+        "E_HP_aged_min": E_HP_aged > 0,
+
+        "P_HE_joule": P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
+        "P_HP_joule": P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
+        "P_HE_joule_aged": P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
+        "P_HP_joule_aged": P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
+
+        "E_HE_aged": E_HE_aged == (M_HE*N_HE*cell_HE.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
+        "E_HP_aged": E_HP_aged == (M_HP*N_HP*cell_HP.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
+        })
 
     SOC_HE[0] = ca.DM(0.9)
     SOC_HP[0] = ca.DM(0.9)
     SOC_HE_aged[0] = ca.DM(0.9)
     SOC_HP_aged[0] = ca.DM(0.9)
-    SOC_TO_OCV_HE = ca.interpolant('LUT', 'bspline', [cell_HE.OCV_SOC], cell_HE.OCV)
-    SOC_TO_OCV_HP = ca.interpolant('LUT', 'bspline', [cell_HP.OCV_SOC], cell_HP.OCV)
-
-    for i in range(len(t)):
-        #opti.subject_to(P_HE[i] >= ca.if_else(P[i] < P_limit, P[i]))
-                        
-
-
-
-        # opti.subject_to(P_HE[i] >= P[i])
+    SOC_TO_OCV_HE = ocv.lookup(cell_HE)
+    SOC_TO_OCV_HP = ocv.lookup(cell_HP)
+
+    # Power split fixed by the treshold
+    if kind == "split":
+        warmstart.subject_to(opti, blocks, {
+            "P_HE": P_HE == ca.if_else(P_load > P_limit, P_limit, P_load),
+            "P_HP": P_HP == ca.if_else(P_load > P_limit, P_load-P_limit, 0),
+            })
+
+    warmstart.subject_to(opti, blocks, {
+        "SOC_HE": SOC_HE[1:] == SOC_HE[:-1] - ((P_HE*dt)/((M_HE*N_HE*cell_HE.energy*3.6e6))),
+        "SOC_HP": SOC_HP[1:] == SOC_HP[:-1] - ((P_HP*dt)/((M_HP*N_HP*cell_HP.energy*3.6e6))),
+        "SOC_HE_aged": SOC_HE_aged[1:] == SOC_HE_aged[:-1] - ((P_HE*dt)/((E_HE_aged*3.6e6))),
+        "SOC_HP_aged": SOC_HP_aged[1:] == SOC_HP_aged[:-1] - ((P_HP*dt)/((E_HP_aged*3.6e6))),
+        })
+
+
+    warmstart.subject_to(opti, blocks, {
+        "V_HE": V_HE == M_HE*SOC_TO_OCV_HE(SOC_HE[:-1].T).T,
+        "V_HP": V_HP == M_HP*SOC_TO_OCV_HP(SOC_HP[:-1].T).T,
+        "V_HE_aged": V_HE_aged == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[:-1].T).T,
+        "V_HP_aged": V_HP_aged == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[:-1].T).T,
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE": I_HE == P_HE/V_HE,
+        "I_HP": I_HP == P_HP/V_HP,
+        "I_HE_aged": I_HE_aged == P_HE/V_HE_aged,
+        "I_HP_aged": I_HP_aged == P_HP/V_HP_aged,
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE_max": I_HE + P_HE_joule/V_HE <= cell_HE.dis_current*N_HE,
+        "I_HP_max": I_HP + P_HP_joule/V_HP <= cell_HP.dis_current*N_HP,
+        "I_HE_aged_max": I_HE_aged + P_HE_joule_aged/V_HE_aged <= cell_HE.dis_current*N_HE,
+        "I_HP_aged_max": I_HP_aged + P_HP_joule_aged/V_HP_aged <= cell_HP.dis_current*N_HP,
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "E_HE_used": E_HE_used == simulation.used(SOC_HE, M_HE*N_HE*cell_HE.energy),
+        "E_HP_used": E_HP_used == simulation.used(SOC_HP, M_HP*N_HP*cell_HP.energy),
+        })
+
+    # The solver is created once, later solves only pass new parameter values and initial guesses
+    opti.minimize(obj)
+    options = {"ipopt": {"print_level": 1, "max_iter":3000, **(warmstart.OPTIONS if warm else {})}} #level5
+    opti.solver('ipopt', options)
 
+    nlp = {
+        "opti": opti, "blocks": blocks, "options": options["ipopt"],
+        "M_HE": M_HE, "M_HP": M_HP, "P_limit": P_limit, "P": P_load, "dt": dt,
+        "P_HE": P_HE, "P_HP": P_HP, "P_HE_joule": P_HE_joule, "P_HP_joule": P_HP_joule,
+        "N_HE": N_HE, "N_HP": N_HP, "SOC_HE": SOC_HE, "SOC_HP": SOC_HP,
+        "V_HE": V_HE, "V_HP": V_HP, "I_HE": I_HE, "I_HP": I_HP,
+        "P_HE_joule_aged": P_HE_joule_aged, "P_HP_joule_aged": P_HP_joule_aged,
+        "SOC_HE_aged": SOC_HE_aged, "SOC_HP_aged": SOC_HP_aged,
+        "V_HE_aged": V_HE_aged, "V_HP_aged": V_HP_aged, "I_HE_aged": I_HE_aged, "I_HP_aged": I_HP_aged,
+        "E_HE_aged": E_HE_aged, "E_HP_aged": E_HP_aged, "E_HE_used": E_HE_used, "E_HP_used": E_HP_used,
+        "x0": np.atleast_1d(opti.value(opti.x, opti.initial())), "lam_g0": np.zeros(max(stop for _, stop in blocks.values())),
+    }
+    templates[key] = nlp
+    stats["misses"] += 1
+    stats["time_build"] += (time.time() - start_build)*1000
 
-        # opti.subject_to(P_HE[i] == ca.if_else(P[i] > P_limit, P_limit, P[i]))
-        # opti.subject_to(P_HP[i] == ca.if_else(P[i] > P_limit, P[i]-P_limit, 0))
+    return nlp
 
-        opti.subject_to(SOC_HE[i+1] == SOC_HE[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((M_HE*N_HE*cell_HE.energy*3.6e6))))
-        opti.subject_to(SOC_HP[i+1] == SOC_HP[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((M_HP*N_HP*cell_HP.energy*3.6e6))))
-        opti.subject_to(SOC_HE_aged[i+1] == SOC_HE_aged[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((E_HE_aged*3.6e6))))
-        opti.subject_to(SOC_HP_aged[i+1] == SOC_HP_aged[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((E_HP_aged*3.6e6))))
 
+def report():
+    '''
+    Template cache statistics: hits, misses, number of templates and total build time (ms)
+    '''
+    return {**stats, "templates": len(templates)}
 
-        opti.subject_to(V_HE[i] == M_HE*SOC_TO_OCV_HE(SOC_HE[i]))
-        opti.subject_to(V_HP[i] == M_HP*SOC_TO_OCV_HP(SOC_HP[i]))
-        opti.subject_to(V_HE_aged[i] == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[i]))
-        opti.subject_to(V_HP_aged[i] == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[i]))
 
-        opti.subject_to(I_HE[i] == P_HE[i]/V_HE[i])
-        opti.subject_to(I_HP[i] == P_HP[i]/V_HP[i])
-        opti.subject_to(I_HE_aged[i] == P_HE[i]/V_HE_aged[i])
-        opti.subject_to(I_HP_aged[i] == P_HP[i]/V_HP_aged[i])
+def clear():
+    templates.clear()
+    stats.update({"hits": 0, "misses": 0, "time_build": 0.0})
 
-        opti.subject_to(I_HE[i] + P_HE_joule[i]/V_HE[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP[i] + P_HP_joule[i]/V_HP[i] <= cell_HP.dis_current*N_HP)
-        opti.subject_to(I_HE_aged[i] + P_HE_joule_aged[i]/V_HE_aged[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP_aged[i] + P_HP_joule_aged[i]/V_HP_aged[i] <= cell_HP.dis_current*N_HP)
 
-    opti.subject_to(E_HE_used == sum(P_HE[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-    opti.subject_to(E_HP_used == sum(P_HP[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
+def solve(kind, loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial, start_time, compiled=False):
+    '''
+    Solve the template of the given kind for a load profile, power treshold and initial guess
+    compiled: solve with the compiled callbacks of the template (see codegen), a template is the same NLP for every load of its length
+    '''
+    start_build = time.time()
+    P = loads[0]["P"].values # W
+    t = loads[0]["t"].values # s
+    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
 
-    # Set initial values
-    opti.set_value(M_HE, V_bus/cell_HE.voltage)
-    opti.set_value(M_HP, V_bus/cell_HP.voltage)
-    opti.set_value(P_limit, limit)
+    objective = "rate" if kind == "HP" else "energy"
+
+    # The constraints of a template only depend on its kind and length, the blocks of one already built tell if the warm start applies
+    misses = stats["misses"]
+    blocks = next((nlp["blocks"] for key, nlp in templates.items() if key[0] == len(t) and key[3] == kind), None)
+    if blocks == None:  # First template of this kind and length
+        blocks = template(kind, len(t), cell_HE, cell_HP)["blocks"]
+    nlp = template(kind, len(t), cell_HE, cell_HP, warm=warmstart.usable(dict_initial, objective, blocks) != None)
+    cached = stats["misses"] == misses
+    opti = nlp["opti"]
+
+    # Set parameter and initial values, from the defaults of the template first so no initial value of a previous solve is kept
+    opti.set_initial(opti.x, nlp["x0"])
+    opti.set_initial(opti.lam_g, nlp["lam_g0"])
+    opti.set_value(nlp["M_HE"], V_bus/cell_HE.voltage)
+    opti.set_value(nlp["M_HP"], V_bus/cell_HP.voltage)
+    opti.set_value(nlp["P_limit"], limit)
+    opti.set_value(nlp["P"], P)
+    opti.set_value(nlp["dt"], np.diff(t_soc))
 
     if dict_initial != None:
-        opti.set_initial(P_HE, dict_initial["P_HE"])
-        opti.set_initial(P_HP, dict_initial["P_HP"])
-        opti.set_initial(N_HE, dict_initial["N_HE"] if dict_initial["N_HE"] != 0 else 1e-9)
-        opti.set_initial(N_HP, dict_initial["N_HP"] if dict_initial["N_HP"] != 0 else 1e-9)
-        opti.set_initial(SOC_HE, dict_initial["SOC_HE"])
-        opti.set_initial(SOC_HP, dict_initial["SOC_HP"])
-        opti.set_initial(V_HE, dict_initial["V_HE"])
-        opti.set_initial(V_HP, dict_initial["V_HP"])
-        opti.set_initial(I_HE, dict_initial["I_HE"])
-        opti.set_initial(I_HP, dict_initial["I_HE"])
-        opti.set_initial(P_HE_joule, dict_initial["P_HE_joule"])
-        opti.set_initial(P_HP_joule, dict_initial["P_HP_joule"])
-        opti.set_initial(SOC_HE_aged, dict_initial["SOC_HE_aged"])
-        opti.set_initial(SOC_HP_aged, dict_initial["SOC_HP_aged"])
-        opti.set_initial(V_HE_aged, dict_initial["V_HE_aged"])
-        opti.set_initial(V_HP_aged, dict_initial["V_HP_aged"])
-        opti.set_initial(I_HE_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(I_HP_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(P_HE_joule_aged, dict_initial["P_HE_joule_aged"])
-        opti.set_initial(P_HP_joule_aged, dict_initial["P_HP_joule_aged"])
-        opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
-        opti.set_initial(E_HP_aged, dict_initial["E_HP_aged"])
-        opti.set_initial(E_HE_used, dict_initial["E_HE_used"])
-        opti.set_initial(E_HP_used, dict_initial["E_HP_used"])
-
+        opti.set_initial(nlp["P_HE"], dict_initial["P_HE"])
+        opti.set_initial(nlp["P_HP"], dict_initial["P_HP"])
+        opti.set_initial(nlp["N_HE"], dict_initial["N_HE"] if dict_initial["N_HE"] != 0 else 1e-9)
+        opti.set_initial(nlp["N_HP"], dict_initial["N_HP"] if dict_initial["N_HP"] != 0 else 1e-9)
+        opti.set_initial(nlp["SOC_HE"], dict_initial["SOC_HE"])
+        opti.set_initial(nlp["SOC_HP"], dict_initial["SOC_HP"])
+        opti.set_initial(nlp["V_HE"], dict_initial["V_HE"])
+        opti.set_initial(nlp["V_HP"], dict_initial["V_HP"])
+        opti.set_initial(nlp["I_HE"], dict_initial["I_HE"])
+        opti.set_initial(nlp["I_HP"], dict_initial["I_HP"])
+        opti.set_initial(nlp["P_HE_joule"], dict_initial["P_HE_joule"])
+        opti.set_initial(nlp["P_HP_joule"], dict_initial["P_HP_joule"])
+        opti.set_initial(nlp["SOC_HE_aged"], dict_initial["SOC_HE_aged"])
+        opti.set_initial(nlp["SOC_HP_aged"], dict_initial["SOC_HP_aged"])
+        opti.set_initial(nlp["V_HE_aged"], dict_initial["V_HE_aged"])
+        opti.set_initial(nlp["V_HP_aged"], dict_initial["V_HP_aged"])
+        opti.set_initial(nlp["I_HE_aged"], dict_initial["I_HE_aged"])
+        opti.set_initial(nlp["I_HP_aged"], dict_initial["I_HP_aged"])
+        opti.set_initial(nlp["P_HE_joule_aged"], dict_initial["P_HE_joule_aged"])
+        opti.set_initial(nlp["P_HP_joule_aged"], dict_initial["P_HP_joule_aged"])
+        opti.set_initial(nlp["E_HE_aged"], dict_initial["E_HE_aged"])
+        opti.set_initial(nlp["E_HP_aged"], dict_initial["E_HP_aged"])
+        opti.set_initial(nlp["E_HE_used"], dict_initial["E_HE_used"])
+        opti.set_initial(nlp["E_HP_used"], dict_initial["E_HP_used"])
+    warmstart.initial(opti, nlp["blocks"], dict_initial, objective) # The solver of a warm template keeps warmstart.OPTIONS, new options would rebuild it
 
     # Start optimization
-    opti.minimize(obj)
-    options = {"ipopt": {"print_level": 1, "max_iter":3000}} #level5
-    opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
     try:
-        sol = opti.solve()
-    except:
+        if compiled and nlp.get("solver") == None:
+            nlp["solver"] = codegen.load(opti, "ipopt", {"ipopt": nlp["options"]})
+        sol = codegen.solve(opti, "ipopt", {"ipopt": nlp["options"]}, nlp["solver"]) if compiled else opti.solve()
+    except Exception:
         opti.debug.show_infeasibilities()
         print("[ERROR] Optimization Failed!")
         # opti.debug.x_describe(index)
         # opti.debug.g_describe(index)
-        exit()
+        return failure(opti, nlp["blocks"], {"t": t, "t_soc": t_soc, "P": P, "method": "optimal"}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
 
+    value = {key: sol.value(nlp[key]) for key in nlp if key not in ("opti", "blocks", "options", "solver", "x0", "lam_g0")}
 
-    zero_HE = sol.value(N_HE) < 1e-3    # Check if there are HE cells in the solutions, to remove artifacts
-    zero_HP = sol.value(N_HP) < 1e-3    # Check if there are HP cells in the solutions, to remove artifacts
+    zero_HE = value["N_HE"] < 1e-3    # Check if there are HE cells in the solutions, to remove artifacts
+    zero_HP = value["N_HP"] < 1e-3    # Check if there are HP cells in the solutions, to remove artifacts
 
     duration = (time.time() - start_time)*1000
     result = {
         "t": t,
         "t_soc": t_soc,
         "P": P,
-        "P_HE": sol.value(P_HE),
-        "P_HP": sol.value(P_HP),
-        "P_HE_joule": sol.value(P_HE_joule),
-        "P_HP_joule": sol.value(P_HP_joule),
-        "SOC_HE": np.full(len(t_soc), 0.9) if zero_HE else sol.value(SOC_HE),
-        "SOC_HP": np.full(len(t_soc), 0.9) if zero_HP else sol.value(SOC_HP),
-        "V_HE": np.full(len(t), sol.value(V_HE[0])) if zero_HE else sol.value(V_HE),
-        "V_HP": np.full(len(t), sol.value(V_HP[0])) if zero_HP else sol.value(V_HP),
-        "I_HE": sol.value(I_HE),
-        "I_HP": sol.value(I_HP),
-        "M_HE": sol.value(M_HE),
-        "M_HP": sol.value(M_HP),
-        "N_HE": sol.value(N_HE),
-        "N_HP": sol.value(N_HP),
-        "cost": sol.value(M_HE) * sol.value(N_HE) * cell_HE.cost + sol.value(M_HP) * sol.value(N_HP) * cell_HP.cost,
+        "P_HE": value["P_HE"],
+        "P_HP": value["P_HP"],
+        "P_HE_joule": value["P_HE_joule"],
+        "P_HP_joule": value["P_HP_joule"],
+        "SOC_HE": np.full(len(t_soc), 0.9) if zero_HE else value["SOC_HE"],
+        "SOC_HP": np.full(len(t_soc), 0.9) if zero_HP else value["SOC_HP"],
+        "V_HE": np.full(len(t), value["V_HE"][0]) if zero_HE else value["V_HE"],
+        "V_HP": np.full(len(t), value["V_HP"][0]) if zero_HP else value["V_HP"],
+        "I_HE": value["I_HE"],
+        "I_HP": value["I_HP"],
+        "M_HE": value["M_HE"],
+        "M_HP": value["M_HP"],
+        "N_HE": value["N_HE"],
+        "N_HP": value["N_HP"],
+        "cost": value["M_HE"] * value["N_HE"] * cell_HE.cost + value["M_HP"] * value["N_HP"] * cell_HP.cost,
         "losses": 0 + 0,
         "efficiency": 0,
-        "P_HE_joule_aged": sol.value(P_HE_joule_aged),
-        "P_HP_joule_aged": sol.value(P_HP_joule_aged),
-        "SOC_HE_aged": np.full(len(t_soc), 0.9) if zero_HE else sol.value(SOC_HE_aged),
-        "SOC_HP_aged": np.full(len(t_soc), 0.9) if zero_HP else sol.value(SOC_HP_aged),
-        "V_HE_aged": np.full(len(t), sol.value(V_HE[0])) if zero_HE else sol.value(V_HE_aged),
-        "V_HP_aged": np.full(len(t), sol.value(V_HP[0])) if zero_HP else sol.value(V_HP_aged),
-        "I_HE_aged": sol.value(I_HE_aged),
-        "I_HP_aged": sol.value(I_HP_aged),
-        "E_HE": sol.value(M_HE) * sol.value(N_HE) * cell_HE.energy,
-        "E_HP": sol.value(M_HP) * sol.value(N_HP) * cell_HP.energy,
-        "E_HE_aged": sol.value(E_HE_aged),
-        "E_HP_aged": sol.value(E_HP_aged),
-        "I_HE_rated": sol.value(N_HE)*cell_HE.dis_current,
-        "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
+        "P_HE_joule_aged": value["P_HE_joule_aged"],
+        "P_HP_joule_aged": value["P_HP_joule_aged"],
+        "SOC_HE_aged": np.full(len(t_soc), 0.9) if zero_HE else value["SOC_HE_aged"],
+        "SOC_HP_aged": np.full(len(t_soc), 0.9) if zero_HP else value["SOC_HP_aged"],
+        "V_HE_aged": np.full(len(t), value["V_HE"][0]) if zero_HE else value["V_HE_aged"],
+        "V_HP_aged": np.full(len(t), value["V_HP"][0]) if zero_HP else value["V_HP_aged"],
+        "I_HE_aged": value["I_HE_aged"],
+        "I_HP_aged": value["I_HP_aged"],
+        "E_HE": value["M_HE"] * value["N_HE"] * cell_HE.energy,
+        "E_HP": value["M_HP"] * value["N_HP"] * cell_HP.energy,
+        "E_HE_aged": value["E_HE_aged"],
+        "E_HP_aged": value["E_HP_aged"],
+        "E_HE_used": value["E_HE_used"],
+        "E_HP_used": value["E_HP_used"],
+        "I_HE_rated": value["N_HE"]*cell_HE.dis_current,
+        "I_HP_rated": value["N_HP"]*cell_HP.dis_current,
         "DOD_HE": 0,
         "DOD_HP": 0,
+        "iterations": sol.stats()["iter_count"],
+        "warm_start": warmstart.save(opti, sol, nlp["blocks"], objective, nlp["options"]),
+        "cached": cached,
+        "time_build": time_build,
+        "time_solve": time_solve,
         "time": duration,
         "method": "optimal"
         #"limit": None
     }
 
-    return result
-
-
-
-
-
-
-
-
-
-
-
-
+    return Result(result)
 
 
-
-
-
-def aeneas_opti_HP(loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial=None):
+def aeneas_opti(loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial=None, compiled=False):
+    multi.single(loads, "aeneas_opti")
     start_time = time.time()
     if dict_initial == None:
-        dict_initial = aeneas_opti(loads, cell_HE, cell_HP, V_bus, cycles, limit=limit, dict_initial=None)
-
-    opti = ca.Opti()
-
-    P = loads[0]["P"].values # W
-    t = loads[0]["t"].values # s
-    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
-
-    # Parameters
-    M_HE = opti.parameter()
-    M_HP = opti.parameter()
-    P_limit = opti.parameter()
-
-    # Decision variables    
-    P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
-    P_HP = opti.variable(len(t),1)      # Power from HP battery       [W]
-    P_HE_joule = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE = opti.variable(len(t), 1)
-    V_HP = opti.variable(len(t), 1)
-    I_HE = opti.variable(len(t), 1)
-    I_HP = opti.variable(len(t), 1)
-
-    P_HE_joule_aged = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule_aged = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE_aged = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP_aged = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE_aged = opti.variable(len(t), 1)
-    V_HP_aged = opti.variable(len(t), 1)
-    I_HE_aged = opti.variable(len(t), 1)
-    I_HP_aged = opti.variable(len(t), 1)
-
-    E_HE_aged = opti.variable(1, 1)
-    E_HP_aged = opti.variable(1, 1)
-    # DOD_HE = opti.variable(1, 1)
-    # DOD_HP = opti.variable(1, 1)
-    E_HE_used = opti.variable(1, 1)
-    E_HP_used = opti.variable(1, 1)
-    
-    # Objective function
-    #obj = N_HP * N_HE + 0*(ca.sum1(P_HE_joule)/np.sum(P)) + (ca.sum1(P_HP_joule)/np.sum(P))
-    obj = N_HP * cell_HP.dis_rate + N_HE * cell_HE.dis_rate
-
-    # Constraintss
-    opti.subject_to([
-        N_HE > 0, # May not be 0 to avoid division by 0
-        N_HP > 0,
-
-        P_HE <= P_limit,
-        P_HE + P_HP == P,
-        P_HE >= 0,
-        
-        SOC_HE <= 0.9,
-        SOC_HP <= 0.9,
-        SOC_HE >= 0.1,
-        SOC_HP >= 0.1,
-        SOC_HE_aged <= 0.9,
-        SOC_HP_aged <= 0.9,
-        SOC_HE_aged >= 0.1,
-        SOC_HP_aged >= 0.1,
-
-        E_HE_used > 0,
-        E_HP_used > 0,
-
-        E_HE_aged > 0,
-        E_HP_aged > 0,
-
-        # DOD_HE < 100,
-        # DOD_HP < 100,
-        # DOD_HE > 0,
-        # DOD_HP > 0,
-
-        P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
-        P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
-
-        E_HE_aged == (M_HE*N_HE*cell_HE.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
-        E_HP_aged == (M_HP*N_HP*cell_HP.energy) ,#* (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
-
-
-        # DOD_HE == (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
-        # DOD_HP == (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
-        ])
-
-    SOC_HE[0] = ca.DM(0.9)
-    SOC_HP[0] = ca.DM(0.9)
-    SOC_HE_aged[0] = ca.DM(0.9)
-    SOC_HP_aged[0] = ca.DM(0.9)
-    SOC_TO_OCV_HE = ca.interpolant('LUT', 'bspline', [cell_HE.OCV_SOC], cell_HE.OCV)
-    SOC_TO_OCV_HP = ca.interpolant('LUT', 'bspline', [cell_HP.OCV_SOC], cell_HP.OCV)
-
-    for i in range(len(t)):
-        #opti.subject_to(P_HE[i] >= ca.if_else(P[i] < P_limit, P[i]))
-                        
-
-
-
-        # opti.subject_to(P_HE[i] >= P[i])
-
-
-        # opti.subject_to(P_HE[i] == ca.if_else(P[i] > P_limit, P_limit, P[i]))
-        # opti.subject_to(P_HP[i] == ca.if_else(P[i] > P_limit, P[i]-P_limit, 0))
-
-        opti.subject_to(SOC_HE[i+1] == SOC_HE[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((M_HE*N_HE*cell_HE.energy*3.6e6))))
-        opti.subject_to(SOC_HP[i+1] == SOC_HP[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((M_HP*N_HP*cell_HP.energy*3.6e6))))
-        opti.subject_to(SOC_HE_aged[i+1] == SOC_HE_aged[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((E_HE_aged*3.6e6))))
-        opti.subject_to(SOC_HP_aged[i+1] == SOC_HP_aged[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((E_HP_aged*3.6e6))))
-
-
-        opti.subject_to(V_HE[i] == M_HE*SOC_TO_OCV_HE(SOC_HE[i]))
-        opti.subject_to(V_HP[i] == M_HP*SOC_TO_OCV_HP(SOC_HP[i]))
-        opti.subject_to(V_HE_aged[i] == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[i]))
-        opti.subject_to(V_HP_aged[i] == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[i]))
-
-        opti.subject_to(I_HE[i] == P_HE[i]/V_HE[i])
-        opti.subject_to(I_HP[i] == P_HP[i]/V_HP[i])
-        opti.subject_to(I_HE_aged[i] == P_HE[i]/V_HE_aged[i])
-        opti.subject_to(I_HP_aged[i] == P_HP[i]/V_HP_aged[i])
-
-        opti.subject_to(I_HE[i] + P_HE_joule[i]/V_HE[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP[i] + P_HP_joule[i]/V_HP[i] <= cell_HP.dis_current*N_HP)
-        opti.subject_to(I_HE_aged[i] + P_HE_joule_aged[i]/V_HE_aged[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP_aged[i] + P_HP_joule_aged[i]/V_HP_aged[i] <= cell_HP.dis_current*N_HP)
-
-    opti.subject_to(E_HE_used == sum(P_HE[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-    opti.subject_to(E_HP_used == sum(P_HP[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-
-    # Set initial values
-    opti.set_value(M_HE, V_bus/cell_HE.voltage)
-    opti.set_value(M_HP, V_bus/cell_HP.voltage)
-    opti.set_value(P_limit, limit)
+        dict_initial = aeneas(loads, cell_HE, cell_HP, V_bus, cycles, limit=limit)
 
-    if dict_initial != None:
-        opti.set_initial(P_HE, dict_initial["P_HE"])
-        opti.set_initial(P_HP, dict_initial["P_HP"])
-        opti.set_initial(N_HE, dict_initial["N_HE"] if dict_initial["N_HE"] != 0 else 1e-9)
-        opti.set_initial(N_HP, dict_initial["N_HP"] if dict_initial["N_HP"] != 0 else 1e-9)
-        opti.set_initial(SOC_HE, dict_initial["SOC_HE"])
-        opti.set_initial(SOC_HP, dict_initial["SOC_HP"])
-        opti.set_initial(V_HE, dict_initial["V_HE"])
-        opti.set_initial(V_HP, dict_initial["V_HP"])
-        opti.set_initial(I_HE, dict_initial["I_HE"])
-        opti.set_initial(I_HP, dict_initial["I_HE"])
-        opti.set_initial(P_HE_joule, dict_initial["P_HE_joule"])
-        opti.set_initial(P_HP_joule, dict_initial["P_HP_joule"])
-        opti.set_initial(SOC_HE_aged, dict_initial["SOC_HE_aged"])
-        opti.set_initial(SOC_HP_aged, dict_initial["SOC_HP_aged"])
-        opti.set_initial(V_HE_aged, dict_initial["V_HE_aged"])
-        opti.set_initial(V_HP_aged, dict_initial["V_HP_aged"])
-        opti.set_initial(I_HE_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(I_HP_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(P_HE_joule_aged, dict_initial["P_HE_joule_aged"])
-        opti.set_initial(P_HP_joule_aged, dict_initial["P_HP_joule_aged"])
-        opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
-        opti.set_initial(E_HP_aged, dict_initial["E_HP_aged"])
-        opti.set_initial(E_HE_used, dict_initial["E_HE_used"])
-        opti.set_initial(E_HP_used, dict_initial["E_HP_used"])
+    return solve("split", loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial, start_time, compiled)
 
 
-    # Start optimization
-    opti.minimize(obj)
-    options = {"ipopt": {"print_level": 1, "max_iter":3000}} #level5
-    opti.solver('ipopt', options)
-    try:
-        sol = opti.solve()
-    except:
-        opti.debug.show_infeasibilities()
-        print("[ERROR] Optimization Failed!")
-        # opti.debug.x_describe(index)
-        # opti.debug.g_describe(index)
-        exit()
+def aeneas_opti_energy(loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial=None, compiled=False):
+    multi.single(loads, "aeneas_opti_energy")
+    start_time = time.time()
+    if dict_initial == None:
+        dict_initial = aeneas_opti(loads, cell_HE, cell_HP, V_bus, cycles, limit=limit, dict_initial=None, compiled=compiled)
+    if failed(dict_initial):
+        return dict_initial
 
+    return solve("energy", loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial, start_time, compiled)
 
-    zero_HE = sol.value(N_HE) < 1e-3    # Check if there are HE cells in the solutions, to remove artifacts
-    zero_HP = sol.value(N_HP) < 1e-3    # Check if there are HP cells in the solutions, to remove artifacts
 
-    duration = (time.time() - start_time)*1000
-    result = {
-        "t": t,
-        "t_soc": t_soc,
-        "P": P,
-        "P_HE": sol.value(P_HE),
-        "P_HP": sol.value(P_HP),
-        "P_HE_joule": sol.value(P_HE_joule),
-        "P_HP_joule": sol.value(P_HP_joule),
-        "SOC_HE": np.full(len(t_soc), 0.9) if zero_HE else sol.value(SOC_HE),
-        "SOC_HP": np.full(len(t_soc), 0.9) if zero_HP else sol.value(SOC_HP),
-        "V_HE": np.full(len(t), sol.value(V_HE[0])) if zero_HE else sol.value(V_HE),
-        "V_HP": np.full(len(t), sol.value(V_HP[0])) if zero_HP else sol.value(V_HP),
-        "I_HE": sol.value(I_HE),
-        "I_HP": sol.value(I_HP),
-        "M_HE": sol.value(M_HE),
-        "M_HP": sol.value(M_HP),
-        "N_HE": sol.value(N_HE),
-        "N_HP": sol.value(N_HP),
-        "cost": sol.value(M_HE) * sol.value(N_HE) * cell_HE.cost + sol.value(M_HP) * sol.value(N_HP) * cell_HP.cost,
-        "losses": 0 + 0,
-        "efficiency": 0,
-        "P_HE_joule_aged": sol.value(P_HE_joule_aged),
-        "P_HP_joule_aged": sol.value(P_HP_joule_aged),
-        "SOC_HE_aged": np.full(len(t_soc), 0.9) if zero_HE else sol.value(SOC_HE_aged),
-        "SOC_HP_aged": np.full(len(t_soc), 0.9) if zero_HP else sol.value(SOC_HP_aged),
-        "V_HE_aged": np.full(len(t), sol.value(V_HE[0])) if zero_HE else sol.value(V_HE_aged),
-        "V_HP_aged": np.full(len(t), sol.value(V_HP[0])) if zero_HP else sol.value(V_HP_aged),
-        "I_HE_aged": sol.value(I_HE_aged),
-        "I_HP_aged": sol.value(I_HP_aged),
-        "E_HE": sol.value(M_HE) * sol.value(N_HE) * cell_HE.energy,
-        "E_HP": sol.value(M_HP) * sol.value(N_HP) * cell_HP.energy,
-        "E_HE_aged": sol.value(E_HE_aged),
-        "E_HP_aged": sol.value(E_HP_aged),
-        "I_HE_rated": sol.value(N_HE)*cell_HE.dis_current,
-        "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
-        "DOD_HE": 0,
-        "DOD_HP": 0,
-        "time": duration,
-        "method": "optimal"
-        #"limit": None
-    }
+def aeneas_opti_HP(loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial=None, compiled=False):
+    multi.single(loads, "aeneas_opti_HP")
+    start_time = time.time()
+    if dict_initial == None:
+        dict_initial = aeneas_opti(loads, cell_HE, cell_HP, V_bus, cycles, limit=limit, dict_initial=None, compiled=compiled)
+    if failed(dict_initial):
+        return dict_initial
 
-    return result
\ No newline at end of file
+    return solve("HP", loads, cell_HE, cell_HP, V_bus, cycles, limit, dict_initial, start_time, compiled)
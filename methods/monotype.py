@@ -1,21 +1,80 @@
 import numpy as np
 import time
 from scipy.integrate import cumtrapz
+from scipy.optimize import brentq
 import matplotlib.pyplot as plt
 import casadi as ca
 
+from funcs import simulation
+from funcs import ocv
+from funcs import multi
+from funcs import codegen
+from funcs.result import Result, failure
+
 """
 Calculate minimal battery size for monotype battery system (single cell technology)
 
     1. Calculate sizing for battery at beginning of life (BOL), make sure the battery contains enough energy and can deliver required currents
     2. Calculate cell degradation due to cycling as described in paper Mohsen (DOI: 10.3390/pr10112418), takes into account the number of cycles and depth of discharge
     3. Increase the size of the battery calculated in step 1 to offset the aging
+       with aging_resize=True, the BOL size is solved for so that the aged pack (aging at the DOD of that size) still holds the energy of step 1
 """
 
-# TODO - The aging should be calculated again after step 3!
 
+def resize_aging(P, t_soc, cell, M, E, cycles, tol=1e-3, max_iter=50, growth=2):
+    '''
+    Aging sizing: find the BOL energy E_BOL with E_BOL * (1 - 0.2*cycles/N_cycles(DOD(E_BOL))) = E, so that the pack still holds E (kWh) at EOL
 
-def monotype(loads, cell, V_bus, cycles=[0]):
+    The aged energy is below E at E_BOL = E, the bracket is grown by growth until it is above E, then the root is found by Brent's method until N
+    is known within tol. A fixed-point iteration E_BOL <- E/(1 - fade(E_BOL)) oscillates, the fade decreases with the size
+    Returns the BOL energy (kWh), the DOD at that size [0-100], the number of evaluations and whether it converged. The sizing fails (NaN energy)
+    when no size up to growth**max_iter times E keeps the aged energy above E (the pack loses all its energy before the cycles)
+    '''
+    evaluations = 0
+    def aged(E_BOL):
+        nonlocal evaluations
+        evaluations += 1
+        sim = simulation.simulate(P, t_soc, E_BOL, cell, M)
+        DOD = 100*(np.max(sim["SOC"]) - np.min(sim["SOC"]))   # Depth of Discharge [0-100]
+        N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
+        return E_BOL * (1 - 0.2 * (cycles/N_cycles)) - E, DOD
+
+    low, high = E, E
+    for _ in range(max_iter):
+        if aged(high)[0] >= 0:
+            break
+        low, high = high, high*growth
+    else:
+        print(f"[ERROR] Aging sizing failed, the pack loses its energy before {cycles} cycles at every size!")
+        return np.nan, np.nan, evaluations, False
+
+    if high == E:   # No aging
+        return E, aged(E)[1], evaluations, True
+
+    E_BOL, root = brentq(lambda E_BOL: aged(E_BOL)[0], low, high, xtol=tol * M * cell.energy, full_output=True, disp=False)
+    return E_BOL, aged(E_BOL)[1], evaluations, root.converged
+
+
+def aging_failure(t, t_soc, P, iterations, start_time):
+    '''
+    Failed result (see result.failure) of a monotype sizing whose aging resize has no solution
+    '''
+    duration = (time.time() - start_time)*1000
+    result = {
+        "t": t,
+        "t_soc": t_soc,
+        "P": P,
+        "status": "failed",
+        "return_status": "Aging_Resize_Failed",
+        "iterations": iterations,
+        "cost": np.nan,
+        "time": duration,
+    }
+
+    return Result(result)
+
+
+def monotype(loads, cell, V_bus, cycles=[0], tol=1e-3, aging_resize=False):
     start_time = time.time()
     # 1. Size battery at BOL (beginning of life)
     P = loads[0]["P"].values # W
@@ -23,65 +82,39 @@ def monotype(loads, cell, V_bus, cycles=[0]):
     t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
     M = (V_bus/cell.voltage) # Number of cells in series per string
 
-    SOC = np.full(len(t_soc), 0.9)  # State of Charge [0-1]
-    V = np.empty(len(t)) # Voltage (V)
-    I = np.empty(len(t)) # Current (A)
-    P_joule = np.empty(len(t)) # Joule losses (W)
-    I_joule = np.empty(len(t)) # Additional current drawn due to joule losses (A)
-
     E_req = np.max(cumtrapz(P/1000, t/3600, initial=0))/0.8 # kWh
     N = E_req / (V_bus/cell.voltage * cell.energy)          # Number of strings in parallel
 
-    while True:
-        E = M * N * cell.energy # Energy in battery pack
-        for i in range(len(t)):
-            SOC[i+1] = SOC[i] - (P[i] * (t_soc[i+1]-t_soc[i]) / (E*3.6e6)) if E != 0 else SOC[i]
-
-            V[i] = M * np.interp(SOC[i], cell.OCV_SOC, cell.OCV)
-            I[i] = P[i]/V[i]
-
-            P_joule[i] = cell.resistance*(I[i]**2)
-            I_joule[i] = P_joule[i] / V[i]
-
-        if np.max(I + I_joule) <= N*cell.dis_current: break # Check if current limits of battery pack are not exceeded, otherwise increase number of parallel strings
-
-        N = N + 1e-2
+    N, sim = simulation.size_strings(P, t_soc, cell, M, N, tol=tol) # Increase number of parallel strings until the current limits of the battery pack are not exceeded
+    E = M * N * cell.energy # Energy in battery pack
     
 
 
 
     ## 2. Calculate cell degradation (aging)
-    DOD = 100*(np.max(SOC) - np.min(SOC))   # Depth of Discharge [0-100]
-    N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
-    E_loss = E * 0.2 * (cycles[0]/N_cycles) # Energy which will be lost due to degradation at EOL (kWh)
-
-
     ## 3. Adjust sizing for aging (EOL)
-    E = E + E_loss      # Battery energy (kWh) at BOL
-    E_aged = E - E_loss # Battery energy (kWh) at EOL
-    N = E / (M * cell.energy)
-
-    SOC_aged = np.full(len(t_soc), 0.9) if E_aged != 0 else np.full(len(t_soc), 0)
-    V_aged = np.empty(len(t))
-    I_aged = np.empty(len(t))
-    P_joule_aged = np.empty(len(t))
-    I_joule_aged = np.empty(len(t))
+    if aging_resize:
+        E_aged = E # Battery energy (kWh) at EOL
+        E, DOD, iterations, converged = resize_aging(P, t_soc, cell, M, E_aged, cycles[0], tol=tol) # Battery energy (kWh) at BOL
+        if np.isnan(E):
+            return aging_failure(t, t_soc, P, iterations, start_time)
+    else:
+        DOD = 100*(np.max(sim["SOC"]) - np.min(sim["SOC"]))   # Depth of Discharge [0-100]
+        N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
+        E_loss = E * 0.2 * (cycles[0]/N_cycles) # Energy which will be lost due to degradation at EOL (kWh)
 
-    for i in range(len(t)):
-        SOC[i+1]        = SOC[i]        - (P[i] * (t_soc[i+1]-t_soc[i]) / (E*3.6e6))        if E != 0       else SOC[i]
-        SOC_aged[i+1]   = SOC_aged[i]   - (P[i] * (t_soc[i+1]-t_soc[i]) / (E_aged*3.6e6))   if E_aged != 0  else SOC_aged[i]
-
-        V[i]        = M * np.interp(SOC[i], cell.OCV_SOC, cell.OCV)
-        V_aged[i]   = M * np.interp(SOC_aged[i], cell.OCV_SOC, cell.OCV)
-
-        I[i]        = P[i]/V[i]
-        I_aged[i]   = P[i]/V_aged[i]
+        E = E + E_loss      # Battery energy (kWh) at BOL
+        E_aged = E - E_loss # Battery energy (kWh) at EOL
+        iterations = 1
+        converged = True
+    N = E / (M * cell.energy)
 
-        P_joule[i]      = cell.resistance*(I[i]**2)
-        P_joule_aged[i] = cell.resistance*(I_aged[i]**2)
+    sim = simulation.simulate_life(P, t_soc, E, E_aged, cell, M, SOC_0=[0.9, 0.9 if E_aged != 0 else 0]) # BOL and EOL in one pass
 
-        I_joule[i]      = P_joule[i]        / V[i]
-        I_joule_aged[i] = P_joule_aged[i]   / V_aged[i]
+    SOC, SOC_aged = sim["SOC"]
+    V, V_aged = sim["V"]
+    I, I_aged = sim["I"]
+    P_joule, P_joule_aged = sim["P_joule"]
 
 
     # Plot comparison between BOL and EOL
@@ -116,16 +149,25 @@ def monotype(loads, cell, V_bus, cycles=[0]):
         "E": E,
         "E_aged": E_aged,
         "I_rated": N * cell.dis_current,
+        "DOD": DOD,
+        "iterations": iterations,
+        "converged": converged,
         "time": duration
     }
 
-    return result
+    return Result(result)
 
 
-def monotype2(loads, cell, V_bus, cycles=[0]):
+def monotype2(loads, cell, V_bus, cycles=[0], tol=1e-3, aging_resize=False, compiled=False):
     '''
     This functions calculates a quick initial solution, then uses CasADi to find optimal monotype solution
+    Several loads are sized together with monotype_multi (aging_resize is for a single load)
     '''
+    if len(loads) > 1:
+        if aging_resize:
+            raise ValueError(f"aging_resize sizes a single load, got {len(loads)} loads")
+        return monotype_multi(loads, cell, V_bus, cycles=cycles, tol=tol, compiled=compiled)
+
     start_time = time.time()
     # 1. Size battery at BOL (beginning of life)
     P = loads[0]["P"].values # W
@@ -133,62 +175,36 @@ def monotype2(loads, cell, V_bus, cycles=[0]):
     t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
     M = (V_bus/cell.voltage) # Number of cells in series per string
 
-    SOC = np.full(len(t_soc), 0.9)  # State of Charge [0-1]
-    V = np.empty(len(t)) # Voltage (V)
-    I = np.empty(len(t)) # Current (A)
-    P_joule = np.empty(len(t)) # Joule losses (W)
-    I_joule = np.empty(len(t)) # Additional current drawn due to joule losses (A)
-
     E_req = np.max(cumtrapz(P/1000, t/3600, initial=0))/0.8 # kWh
     N = E_req / (V_bus/cell.voltage * cell.energy)          # Number of strings in parallel
 
-    while True:
-        E = M * N * cell.energy # Energy in battery pack
-        for i in range(len(t)):
-            SOC[i+1] = SOC[i] - (P[i] * (t_soc[i+1]-t_soc[i]) / (E*3.6e6)) if E != 0 else SOC[i]
-
-            V[i] = M * np.interp(SOC[i], cell.OCV_SOC, cell.OCV)
-            I[i] = P[i]/V[i]
-
-            P_joule[i] = cell.resistance*(I[i]**2)
-            I_joule[i] = P_joule[i] / V[i]
-
-        if np.max(I + I_joule) <= N*cell.dis_current: break # Check if current limits of battery pack are not exceeded, otherwise increase number of parallel strings
-
-        N = N + 1e-2
+    N, sim = simulation.size_strings(P, t_soc, cell, M, N, tol=tol) # Increase number of parallel strings until the current limits of the battery pack are not exceeded
+    E = M * N * cell.energy # Energy in battery pack
     
     ## 2. Calculate cell degradation (aging)
-    DOD = 100*(np.max(SOC) - np.min(SOC))   # Depth of Discharge [0-100]
-    N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
-    E_loss = E * 0.2 * (cycles[0]/N_cycles) # Energy which will be lost due to degradation at EOL (kWh)
-
-
     ## 3. Adjust sizing for aging (EOL)
-    E = E + E_loss      # Battery energy (kWh) at BOL
-    E_aged = E - E_loss # Battery energy (kWh) at EOL
-    N = E / (M * cell.energy)
-
-    SOC_aged = np.full(len(t_soc), 0.9) if E_aged != 0 else np.full(len(t_soc), 0)
-    V_aged = np.empty(len(t))
-    I_aged = np.empty(len(t))
-    P_joule_aged = np.empty(len(t))
-    I_joule_aged = np.empty(len(t))
+    if aging_resize:
+        E_aged = E # Battery energy (kWh) at EOL
+        E, DOD, iterations, converged = resize_aging(P, t_soc, cell, M, E_aged, cycles[0], tol=tol) # Battery energy (kWh) at BOL
+        if np.isnan(E):
+            return aging_failure(t, t_soc, P, iterations, start_time)
+    else:
+        DOD = 100*(np.max(sim["SOC"]) - np.min(sim["SOC"]))   # Depth of Discharge [0-100]
+        N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
+        E_loss = E * 0.2 * (cycles[0]/N_cycles) # Energy which will be lost due to degradation at EOL (kWh)
 
-    for i in range(len(t)):
-        SOC[i+1]        = SOC[i]        - (P[i] * (t_soc[i+1]-t_soc[i]) / (E*3.6e6))        if E != 0       else SOC[i]
-        SOC_aged[i+1]   = SOC_aged[i]   - (P[i] * (t_soc[i+1]-t_soc[i]) / (E_aged*3.6e6))   if E_aged != 0  else SOC_aged[i]
-
-        V[i]        = M * np.interp(SOC[i], cell.OCV_SOC, cell.OCV)
-        V_aged[i]   = M * np.interp(SOC_aged[i], cell.OCV_SOC, cell.OCV)
-
-        I[i]        = P[i]/V[i]
-        I_aged[i]   = P[i]/V_aged[i]
+        E = E + E_loss      # Battery energy (kWh) at BOL
+        E_aged = E - E_loss # Battery energy (kWh) at EOL
+        iterations = 1
+        converged = True
+    N = E / (M * cell.energy)
 
-        P_joule[i]      = cell.resistance*(I[i]**2)
-        P_joule_aged[i] = cell.resistance*(I_aged[i]**2)
+    sim = simulation.simulate_life(P, t_soc, E, E_aged, cell, M, SOC_0=[0.9, 0.9 if E_aged != 0 else 0]) # BOL and EOL in one pass
 
-        I_joule[i]      = P_joule[i]        / V[i]
-        I_joule_aged[i] = P_joule_aged[i]   / V_aged[i]
+    SOC, SOC_aged = sim["SOC"]
+    V, V_aged = sim["V"]
+    I, I_aged = sim["I"]
+    P_joule, P_joule_aged = sim["P_joule"]
     
     result = {
         "t": t,
@@ -211,6 +227,7 @@ def monotype2(loads, cell, V_bus, cycles=[0]):
     }
 
     # -------------------------------------------
+    start_build = time.time()
     opti = ca.Opti()
     #DOD = 0.8*100
     M = opti.parameter()
@@ -248,21 +265,19 @@ def monotype2(loads, cell, V_bus, cycles=[0]):
     SOC[0] = ca.DM(0.9)
     E_used[0] = ca.DM(0)
     SOC_aged[0] = ca.DM(0.9)
-    SOC_TO_OCV = ca.interpolant('LUT', 'bspline', [cell.OCV_SOC], cell.OCV)
+    SOC_TO_OCV = ocv.lookup(cell)
 
-    for i in range(len(t)):
-        
-
-        opti.subject_to(SOC[i+1] == ca.if_else(N == 0, SOC[i], SOC[i]-((P[i]*(t_soc[i+1]-t_soc[i]))/(M*N*cell.energy*3.6e6))))
-        opti.subject_to(SOC_aged[i+1] == ca.if_else(N == 0, SOC_aged[i], SOC_aged[i]-((P[i]*(t_soc[i+1]-t_soc[i]))/(E_aged*3.6e6))))
-        opti.subject_to(E_used[i+1] == ca.if_else(N==0, E_used[i], E_used[i] + P[i]*(t_soc[i+1]-t_soc[i])/3.6e6))
-        opti.subject_to(V[i] == M*SOC_TO_OCV(SOC[i]))
-        opti.subject_to(V_aged[i] == M*SOC_TO_OCV(SOC_aged[i]))
-        opti.subject_to(I[i] == P[i]/V[i])
-        opti.subject_to(I_aged[i] == P[i]/V_aged[i])
-        opti.subject_to(I[i] + (P_joule[i]/V[i]) <= cell.dis_current*N)
-        opti.subject_to(I_aged[i] + (P_joule_aged[i]/V_aged[i]) <= cell.dis_current*N)
-        
+    dt = ca.DM(np.diff(t_soc)) # s
+    P_load = ca.DM(P)          # W
+    opti.subject_to(SOC[1:] == ca.if_else(N == 0, SOC[:-1], SOC[:-1]-((P_load*dt)/(M*N*cell.energy*3.6e6))))
+    opti.subject_to(SOC_aged[1:] == ca.if_else(N == 0, SOC_aged[:-1], SOC_aged[:-1]-((P_load*dt)/(E_aged*3.6e6))))
+    opti.subject_to(E_used[1:] == ca.if_else(N==0, E_used[:-1], E_used[:-1] + P_load*dt/3.6e6))
+    opti.subject_to(V == M*SOC_TO_OCV(SOC[:-1].T).T)
+    opti.subject_to(V_aged == M*SOC_TO_OCV(SOC_aged[:-1].T).T)
+    opti.subject_to(I == P_load/V)
+    opti.subject_to(I_aged == P_load/V_aged)
+    opti.subject_to(I + (P_joule/V) <= cell.dis_current*N)
+    opti.subject_to(I_aged + (P_joule_aged/V_aged) <= cell.dis_current*N)
 
 
     # Set initial values
@@ -283,14 +298,17 @@ def monotype2(loads, cell, V_bus, cycles=[0]):
     opti.minimize(obj)
     options = {"ipopt": {"print_level": 2, "max_iter":3000}} #level5
     opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
     try:
-        sol = opti.solve()
-    except:
+        sol = codegen.solve(opti, "ipopt", options) if compiled else opti.solve()
+    except Exception:
         opti.debug.show_infeasibilities()
         print("[ERROR] Optimization Failed!")
         # opti.debug.x_describe(index)
         # opti.debug.g_describe(index)
-        exit()
+        return failure(opti, {}, {"t": t, "t_soc": t_soc, "P": P}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
 
     duration = (time.time() - start_time)*1000
     print(f"Monotype solution found! \t[{duration:0.2f} ms]")
@@ -314,6 +332,10 @@ def monotype2(loads, cell, V_bus, cycles=[0]):
         "E": sol.value(M)*sol.value(N)*cell.energy,
         "E_aged": sol.value(E_aged),
         "I_rated": sol.value(N) * cell.dis_current,
+        "iterations": iterations,
+        "converged": converged,
+        "time_build": time_build,
+        "time_solve": time_solve,
         "time": duration,
 
         "P_HE": P if cell.dis_rate < 2 else P*0,
@@ -350,90 +372,62 @@ def monotype2(loads, cell, V_bus, cycles=[0]):
     print(f"--> Depth of Discharge: {sol.value(DOD)}")
 
 
-    return result
+    return Result(result)
 
 
 
 
 
-def monotype_multi(loads, cell, V_bus, cycles=[0]):
+def monotype_multi(loads, cell, V_bus, cycles=[0], tol=1e-3, compiled=False):
     '''
     This functions calculates a quick initial solution, then uses CasADi to find optimal monotype solution
+
+    Any number of profiles (loads), each with its own number of cycles, share one pack; the trajectories of the result are lists with one array per profile
     '''
     start_time = time.time()
 
     M = (V_bus/cell.voltage)
-    N, P, t, t_soc, SOC, V, I, P_joule, I_joule, E_aged, SOC_aged, V_aged, I_aged, P_joule_aged, I_joule_aged, DOD = [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], []
-
-    for i in range(len(loads)):
-        P.append(loads[i]["P"].values) # (W)
-        t.append(loads[i]["t"].values) # (s)
-        t_soc.append(np.append(t[i], t[i][-1] + (t[i][-1] - t[i][-2]))) # (s)
-
-        SOC.append(np.full(len(t_soc[i]), 0.9))  # State of Charge [0-1]
-        V.append(np.empty(len(t[i])))            # Voltage (V)
-        I.append(np.empty(len(t[i])))            # Current (A)
-        P_joule.append(np.empty(len(t[i])))      # Joule losses (W)
-        I_joule.append(np.empty(len(t[i])))      # Additional current drawn due to joule losses (A)
+    cycles = np.broadcast_to(np.asarray(cycles, dtype=float), (len(loads),))
 
-        E_req = np.max(cumtrapz(P[i]/1000, t[i]/3600, initial=0))/0.8     # Required energy (kWh)
-        N.append(E_req / (V_bus/cell.voltage * cell.energy))        # Number of strings in parallel
+    # All profiles as one padded 2D array (profiles x samples), sized and simulated together
+    P_2D, t_2D, t_soc_2D, lengths = simulation.stack(loads)
 
-        while True:
-            E = M * N[i] * cell.energy # Energy in battery pack
-            for j in range(len(t[i])):
-                SOC[i][j+1] = SOC[i][j] - (P[i][j] * (t_soc[i][j+1]-t_soc[i][j]) / (E*3.6e6)) if E != 0 else SOC[i][j]
+    E_req = np.max(cumtrapz(P_2D/1000, t_2D/3600, initial=0, axis=-1), axis=-1)/0.8 # Required energy (kWh)
+    N = E_req / (V_bus/cell.voltage * cell.energy) # Number of strings in parallel
 
-                V[i][j] = M * np.interp(SOC[i][j], cell.OCV_SOC, cell.OCV)
-                I[i][j] = P[i][j]/V[i][j]
+    N, sim = simulation.size_strings(P_2D, t_soc_2D, cell, M, N, tol=tol) # Increase number of parallel strings until the current limits of the battery pack are not exceeded
+    E = M * N * cell.energy # Energy in battery pack
 
-                P_joule[i][j] = cell.resistance*(I[i][j]**2)
-                I_joule[i][j] = P_joule[i][j] / V[i][j]
-
-            if np.max(I[i] + I_joule[i]) <= N[i]*cell.dis_current: break # Check if current limits of battery pack are not exceeded, otherwise increase number of parallel strings
-
-            N[i] += 5e-2
-
-        # ## 2. Calculate cell degradation (aging)
-        DOD.append(100*(np.max(SOC[i]) - np.min(SOC[i])))   # Depth of Discharge [0-100]
-        N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD[i]) + cell.aging[2]*np.exp(cell.aging[3]*DOD[i]) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
-        E_loss = E * 0.2 * (cycles[i]/N_cycles) if N_cycles !=0 else 0 # Energy which will be lost due to degradation at EOL (kWh)
-
-        ## 3. Adjust sizing for aging (EOL)
-        E = E + E_loss      # Battery energy (kWh) at BOL
-        E_aged.append(E - E_loss) # Battery energy (kWh) at EOL
-
-        N[i] = E / (M * cell.energy)
+    ## 2. Calculate cell degradation (aging)
+    DOD = 100*(np.max(sim["SOC"], axis=-1) - np.min(sim["SOC"], axis=-1))   # Depth of Discharge [0-100]
+    N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
+    E_loss = np.where(N_cycles != 0, E * 0.2 * (cycles/N_cycles), 0) # Energy which will be lost due to degradation at EOL (kWh)
 
-        # ----------------------------------------------------------
+    ## 3. Adjust sizing for aging (EOL)
+    N = (E + E_loss) / (M * cell.energy)
 
-    for i in range(len(loads)):
-        E = max(N) * M * cell.energy
+    # ----------------------------------------------------------
 
-        for j in range(len(t[i])):
-            SOC[i][j+1] = SOC[i][j] - (P[i][j] * (t_soc[i][j+1]-t_soc[i][j]) / (E*3.6e6)) if E != 0 else SOC[i][j]
-            V[i][j] = M * np.interp(SOC[i][j], cell.OCV_SOC, cell.OCV)
-            I[i][j] = P[i][j]/V[i][j]
-            P_joule[i][j] = cell.resistance*(I[i][j]**2)
-            I_joule[i][j] = P_joule[i][j] / V[i][j]
+    # All profiles share the largest pack
+    E = np.max(N) * M * cell.energy
+    sim = simulation.simulate(P_2D, t_soc_2D, np.full(len(loads), E), cell, M)
 
-        DOD[i] = 100*(np.max(SOC[i]) - np.min(SOC[i]))   # Depth of Discharge [0-100]
-        N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD[i]) + cell.aging[2]*np.exp(cell.aging[3]*DOD[i]) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
-        E_loss = E * 0.2 * (cycles[i]/N_cycles) if N_cycles != 0 else 0# Energy which will be lost due to degradation at EOL (kWh)
-        E_aged[i] = (E - E_loss) # Battery energy (kWh) at EOL
+    DOD = 100*(np.max(sim["SOC"], axis=-1) - np.min(sim["SOC"], axis=-1))   # Depth of Discharge [0-100]
+    N_cycles = cell.aging[0]*np.exp(cell.aging[1]*DOD) + cell.aging[2]*np.exp(cell.aging[3]*DOD) # Number of cycles which can be performed before initial energy of battery is shrinked by 20%
+    E_loss = np.where(N_cycles != 0, E * 0.2 * (cycles/N_cycles), 0) # Energy which will be lost due to degradation at EOL (kWh)
+    E_aged = E - E_loss # Battery energy (kWh) at EOL
 
-        SOC_aged.append(np.full(len(t_soc[i]), 0.9))
-        V_aged.append(np.empty(len(t[i])))
-        I_aged.append(np.empty(len(t[i])))
-        P_joule_aged.append(np.empty(len(t[i])))
-        I_joule_aged.append(np.empty(len(t[i])))
+    sim_aged = simulation.simulate(P_2D, t_soc_2D, E_aged, cell, M)
 
-        for j in range(len(t[i])):
-            SOC_aged[i][j+1] = SOC_aged[i][j] - (P[i][j] * (t_soc[i][j+1]-t_soc[i][j]) / (E_aged[i]*3.6e6)) if E_aged[i] != 0  else SOC_aged[i][j]           
-            V_aged[i][j] = M * np.interp(SOC_aged[i][j], cell.OCV_SOC, cell.OCV)           
-            I_aged[i][j] = P[i][j]/V_aged[i][j]           
-            P_joule_aged[i][j] = cell.resistance*(I_aged[i][j]**2)           
-            I_joule_aged[i][j] = P_joule_aged[i][j]   / V_aged[i][j]
+    # Trim the padding, one array per profile
+    P = [P_2D[i, :n] for i, n in enumerate(lengths)]
+    t = [t_2D[i, :n] for i, n in enumerate(lengths)]
+    t_soc = [t_soc_2D[i, :n+1] for i, n in enumerate(lengths)]
+    SOC, SOC_aged = [sim["SOC"][i, :n+1] for i, n in enumerate(lengths)], [sim_aged["SOC"][i, :n+1] for i, n in enumerate(lengths)]
+    V, V_aged = [sim["V"][i, :n] for i, n in enumerate(lengths)], [sim_aged["V"][i, :n] for i, n in enumerate(lengths)]
+    I, I_aged = [sim["I"][i, :n] for i, n in enumerate(lengths)], [sim_aged["I"][i, :n] for i, n in enumerate(lengths)]
+    P_joule, P_joule_aged = [sim["P_joule"][i, :n] for i, n in enumerate(lengths)], [sim_aged["P_joule"][i, :n] for i, n in enumerate(lengths)]
+    DOD, E_aged = list(DOD), list(E_aged)
 
     duration = (time.time() - start_time)*1000
     
@@ -462,159 +456,86 @@ def monotype_multi(loads, cell, V_bus, cycles=[0]):
 
 
     ## CASADI OPTIMIZATION
+    # One pack shared by all profiles, the constraints of every profile are one Function mapped over the columns (profiles) of the decision variables
+    start_build = time.time()
     opti = ca.Opti()
     M = opti.parameter()
+    K = len(loads)
+    n = P_2D.shape[1]
+    dt = np.diff(t_soc_2D, axis=-1).T # s, one column per profile
 
     # Decision variables
     N = opti.variable(1, 1)
-    DOD = opti.variable(len(loads), 1)
-    E_aged = opti.variable(len(loads), 1)
-
-    SOC1 = opti.variable(len(t_soc[0]), 1)
-    V1 = opti.variable(len(t[0]), 1)
-    I1 = opti.variable(len(t[0]), 1)
-    P_joule1 = opti.variable(len(t[0]), 1)
-    SOC1_aged = opti.variable(len(t_soc[0]), 1)
-    V1_aged = opti.variable(len(t[0]), 1)
-    I1_aged = opti.variable(len(t[0]), 1)
-    P_joule1_aged = opti.variable(len(t[0]), 1)
-    E_used1 = opti.variable(len(t_soc[0]), 1)
-
-    if len(loads) >= 2:
-        SOC2 = opti.variable(len(t_soc[1]), 1)
-        V2 = opti.variable(len(t[1]), 1)
-        I2 = opti.variable(len(t[1]), 1)
-        P_joule2 = opti.variable(len(t[1]), 1)
-        SOC2_aged = opti.variable(len(t_soc[1]), 1)
-        V2_aged = opti.variable(len(t[1]), 1)
-        I2_aged = opti.variable(len(t[1]), 1)
-        P_joule2_aged = opti.variable(len(t[1]), 1)
-        E_used2 = opti.variable(len(t_soc[1]), 1)
+    DOD = opti.variable(1, K)
+    E_aged = opti.variable(1, K)
+    SOC = opti.variable(n, K)       # SOC after every sample, one column per profile [0-1]
+    SOC_aged = opti.variable(n, K)
 
     # Objective function
     obj = M * N * cell.cost
 
     # Constraints
+    equality, margin, V, I, P_joule, V_aged, I_aged, P_joule_aged = multi.mapped(multi.pack(cell, n), K)(P_2D.T, dt, SOC, SOC_aged, multi.used(SOC, lengths), N, M, E_aged, DOD, ca.DM(cycles).T)
     opti.subject_to([
         N >= 0,
-        SOC1 <= 0.9,
-        SOC1 >= 0.1,
-        SOC1_aged <= 0.9,
-        SOC1_aged >= 0.1,
-        P_joule1 == cell.resistance * (I1**2),
-        P_joule1_aged == cell.resistance * (I1_aged**2),
-        
-        E_aged[0] == (M*N*cell.energy) * (1 - 0.2 * (cycles[0]/(cell.aging[0]*ca.exp(cell.aging[1]*DOD[0])+cell.aging[2]*ca.exp(cell.aging[3]*DOD[0])))),
-        DOD[0] == E_used1[-1]/(M*N*cell.energy)*100#0.8*100#(ca.mmax(SOC) - ca.mmin(SOC))*100
+        ca.vec(SOC) <= 0.9,
+        ca.vec(SOC) >= 0.1,
+        ca.vec(SOC_aged) <= 0.9,
+        ca.vec(SOC_aged) >= 0.1,
+        ca.vec(equality) == 0,
+        ca.vec(margin) <= 0,
     ])
 
-    SOC1[0] = ca.DM(0.9)
-    E_used1[0] = ca.DM(0)
-    SOC1_aged[0] = ca.DM(0.9)
-
-    if len(loads) >= 2:
-        opti.subject_to([
-            SOC2 <= 0.9,
-            SOC2 >= 0.1,
-            SOC2_aged <= 0.9,
-            SOC2_aged >= 0.1,
-            P_joule2 == cell.resistance * (I2**2),
-            P_joule2_aged == cell.resistance * (I2_aged**2),
-            
-            E_aged[1] == (M*N*cell.energy) * (1 - 0.2 * (cycles[1]/(cell.aging[0]*ca.exp(cell.aging[1]*DOD[1])+cell.aging[2]*ca.exp(cell.aging[3]*DOD[1])))),
-            DOD[1] == E_used2[-1]/(M*N*cell.energy)*100#0.8*100#(ca.mmax(SOC) - ca.mmin(SOC))*100
-        ])
-
-        SOC2[0] = ca.DM(0.9)
-        E_used2[0] = ca.DM(0)
-        SOC2_aged[0] = ca.DM(0.9)
-       
-    SOC_TO_OCV = ca.interpolant('LUT', 'bspline', [cell.OCV_SOC], cell.OCV)
-
-    for i in range(len(t[0])):
-        opti.subject_to(SOC1[i+1] == ca.if_else(N == 0, SOC1[i], SOC1[i]-((P[0][i]*(t_soc[0][i+1]-t_soc[0][i]))/(M*N*cell.energy*3.6e6))))
-        opti.subject_to(SOC1_aged[i+1] == ca.if_else(N == 0, SOC1_aged[i], SOC1_aged[i]-((P[0][i]*(t_soc[0][i+1]-t_soc[0][i]))/(E_aged[0]*3.6e6))))
-        opti.subject_to(E_used1[i+1] == ca.if_else(N==0, E_used1[i], E_used1[i] + P[0][i]*(t_soc[0][i+1]-t_soc[0][i])/3.6e6))
-        opti.subject_to(V1[i] == M*SOC_TO_OCV(SOC1[i]))
-        opti.subject_to(V1_aged[i] == M*SOC_TO_OCV(SOC1_aged[i]))
-        opti.subject_to(I1[i] == P[0][i]/V1[i])
-        opti.subject_to(I1_aged[i] == P[0][i]/V1_aged[i])
-        opti.subject_to(I1[i] + (P_joule1[i]/V1[i]) <= cell.dis_current*N)
-        opti.subject_to(I1_aged[i] + (P_joule1_aged[i]/V1_aged[i]) <= cell.dis_current*N)
-
-    if len(loads) >= 2:
-        for i in range(len(t[1])):
-            opti.subject_to(SOC2[i+1] == ca.if_else(N == 0, SOC2[i], SOC2[i]-((P[1][i]*(t_soc[1][i+1]-t_soc[1][i]))/(M*N*cell.energy*3.6e6))))
-            opti.subject_to(SOC2_aged[i+1] == ca.if_else(N == 0, SOC2_aged[i], SOC2_aged[i]-((P[1][i]*(t_soc[1][i+1]-t_soc[1][i]))/(E_aged[1]*3.6e6))))
-            opti.subject_to(E_used2[i+1] == ca.if_else(N==0, E_used2[i], E_used2[i] + P[1][i]*(t_soc[1][i+1]-t_soc[1][i])/3.6e6))
-            opti.subject_to(V2[i] == M*SOC_TO_OCV(SOC2[i]))
-            opti.subject_to(V2_aged[i] == M*SOC_TO_OCV(SOC2_aged[i]))
-            opti.subject_to(I2[i] == P[1][i]/V2[i])
-            opti.subject_to(I2_aged[i] == P[1][i]/V2_aged[i])
-            opti.subject_to(I2[i] + (P_joule2[i]/V2[i]) <= cell.dis_current*N)
-            opti.subject_to(I2_aged[i] + (P_joule2_aged[i]/V2_aged[i]) <= cell.dis_current*N)
-
-    
     # Set initial values
     opti.set_value(M, V_bus/cell.voltage)
     opti.set_initial(N, result["N"])
-    opti.set_initial(SOC1, result["SOC"][0])
-    opti.set_initial(SOC1_aged, result["SOC_aged"][0])
-    opti.set_initial(V1, result["V"][0])
-    opti.set_initial(V1_aged, result["V_aged"][0])
-    opti.set_initial(I1, result["I"][0])
-    opti.set_initial(I1_aged, result["I_aged"][0])
-    opti.set_initial(P_joule1, result["P_joule"][0])
-    opti.set_initial(P_joule1_aged, result["P_joule_aged"][0])
+    opti.set_initial(SOC, sim["SOC"][:, 1:].T)
+    opti.set_initial(SOC_aged, sim_aged["SOC"][:, 1:].T)
     opti.set_initial(E_aged, result["E_aged"])
     opti.set_initial(DOD, result["DOD"])
 
-    if len(loads) >= 2:
-        opti.set_initial(SOC2, result["SOC"][1])
-        opti.set_initial(SOC2_aged, result["SOC_aged"][1])
-        opti.set_initial(V2, result["V"][1])
-        opti.set_initial(V2_aged, result["V_aged"][1])
-        opti.set_initial(I2, result["I"][1])
-        opti.set_initial(I2_aged, result["I_aged"][1])
-        opti.set_initial(P_joule2, result["P_joule"][1])
-        opti.set_initial(P_joule2_aged, result["P_joule_aged"][1])
-
     # Start optimization
     opti.minimize(obj)
-    options = {"ipopt": {"print_level": 2, "max_iter":3000}} #level5
+    options = {"expand": multi.expand(), "ipopt": {"print_level": 2, "max_iter":3000}} #level5
     opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
     try:
-        sol = opti.solve()
-    except:
+        sol = codegen.solve(opti, "ipopt", options) if compiled else opti.solve()
+    except Exception:
         opti.debug.show_infeasibilities()
         print("[ERROR] Optimization Failed!")
-        exit()
+        return failure(opti, {}, {"t": t, "t_soc": t_soc, "P": P}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
 
     duration = (time.time() - start_time)*1000
+    SOC_0 = np.full((1, K), 0.9)
 
     result = {
         "t": t,
         "t_soc": t_soc,
         "P": P,
-        "P_joule": [sol.value(P_joule1)] if len(loads) == 1 else [sol.value(P_joule1), sol.value(P_joule2)],
-        "SOC": [sol.value(SOC1)] if len(loads) == 1 else [sol.value(SOC1), sol.value(SOC2)],
-        "V": [sol.value(V1)] if len(loads) == 1 else [sol.value(V1), sol.value(V2)],
-        "I": [sol.value(I1)] if len(loads) == 1 else [sol.value(I1), sol.value(I2)],
+        "P_joule": multi.trim(sol.value(P_joule), lengths),
+        "SOC": multi.trim(np.vstack((SOC_0, sol.value(SOC).reshape(n, K))), lengths, extra=1),
+        "V": multi.trim(sol.value(V), lengths),
+        "I": multi.trim(sol.value(I), lengths),
         "M": sol.value(M),
         "N": sol.value(N),
-        "DOD": sol.value(DOD),
+        "DOD": list(np.atleast_1d(sol.value(DOD))),
         "cost": sol.value(M)*sol.value(N)*cell.cost,
-        "P_joule_aged": [sol.value(P_joule1_aged)] if len(loads) == 1 else [sol.value(P_joule1_aged), sol.value(P_joule2_aged)],
-        "SOC_aged": [sol.value(SOC1_aged)] if len(loads) == 1 else [sol.value(SOC1_aged), sol.value(SOC2_aged)],
-        "V_aged": [sol.value(V1_aged)] if len(loads) == 1 else [sol.value(V1_aged), sol.value(V2_aged)],
-        "I_aged": [sol.value(I1_aged)] if len(loads) == 1 else [sol.value(I1_aged), sol.value(I2_aged)],
+        "P_joule_aged": multi.trim(sol.value(P_joule_aged), lengths),
+        "SOC_aged": multi.trim(np.vstack((SOC_0, sol.value(SOC_aged).reshape(n, K))), lengths, extra=1),
+        "V_aged": multi.trim(sol.value(V_aged), lengths),
+        "I_aged": multi.trim(sol.value(I_aged), lengths),
         "E": sol.value(M)*sol.value(N)*cell.energy,
-        "E_aged": sol.value(E_aged),
+        "E_aged": list(np.atleast_1d(sol.value(E_aged))),
         "I_rated": sol.value(N) * cell.dis_current,
+        "time_build": time_build,
+        "time_solve": time_solve,
         "time": duration
     }
 
-    return result
+    return Result(result)
 
 
 
@@ -3,9 +3,21 @@ import numpy as np
 from scipy.integrate import cumtrapz
 import time
 
-def optimal(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False, dict_initial=None):
+from funcs import simulation
+from funcs import ocv
+from funcs import warmstart
+from funcs import ocp
+from funcs import multi
+from funcs import codegen
+from funcs.result import Result, failure
+from methods import treshold
+
+def optimal(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False, dict_initial=None, compiled=False):
+    multi.single(loads, "optimal")
     start_time = time.time()
+    start_build = time.time()
     opti = ca.Opti()
+    blocks = {}
 
     P = loads[0]["P"].values # W
     t = loads[0]["t"].values # s
@@ -35,46 +47,54 @@ def optimal(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False,
           # 1000 * (ca.sum1(P_HE_joule)/np.sum(P)) + (ca.sum1(P_HP_joule)/np.sum(P))) # Minimize joule losses
 
     # Constraints
-    opti.subject_to([
-        P_HE + P_HP == P,
-        N_HE >= 0, # May not be 0 to avoid division by 0
-        N_HP >= 0,
+    warmstart.subject_to(opti, blocks, {
+        "P": P_HE + P_HP == P,
+        "N_HE_min": N_HE >= 0, # May not be 0 to avoid division by 0
+        "N_HP_min": N_HP >= 0,
         
-        SOC_HE <= 0.9,
-        SOC_HP <= 0.9,
-        SOC_HE >= 0.1,
-        SOC_HP >= 0.1,
+        "SOC_HE_max": SOC_HE <= 0.9,
+        "SOC_HP_max": SOC_HP <= 0.9,
+        "SOC_HE_min": SOC_HE >= 0.1,
+        "SOC_HP_min": SOC_HP >= 0.1,
 
         # SOC_HE[-1] == ca.if_else(N_HE == 0, 0.9, 0.1), # <- GIVES ERROR
         # SOC_HP[-1] == ca.if_else(N_HP == 0, 0.9, 0.1),
 
-        P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
-        ])
+        "P_HE_joule": P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
+        "P_HP_joule": P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
+        })
     
     if not bool_intercharge:
-        opti.subject_to([
-            P_HE >= 0,
-            P_HP >= 0,
-        ])
+        warmstart.subject_to(opti, blocks, {
+            "P_HE_min": P_HE >= 0,
+            "P_HP_min": P_HP >= 0,
+        })
 
     SOC_HE[0] = ca.DM(0.9)
     SOC_HP[0] = ca.DM(0.9)
-    SOC_TO_OCV_HE = ca.interpolant('LUT', 'bspline', [cell_HE.OCV_SOC], cell_HE.OCV)
-    SOC_TO_OCV_HP = ca.interpolant('LUT', 'bspline', [cell_HP.OCV_SOC], cell_HP.OCV)
-
-    for i in range(len(t)):
-        opti.subject_to(SOC_HE[i+1] == ca.if_else(N_HE == 0, SOC_HE[i], SOC_HE[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((M_HE*N_HE*cell_HE.energy*3.6e6)))))
-        opti.subject_to(SOC_HP[i+1] == ca.if_else(N_HP == 0, SOC_HP[i], SOC_HP[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((M_HP*N_HP*cell_HP.energy*3.6e6)))))
-
-        opti.subject_to(V_HE[i] == M_HE*SOC_TO_OCV_HE(SOC_HE[i]))
-        opti.subject_to(V_HP[i] == M_HP*SOC_TO_OCV_HP(SOC_HP[i]))
-
-        opti.subject_to(I_HE[i] == P_HE[i]/V_HE[i])
-        opti.subject_to(I_HP[i] == P_HP[i]/V_HP[i])
-
-        opti.subject_to(I_HE[i] + P_HE_joule[i]/V_HE[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP[i] + P_HP_joule[i]/V_HP[i] <= cell_HP.dis_current*N_HP)
+    SOC_TO_OCV_HE = ocv.lookup(cell_HE)
+    SOC_TO_OCV_HP = ocv.lookup(cell_HP)
+
+    dt = ca.DM(np.diff(t_soc)) # s
+    warmstart.subject_to(opti, blocks, {
+        "SOC_HE": SOC_HE[1:] == ca.if_else(N_HE == 0, SOC_HE[:-1], SOC_HE[:-1] - ((P_HE*dt)/((M_HE*N_HE*cell_HE.energy*3.6e6)))),
+        "SOC_HP": SOC_HP[1:] == ca.if_else(N_HP == 0, SOC_HP[:-1], SOC_HP[:-1] - ((P_HP*dt)/((M_HP*N_HP*cell_HP.energy*3.6e6)))),
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "V_HE": V_HE == M_HE*SOC_TO_OCV_HE(SOC_HE[:-1].T).T,
+        "V_HP": V_HP == M_HP*SOC_TO_OCV_HP(SOC_HP[:-1].T).T,
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE": I_HE == P_HE/V_HE,
+        "I_HP": I_HP == P_HP/V_HP,
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE_max": I_HE + P_HE_joule/V_HE <= cell_HE.dis_current*N_HE,
+        "I_HP_max": I_HP + P_HP_joule/V_HP <= cell_HP.dis_current*N_HP,
+        })
 
     # Set initial values
     opti.set_value(M_HE, V_bus/cell_HE.voltage)
@@ -90,23 +110,27 @@ def optimal(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False,
         opti.set_initial(V_HE, dict_initial["V_HE"])
         opti.set_initial(V_HP, dict_initial["V_HP"])
         opti.set_initial(I_HE, dict_initial["I_HE"])
-        opti.set_initial(I_HP, dict_initial["I_HE"])
+        opti.set_initial(I_HP, dict_initial["I_HP"])
         opti.set_initial(P_HE_joule, dict_initial["P_HE_joule"])
         opti.set_initial(P_HP_joule, dict_initial["P_HP_joule"])
 
 
     # Start optimization
     opti.minimize(obj)
-    options = {"ipopt": {"print_level": 2, "max_iter":3000}} #level5
+    warm = warmstart.initial(opti, blocks, dict_initial, "cost")
+    options = {"ipopt": {"print_level": 2, "max_iter":3000, **warm}} #level5
     opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
     try:
-        sol = opti.solve()
-    except:
+        sol = codegen.solve(opti, "ipopt", options) if compiled else opti.solve()
+    except Exception:
         opti.debug.show_infeasibilities()
         print("[ERROR] Optimization Failed!")
         # opti.debug.x_describe(index)
         # opti.debug.g_describe(index)
-        exit()
+        return failure(opti, blocks, {"t": t, "t_soc": t_soc, "P": P, "method": "optimal"}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
 
     print(sol.value(obj))
     print(f"M_HE: {sol.value(M_HE)} & N_HE: {sol.value(N_HE)}")
@@ -164,145 +188,222 @@ def optimal(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False,
         "E_HP_aged": sol.value(M_HP) * sol.value(N_HP) * cell_HP.energy,
         "I_HE_rated": sol.value(N_HE)*cell_HE.dis_current,
         "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
+        "iterations": sol.stats()["iter_count"],
+        "warm_start": warmstart.save(opti, sol, blocks, "cost", options["ipopt"]),
+        "time_build": time_build,
+        "time_solve": time_solve,
         "time": duration,
         "method": "optimal"
         #"limit": None
     }
 
-    return result
+    return Result(result)
+
 
 
 
 
+def optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False, dict_initial=None, condensed=False, compiled=False, objective="cost", epsilon={}):
+    '''
+    condensed: only the sizes, the HE power, the SOC trajectories and the aging terms are decision variables, the HP power, voltages, currents and losses are
+               expressions of them (the SOC stays a variable, eliminating it as well makes the Jacobian and Hessian dense in the HE power)
+    objective: "cost" (cost of the cells plus weighted Joule losses), "losses" (Joule losses, kWh) or "weight" (weight of the cells, kg)
+    epsilon: upper bounds of these measures (dict name -> bound, e.g. {"cost": 4e5}), for the epsilon-constraint Pareto fronts (see pareto)
+             A bound on the losses is a dense Jacobian row (see simulation.used), the fronts bound the cost instead
+    Several loads are sized together with optimal_aging_multi, which minimises the cost only (condensed, objective and epsilon are for a single load)
+    '''
+    if len(loads) > 1:
+        if condensed or objective != "cost" or epsilon:
+            raise ValueError(f"condensed, objective and epsilon size a single load, got {len(loads)} loads")
+        return optimal_aging_multi(loads, cell_HE, cell_HP, V_bus, cycles=cycles, bool_intercharge=bool_intercharge, dict_initial=dict_initial, compiled=compiled)
 
-def optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False, dict_initial=None):
     start_time = time.time()
+    start_build = time.time()
     opti = ca.Opti()
+    blocks = {}
 
     P = loads[0]["P"].values # W
     t = loads[0]["t"].values # s
     t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
+    dt = ca.DM(np.diff(t_soc)) # s
 
     # Parameters
     M_HE = opti.parameter()
     M_HP = opti.parameter()
 
     # Decision variables
-    P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
-    P_HP = opti.variable(len(t),1)      # Power from HP battery       [W]
-    P_HE_joule = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE = opti.variable(len(t), 1)
-    V_HP = opti.variable(len(t), 1)
-    I_HE = opti.variable(len(t), 1)
-    I_HP = opti.variable(len(t), 1)
-
-    P_HE_joule_aged = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule_aged = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE_aged = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP_aged = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE_aged = opti.variable(len(t), 1)
-    V_HP_aged = opti.variable(len(t), 1)
-    I_HE_aged = opti.variable(len(t), 1)
-    I_HP_aged = opti.variable(len(t), 1)
-
-    E_HE_aged = opti.variable(1, 1)
-    E_HP_aged = opti.variable(1, 1)
-    DOD_HE = opti.variable(1, 1)
-    DOD_HP = opti.variable(1, 1)
-    E_HE_used = opti.variable(1, 1)
-    E_HP_used = opti.variable(1, 1)
+    if condensed:
+        P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
+        N_HE = opti.variable(1,1)           # Number of parallel HE strings []
+        N_HP = opti.variable(1,1)           # Number of parallel HP strings []
+        SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
+        SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
+        SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
+        SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
+        E_HE_aged = opti.variable(1, 1)
+        E_HP_aged = opti.variable(1, 1)
+        DOD_HE = opti.variable(1, 1)
+        DOD_HP = opti.variable(1, 1)
+
+        P_HP = P - P_HE                     # Power from HP battery       [W]
+
+        SOC_HE[0] = ca.DM(0.9)
+        SOC_HP[0] = ca.DM(0.9)
+        SOC_HE_aged[0] = ca.DM(0.9)
+        SOC_HP_aged[0] = ca.DM(0.9)
+        E_HE_used = simulation.used(SOC_HE, M_HE*N_HE*cell_HE.energy)
+        E_HP_used = simulation.used(SOC_HP, M_HP*N_HP*cell_HP.energy)
+        sim_HE = simulation.outputs(P_HE, SOC_HE, cell_HE, M_HE)
+        sim_HP = simulation.outputs(P_HP, SOC_HP, cell_HP, M_HP)
+        sim_HE_aged = simulation.outputs(P_HE, SOC_HE_aged, cell_HE, M_HE)
+        sim_HP_aged = simulation.outputs(P_HP, SOC_HP_aged, cell_HP, M_HP)
+        V_HE, I_HE, P_HE_joule = sim_HE["V"], sim_HE["I"], sim_HE["P_joule"]
+        V_HP, I_HP, P_HP_joule = sim_HP["V"], sim_HP["I"], sim_HP["P_joule"]
+        V_HE_aged, I_HE_aged, P_HE_joule_aged = sim_HE_aged["V"], sim_HE_aged["I"], sim_HE_aged["P_joule"]
+        V_HP_aged, I_HP_aged, P_HP_joule_aged = sim_HP_aged["V"], sim_HP_aged["I"], sim_HP_aged["P_joule"]
+    else:
+        P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
+        P_HP = opti.variable(len(t),1)      # Power from HP battery       [W]
+        P_HE_joule = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
+        P_HP_joule = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
+        N_HE = opti.variable(1,1)           # Number of parallel HE strings []
+        N_HP = opti.variable(1,1)           # Number of parallel HP strings []
+        SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
+        SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
+        V_HE = opti.variable(len(t), 1)
+        V_HP = opti.variable(len(t), 1)
+        I_HE = opti.variable(len(t), 1)
+        I_HP = opti.variable(len(t), 1)
+
+        P_HE_joule_aged = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
+        P_HP_joule_aged = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
+        N_HE_aged = opti.variable(1,1)           # Number of parallel HE strings []
+        N_HP_aged = opti.variable(1,1)           # Number of parallel HP strings []
+        SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
+        SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
+        V_HE_aged = opti.variable(len(t), 1)
+        V_HP_aged = opti.variable(len(t), 1)
+        I_HE_aged = opti.variable(len(t), 1)
+        I_HP_aged = opti.variable(len(t), 1)
+
+        E_HE_aged = opti.variable(1, 1)
+        E_HP_aged = opti.variable(1, 1)
+        DOD_HE = opti.variable(1, 1)
+        DOD_HP = opti.variable(1, 1)
+        E_HE_used = opti.variable(1, 1)
+        E_HP_used = opti.variable(1, 1)
 
     # Objective function
-    obj = ((M_HE*N_HE*cell_HE.cost) + (M_HP*N_HP*cell_HP.cost) + # Total cost of battery cells
-           #100000 * ((SOC_HE[-1]-0.1) + (SOC_HP[-1]-0.1)) + # End at minimum SOC
-           1000 * (ca.sum1(P_HE_joule)/np.sum(P)) + (ca.sum1(P_HP_joule)/np.sum(P)))  # Minimize joule losses
-           #+ 10 * ca.sum1(P_HE)/len(t)) # Minimize average HE power
+    measures = {
+        "cost": (M_HE*N_HE*cell_HE.cost) + (M_HP*N_HP*cell_HP.cost),                 # Total cost of battery cells (€)
+        "losses": ca.dot(P_HE_joule + P_HP_joule, dt)/3.6e6,                        # Joule losses (kWh)
+        "weight": (M_HE*N_HE*cell_HE.weight) + (M_HP*N_HP*cell_HP.weight),         # Total weight of battery cells (kg)
+    }
+    if objective == "cost":
+        obj = ((M_HE*N_HE*cell_HE.cost) + (M_HP*N_HP*cell_HP.cost) + # Total cost of battery cells
+               #100000 * ((SOC_HE[-1]-0.1) + (SOC_HP[-1]-0.1)) + # End at minimum SOC
+               1000 * (ca.sum1(P_HE_joule)/np.sum(P)) + (ca.sum1(P_HP_joule)/np.sum(P)))  # Minimize joule losses
+               #+ 10 * ca.sum1(P_HE)/len(t)) # Minimize average HE power
+    else:
+        obj = measures[objective]
 
     # Constraints
-    opti.subject_to([
-        P_HE + P_HP == P,
-        N_HE >= 0, # May not be 0 to avoid division by 0
-        N_HP >= 0,
+    if not condensed:
+        warmstart.subject_to(opti, blocks, {"P": P_HE + P_HP == P})
+
+    warmstart.subject_to(opti, blocks, {f"{measure}_max": measures[measure] <= bound for measure, bound in epsilon.items()})
+
+    warmstart.subject_to(opti, blocks, {
+        "N_HE_min": N_HE >= 0, # May not be 0 to avoid division by 0
+        "N_HP_min": N_HP >= 0,
         
-        SOC_HE <= 0.9,
-        SOC_HP <= 0.9,
-        SOC_HE >= 0.1,
-        SOC_HP >= 0.1,
-        SOC_HE_aged <= 0.9,
-        SOC_HP_aged <= 0.9,
-        SOC_HE_aged >= 0.1,
-        SOC_HP_aged >= 0.1,
+        "SOC_HE_max": SOC_HE <= 0.9,
+        "SOC_HP_max": SOC_HP <= 0.9,
+        "SOC_HE_min": SOC_HE >= 0.1,
+        "SOC_HP_min": SOC_HP >= 0.1,
+        "SOC_HE_aged_max": SOC_HE_aged <= 0.9,
+        "SOC_HP_aged_max": SOC_HP_aged <= 0.9,
+        "SOC_HE_aged_min": SOC_HE_aged >= 0.1,
+        "SOC_HP_aged_min": SOC_HP_aged >= 0.1,
 
-        E_HE_used > 0,
-        E_HP_used > 0,
+        "E_HE_used_min": E_HE_used > 0,
+        "E_HP_used_min": E_HP_used > 0,
 
-        E_HE_aged > 0,
-        E_HP_aged > 0,
+        "E_HE_aged_min": E_HE_aged > 0,
+        "E_HP_aged_min": E_HP_aged > 0,
 
-        DOD_HE < 100,
-        DOD_HP < 100,
-        DOD_HE > 0,
-        DOD_HP > 0,
+        "DOD_HE_max": DOD_HE < 100,
+        "DOD_HP_max": DOD_HP < 100,
+        "DOD_HE_min": DOD_HE > 0,
+        "DOD_HP_min": DOD_HP > 0,
 
-        E_HE_aged == (M_HE*N_HE*cell_HE.energy) * (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
-        E_HP_aged == (M_HP*N_HP*cell_HP.energy) * (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
+        "E_HE_aged": E_HE_aged == (M_HE*N_HE*cell_HE.energy) * (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
+        "E_HP_aged": E_HP_aged == (M_HP*N_HP*cell_HP.energy) * (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
 
 
-        DOD_HE == (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
-        DOD_HP == (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
+        "DOD_HE": DOD_HE == (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
+        "DOD_HP": DOD_HP == (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
 
         # SOC_HE[-1] == ca.if_else(N_HE == 0, 0.9, 0.1), # <- GIVES ERROR
         # SOC_HP[-1] == ca.if_else(N_HP == 0, 0.9, 0.1),
-
-        P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
-        P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
-        ])
+        })
+
+    if not condensed:
+        warmstart.subject_to(opti, blocks, {
+            "P_HE_joule": P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
+            "P_HP_joule": P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
+            "P_HE_joule_aged": P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
+            "P_HP_joule_aged": P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
+            })
     
     if not bool_intercharge:
-        opti.subject_to([
-            P_HE >= 0,
-            P_HP >= 0,
-        ])
-
-    SOC_HE[0] = ca.DM(0.9)
-    SOC_HP[0] = ca.DM(0.9)
-    SOC_HE_aged[0] = ca.DM(0.9)
-    SOC_HP_aged[0] = ca.DM(0.9)
-    SOC_TO_OCV_HE = ca.interpolant('LUT', 'bspline', [cell_HE.OCV_SOC], cell_HE.OCV)
-    SOC_TO_OCV_HP = ca.interpolant('LUT', 'bspline', [cell_HP.OCV_SOC], cell_HP.OCV)
-
-    for i in range(len(t)):
-        opti.subject_to(SOC_HE[i+1] == ca.if_else(N_HE == 0, SOC_HE[i], SOC_HE[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((M_HE*N_HE*cell_HE.energy*3.6e6)))))
-        opti.subject_to(SOC_HP[i+1] == ca.if_else(N_HP == 0, SOC_HP[i], SOC_HP[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((M_HP*N_HP*cell_HP.energy*3.6e6)))))
-        opti.subject_to(SOC_HE_aged[i+1] == SOC_HE_aged[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((E_HE_aged*3.6e6))))
-        opti.subject_to(SOC_HP_aged[i+1] == SOC_HP_aged[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((E_HP_aged*3.6e6))))
-
-        opti.subject_to(V_HE[i] == M_HE*SOC_TO_OCV_HE(SOC_HE[i]))
-        opti.subject_to(V_HP[i] == M_HP*SOC_TO_OCV_HP(SOC_HP[i]))
-        opti.subject_to(V_HE_aged[i] == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[i]))
-        opti.subject_to(V_HP_aged[i] == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[i]))
-
-        opti.subject_to(I_HE[i] == P_HE[i]/V_HE[i])
-        opti.subject_to(I_HP[i] == P_HP[i]/V_HP[i])
-        opti.subject_to(I_HE_aged[i] == P_HE[i]/V_HE_aged[i])
-        opti.subject_to(I_HP_aged[i] == P_HP[i]/V_HP_aged[i])
-
-        opti.subject_to(I_HE[i] + P_HE_joule[i]/V_HE[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP[i] + P_HP_joule[i]/V_HP[i] <= cell_HP.dis_current*N_HP)
-        opti.subject_to(I_HE_aged[i] + P_HE_joule_aged[i]/V_HE_aged[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP_aged[i] + P_HP_joule_aged[i]/V_HP_aged[i] <= cell_HP.dis_current*N_HP)
-
-    opti.subject_to(E_HE_used == sum(P_HE[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-    opti.subject_to(E_HP_used == sum(P_HP[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
+        warmstart.subject_to(opti, blocks, {
+            "P_HE_min": P_HE >= 0,
+            "P_HP_min": P_HP >= 0,
+        })
+
+    if not condensed:
+        SOC_HE[0] = ca.DM(0.9)
+        SOC_HP[0] = ca.DM(0.9)
+        SOC_HE_aged[0] = ca.DM(0.9)
+        SOC_HP_aged[0] = ca.DM(0.9)
+        SOC_TO_OCV_HE = ocv.lookup(cell_HE)
+        SOC_TO_OCV_HP = ocv.lookup(cell_HP)
+
+    warmstart.subject_to(opti, blocks, {
+        "SOC_HE": SOC_HE[1:] == ca.if_else(N_HE == 0, SOC_HE[:-1], SOC_HE[:-1] - ((P_HE*dt)/((M_HE*N_HE*cell_HE.energy*3.6e6)))),
+        "SOC_HP": SOC_HP[1:] == ca.if_else(N_HP == 0, SOC_HP[:-1], SOC_HP[:-1] - ((P_HP*dt)/((M_HP*N_HP*cell_HP.energy*3.6e6)))),
+        "SOC_HE_aged": SOC_HE_aged[1:] == SOC_HE_aged[:-1] - ((P_HE*dt)/((E_HE_aged*3.6e6))),
+        "SOC_HP_aged": SOC_HP_aged[1:] == SOC_HP_aged[:-1] - ((P_HP*dt)/((E_HP_aged*3.6e6))),
+        })
+
+    if not condensed:
+        warmstart.subject_to(opti, blocks, {
+            "V_HE": V_HE == M_HE*SOC_TO_OCV_HE(SOC_HE[:-1].T).T,
+            "V_HP": V_HP == M_HP*SOC_TO_OCV_HP(SOC_HP[:-1].T).T,
+            "V_HE_aged": V_HE_aged == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[:-1].T).T,
+            "V_HP_aged": V_HP_aged == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[:-1].T).T,
+            })
+
+        warmstart.subject_to(opti, blocks, {
+            "I_HE": I_HE == P_HE/V_HE,
+            "I_HP": I_HP == P_HP/V_HP,
+            "I_HE_aged": I_HE_aged == P_HE/V_HE_aged,
+            "I_HP_aged": I_HP_aged == P_HP/V_HP_aged,
+            })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE_max": I_HE + P_HE_joule/V_HE <= cell_HE.dis_current*N_HE,
+        "I_HP_max": I_HP + P_HP_joule/V_HP <= cell_HP.dis_current*N_HP,
+        "I_HE_aged_max": I_HE_aged + P_HE_joule_aged/V_HE_aged <= cell_HE.dis_current*N_HE,
+        "I_HP_aged_max": I_HP_aged + P_HP_joule_aged/V_HP_aged <= cell_HP.dis_current*N_HP,
+        })
+
+    if not condensed:
+        warmstart.subject_to(opti, blocks, {
+            "E_HE_used": E_HE_used == simulation.used(SOC_HE, M_HE*N_HE*cell_HE.energy),
+            "E_HP_used": E_HP_used == simulation.used(SOC_HP, M_HP*N_HP*cell_HP.energy),
+            })
 
     
     # Set initial values
@@ -311,40 +412,47 @@ def optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=F
 
     if dict_initial != None:
         opti.set_initial(P_HE, dict_initial["P_HE"])
-        opti.set_initial(P_HP, dict_initial["P_HP"])
         opti.set_initial(N_HE, dict_initial["N_HE"] if dict_initial["N_HE"] != 0 else 1e-9)
         opti.set_initial(N_HP, dict_initial["N_HP"] if dict_initial["N_HP"] != 0 else 1e-9)
+        opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
+        opti.set_initial(E_HP_aged, dict_initial["E_HP_aged"])
+
         opti.set_initial(SOC_HE, dict_initial["SOC_HE"])
         opti.set_initial(SOC_HP, dict_initial["SOC_HP"])
+
+    if dict_initial != None and not condensed:
+        opti.set_initial(P_HP, dict_initial["P_HP"])
         opti.set_initial(V_HE, dict_initial["V_HE"])
         opti.set_initial(V_HP, dict_initial["V_HP"])
         opti.set_initial(I_HE, dict_initial["I_HE"])
-        opti.set_initial(I_HP, dict_initial["I_HE"])
+        opti.set_initial(I_HP, dict_initial["I_HP"])
         opti.set_initial(P_HE_joule, dict_initial["P_HE_joule"])
         opti.set_initial(P_HP_joule, dict_initial["P_HP_joule"])
         
         opti.set_initial(V_HE_aged, dict_initial["V_HE_aged"])
         opti.set_initial(V_HP_aged, dict_initial["V_HP_aged"])
         opti.set_initial(I_HE_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(I_HP_aged, dict_initial["I_HE_aged"])
+        opti.set_initial(I_HP_aged, dict_initial["I_HP_aged"])
         opti.set_initial(P_HE_joule_aged, dict_initial["P_HE_joule_aged"])
         opti.set_initial(P_HP_joule_aged, dict_initial["P_HP_joule_aged"])
-        opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
-        opti.set_initial(E_HP_aged, dict_initial["E_HP_aged"])
 
 
     # Start optimization
     opti.minimize(obj)
-    options = {"ipopt": {"print_level": 2, "max_iter":3000}} #level5
+    warm = warmstart.initial(opti, blocks, dict_initial, objective)
+    options = {"ipopt": {"print_level": 2, "max_iter":3000, **warm}} #level5
     opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
     try:
-        sol = opti.solve()
-    except:
+        sol = codegen.solve(opti, "ipopt", options) if compiled else opti.solve()
+    except Exception:
         opti.debug.show_infeasibilities()
         print("[ERROR] Optimization Failed!")
         # opti.debug.x_describe(index)
         # opti.debug.g_describe(index)
-        exit()
+        return failure(opti, blocks, {"t": t, "t_soc": t_soc, "P": P, "method": "optimal"}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
 
     print(sol.value(obj))
     print(f"M_HE: {sol.value(M_HE)} & N_HE: {sol.value(N_HE)}")
@@ -402,9 +510,409 @@ def optimal_aging(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=F
         "E_HP_aged": sol.value(E_HP_aged),
         "I_HE_rated": sol.value(N_HE)*cell_HE.dis_current,
         "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
+        "weight": sol.value(measures["weight"]),
+        "objective": objective,
+        "iterations": sol.stats()["iter_count"],
+        "warm_start": warmstart.save(opti, sol, blocks, objective, options["ipopt"]),
+        "time_build": time_build,
+        "time_solve": time_solve,
         "time": duration,
         "method": "optimal"
         #"limit": None
     }
 
-    return result
\ No newline at end of file
+    return Result(result)
+
+
+def optimal_aging_multi(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False, dict_initial=None, compiled=False):
+    '''
+    optimal_aging for any number of profiles (loads), each with its own number of cycles, sized with one HE and one HP pack shared by all of them
+
+    The power split, SOC trajectories, DODs and aged energies are per profile (see funcs/multi.py), the trajectories of the result are lists with one
+    array per profile. dict_initial is a result of optimal_aging_multi on the same profiles, without it (or with a single-profile result) the start is
+    the rule-based sizing of every profile with the largest sizes
+    '''
+    start_time = time.time()
+    start_build = time.time()
+    opti = ca.Opti()
+    blocks = {}
+
+    K = len(loads)
+    cycles = np.broadcast_to(np.asarray(cycles, dtype=float), (K,))
+    P_2D, t_2D, t_soc_2D, lengths = simulation.stack(loads)
+    n = P_2D.shape[1]
+    dt = np.diff(t_soc_2D, axis=-1).T # s, one column per profile
+    P = P_2D.T # W, one column per profile
+
+    # Parameters
+    M_HE = opti.parameter()
+    M_HP = opti.parameter()
+
+    # Decision variables, one column per profile
+    P_HE = opti.variable(n, K)          # Power from HE battery       [W]
+    N_HE = opti.variable(1,1)           # Number of parallel HE strings []
+    N_HP = opti.variable(1,1)           # Number of parallel HP strings []
+    SOC_HE = opti.variable(n, K)        # State of Charge of HE batttery after every sample [0-1]
+    SOC_HP = opti.variable(n, K)        # State of Charge of HP batttery after every sample [0-1]
+    SOC_HE_aged = opti.variable(n, K)
+    SOC_HP_aged = opti.variable(n, K)
+    E_HE_aged = opti.variable(1, K)
+    E_HP_aged = opti.variable(1, K)
+    DOD_HE = opti.variable(1, K)
+    DOD_HP = opti.variable(1, K)
+
+    P_HP = P - P_HE                     # Power from HP battery       [W]
+
+    equality_HE, margin_HE, V_HE, I_HE, P_HE_joule, V_HE_aged, I_HE_aged, P_HE_joule_aged = multi.mapped(multi.pack(cell_HE, n), K)(
+        P_HE, dt, SOC_HE, SOC_HE_aged, multi.used(SOC_HE, lengths, used_last=False), N_HE, M_HE, E_HE_aged, DOD_HE, ca.DM(cycles).T)
+    equality_HP, margin_HP, V_HP, I_HP, P_HP_joule, V_HP_aged, I_HP_aged, P_HP_joule_aged = multi.mapped(multi.pack(cell_HP, n), K)(
+        P_HP, dt, SOC_HP, SOC_HP_aged, multi.used(SOC_HP, lengths, used_last=False), N_HP, M_HP, E_HP_aged, DOD_HP, ca.DM(cycles).T)
+
+    # Objective function
+    obj = ((M_HE*N_HE*cell_HE.cost) + (M_HP*N_HP*cell_HP.cost) + # Total cost of battery cells
+           1000 * (ca.sum1(ca.vec(P_HE_joule))/np.sum(P)) + (ca.sum1(ca.vec(P_HP_joule))/np.sum(P)))  # Minimize joule losses
+
+    # Constraints
+    warmstart.subject_to(opti, blocks, {
+        "N_HE_min": N_HE >= 0,
+        "N_HP_min": N_HP >= 0,
+
+        "SOC_HE_max": ca.vec(SOC_HE) <= 0.9,
+        "SOC_HP_max": ca.vec(SOC_HP) <= 0.9,
+        "SOC_HE_min": ca.vec(SOC_HE) >= 0.1,
+        "SOC_HP_min": ca.vec(SOC_HP) >= 0.1,
+        "SOC_HE_aged_max": ca.vec(SOC_HE_aged) <= 0.9,
+        "SOC_HP_aged_max": ca.vec(SOC_HP_aged) <= 0.9,
+        "SOC_HE_aged_min": ca.vec(SOC_HE_aged) >= 0.1,
+        "SOC_HP_aged_min": ca.vec(SOC_HP_aged) >= 0.1,
+
+        "E_HE_aged_min": ca.vec(E_HE_aged) > 0,
+        "E_HP_aged_min": ca.vec(E_HP_aged) > 0,
+
+        "DOD_HE_max": ca.vec(DOD_HE) < 100,
+        "DOD_HP_max": ca.vec(DOD_HP) < 100,
+        "DOD_HE_min": ca.vec(DOD_HE) > 0,
+        "DOD_HP_min": ca.vec(DOD_HP) > 0,
+
+        "HE": ca.vec(equality_HE) == 0,             # SOC dynamics, aging and DOD of the HE pack on every profile
+        "HP": ca.vec(equality_HP) == 0,
+        "I_HE_max": ca.vec(margin_HE) <= 0,         # Current limits at BOL and EOL
+        "I_HP_max": ca.vec(margin_HP) <= 0,
+        })
+
+    if not bool_intercharge:
+        warmstart.subject_to(opti, blocks, {
+            "P_HE_min": ca.vec(P_HE) >= 0,
+            "P_HP_min": ca.vec(P_HP) >= 0,
+        })
+
+
+    # Set initial values
+    opti.set_value(M_HE, V_bus/cell_HE.voltage)
+    opti.set_value(M_HP, V_bus/cell_HP.voltage)
+
+    if dict_initial != None and isinstance(dict_initial["t"], list) and len(dict_initial["t"]) == K:
+        initial = {key: dict_initial[key] for key in ("N_HE", "N_HP")}
+        initial["P_HE"] = multi.pad(dict_initial["P_HE"], n, mode="constant")
+        for key in ("SOC_HE", "SOC_HP", "SOC_HE_aged", "SOC_HP_aged"):
+            initial[key] = multi.pad(dict_initial[key], n, extra=1)[1:]
+        for key in ("E_HE_aged", "E_HP_aged", "DOD_HE", "DOD_HP"):
+            initial[key] = np.asarray(dict_initial[key], dtype=float)
+    else:
+        # Rule-based sizing of every profile, the largest sizes are shared
+        rules = [treshold.treshold([load], cell_HE, cell_HP, V_bus, [cycles[k]]) for k, load in enumerate(loads)]
+        initial = {"P_HE": multi.pad([rule["P_HE"] for rule in rules], n, mode="constant")}
+        for pack, cell, M, P_pack in (("HE", cell_HE, V_bus/cell_HE.voltage, initial["P_HE"]), ("HP", cell_HP, V_bus/cell_HP.voltage, P - initial["P_HE"])):
+            N = max(max(rule[f"N_{pack}"] for rule in rules), 1e-3) # May not be 0 to avoid division by 0
+            E = M * N * cell.energy # kWh
+            aged = np.array([rule[f"E_{pack}_aged"]/rule[f"E_{pack}"] if rule[f"E_{pack}"] > 0 else 1 for rule in rules]) # Share of the energy left at EOL
+            sim = simulation.simulate(P_pack.T, t_soc_2D, np.full(K, E), cell, M)
+            sim_aged = simulation.simulate(P_pack.T, t_soc_2D, E*aged, cell, M)
+            initial.update({
+                f"N_{pack}": N,
+                f"SOC_{pack}": sim["SOC"][:, 1:].T,
+                f"SOC_{pack}_aged": sim_aged["SOC"][:, 1:].T,
+                f"E_{pack}_aged": E*aged,
+                f"DOD_{pack}": (0.9 - sim["SOC"][np.arange(K), lengths-1])*100, # SOC before the last sample
+            })
+
+    for variable, key in ((P_HE, "P_HE"), (N_HE, "N_HE"), (N_HP, "N_HP"), (SOC_HE, "SOC_HE"), (SOC_HP, "SOC_HP"), (SOC_HE_aged, "SOC_HE_aged"),
+                          (SOC_HP_aged, "SOC_HP_aged"), (E_HE_aged, "E_HE_aged"), (E_HP_aged, "E_HP_aged"), (DOD_HE, "DOD_HE"), (DOD_HP, "DOD_HP")):
+        opti.set_initial(variable, np.reshape(initial[key], variable.shape))
+
+
+    # Start optimization
+    opti.minimize(obj)
+    warm = warmstart.initial(opti, blocks, dict_initial, "cost")
+    options = {"expand": multi.expand(), "ipopt": {"print_level": 2, "max_iter":3000, **warm}} #level5
+    opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
+    t = multi.trim(t_2D.T, lengths)
+    t_soc = multi.trim(t_soc_2D.T, lengths, extra=1)
+    try:
+        sol = codegen.solve(opti, "ipopt", options) if compiled else opti.solve()
+    except Exception:
+        opti.debug.show_infeasibilities()
+        print("[ERROR] Optimization Failed!")
+        return failure(opti, blocks, {"t": t, "t_soc": t_soc, "P": multi.trim(P, lengths), "method": "optimal"}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
+
+    def value(expression, extra=0):
+        if extra:
+            return multi.trim(np.vstack((np.full((1, K), 0.9), np.reshape(sol.value(expression), (n, K)))), lengths, extra=extra)
+        return multi.trim(sol.value(expression), lengths)
+
+    E_HE_losses = sum(np.max(cumtrapz(P_joule/1000, t_k/3600, initial=0)) for P_joule, t_k in zip(value(P_HE_joule), t)) # kWh
+    E_HP_losses = sum(np.max(cumtrapz(P_joule/1000, t_k/3600, initial=0)) for P_joule, t_k in zip(value(P_HP_joule), t)) # kWh
+    E_HE_used = sum(np.max(cumtrapz(P_k/1000, t_k/3600, initial=0)) for P_k, t_k in zip(value(P_HE), t))
+    E_HP_used = sum(np.max(cumtrapz(P_k/1000, t_k/3600, initial=0)) for P_k, t_k in zip(value(P_HP), t))
+
+    efficiency_HE = (E_HE_used / (E_HE_used + E_HE_losses)) * 100
+    efficiency_HP = (E_HP_used / (E_HP_used + E_HP_losses)) * 100
+    efficiency = (E_HE_used/(E_HE_used + E_HP_used)) * efficiency_HE + (E_HP_used/(E_HP_used + E_HE_used)) * efficiency_HP
+
+    duration = (time.time() - start_time)*1000
+    print(f"Optimal solution found for {K} profiles! \t[{duration:0.2f} ms]")
+
+    result = {
+        "t": t,
+        "t_soc": t_soc,
+        "P": multi.trim(P, lengths),
+        "P_HE": value(P_HE),
+        "P_HP": value(P_HP),
+        "P_HE_joule": value(P_HE_joule),
+        "P_HP_joule": value(P_HP_joule),
+        "SOC_HE": value(SOC_HE, extra=1),
+        "SOC_HP": value(SOC_HP, extra=1),
+        "V_HE": value(V_HE),
+        "V_HP": value(V_HP),
+        "I_HE": value(I_HE),
+        "I_HP": value(I_HP),
+        "M_HE": sol.value(M_HE),
+        "M_HP": sol.value(M_HP),
+        "N_HE": sol.value(N_HE),
+        "N_HP": sol.value(N_HP),
+        "cost": sol.value(M_HE) * sol.value(N_HE) * cell_HE.cost + sol.value(M_HP) * sol.value(N_HP) * cell_HP.cost,
+        "losses": E_HE_losses + E_HP_losses,
+        "efficiency": efficiency,
+        "P_HE_joule_aged": value(P_HE_joule_aged),
+        "P_HP_joule_aged": value(P_HP_joule_aged),
+        "SOC_HE_aged": value(SOC_HE_aged, extra=1),
+        "SOC_HP_aged": value(SOC_HP_aged, extra=1),
+        "V_HE_aged": value(V_HE_aged),
+        "V_HP_aged": value(V_HP_aged),
+        "I_HE_aged": value(I_HE_aged),
+        "I_HP_aged": value(I_HP_aged),
+        "E_HE": sol.value(M_HE) * sol.value(N_HE) * cell_HE.energy,
+        "E_HP": sol.value(M_HP) * sol.value(N_HP) * cell_HP.energy,
+        "E_HE_aged": list(np.atleast_1d(sol.value(E_HE_aged))),
+        "E_HP_aged": list(np.atleast_1d(sol.value(E_HP_aged))),
+        "DOD_HE": list(np.atleast_1d(sol.value(DOD_HE))),
+        "DOD_HP": list(np.atleast_1d(sol.value(DOD_HP))),
+        "I_HE_rated": sol.value(N_HE)*cell_HE.dis_current,
+        "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
+        "iterations": sol.stats()["iter_count"],
+        "warm_start": warmstart.save(opti, sol, blocks, "cost", options["ipopt"]),
+        "time_build": time_build,
+        "time_solve": time_solve,
+        "time": duration,
+        "method": "optimal"
+    }
+
+    return Result(result)
+
+
+def optimal_aging_ocp(loads, cell_HE, cell_HP, V_bus, cycles=[0], bool_intercharge=False, dict_initial=None, solver=ocp.SOLVER):
+    '''
+    optimal_aging set up as a stage-structured OCP (see funcs/ocp.py), solved with fatrop and IPOPT as fallback (solver="ipopt" to use IPOPT directly)
+
+    State of stage k: SOC_HE, SOC_HP, SOC_HE_aged, SOC_HP_aged, N_HE, N_HP, E_HE_aged, E_HP_aged, DOD_HE, DOD_HP and the HE/HP energy used up to sample k (kWh),
+    control of stage k: P_HE. The sizes, aged energies and DODs are stage-invariant, the DOD and aging relations are imposed on the last stage
+    '''
+    multi.single(loads, "optimal_aging_ocp")
+    start_time = time.time()
+    start_build = time.time()
+    opti = ca.Opti()
+
+    P = loads[0]["P"].values # W
+    t = loads[0]["t"].values # s
+    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
+    dt = np.diff(t_soc) # s
+    dt_used = np.append(dt[:-1], 0) # s, the used energy leaves out the last sample like optimal_aging
+
+    # Parameters
+    M_HE = opti.parameter()
+    M_HP = opti.parameter()
+
+    # Decision variables
+    X, U = ocp.stages(opti, len(t), 12, 1)
+
+    # Stage dynamics and path constraints, as functions of the state x, the HE power u, the load P_k, the time steps and the cells in series M
+    x = ca.MX.sym("x", 12)
+    u = ca.MX.sym("u")
+    P_k = ca.MX.sym("P_k")
+    dt_k = ca.MX.sym("dt_k")
+    dt_used_k = ca.MX.sym("dt_used_k")
+    M = ca.MX.sym("M", 2)
+    SOC_HE, SOC_HP, SOC_HE_aged, SOC_HP_aged, N_HE, N_HP, E_HE_aged, E_HP_aged, DOD_HE, DOD_HP, E_HE_used, E_HP_used = ca.vertsplit(x)
+    P_HE = u
+    P_HP = P_k - u
+
+    x_next = ca.vertcat(
+        ca.if_else(N_HE == 0, SOC_HE, SOC_HE - ((P_HE*dt_k)/((M[0]*N_HE*cell_HE.energy*3.6e6)))),
+        ca.if_else(N_HP == 0, SOC_HP, SOC_HP - ((P_HP*dt_k)/((M[1]*N_HP*cell_HP.energy*3.6e6)))),
+        SOC_HE_aged - ((P_HE*dt_k)/((E_HE_aged*3.6e6))),
+        SOC_HP_aged - ((P_HP*dt_k)/((E_HP_aged*3.6e6))),
+        N_HE, N_HP, E_HE_aged, E_HP_aged, DOD_HE, DOD_HP,
+        E_HE_used + P_HE*dt_used_k/3.6e6,
+        E_HP_used + P_HP*dt_used_k/3.6e6)
+    dynamics = ca.Function("dynamics", [x, u, P_k, dt_k, dt_used_k, M], [x_next])
+
+    SOC_TO_OCV_HE = ocv.lookup(cell_HE)
+    SOC_TO_OCV_HP = ocv.lookup(cell_HP)
+    V = ca.vertcat(M[0]*SOC_TO_OCV_HE(SOC_HE), M[1]*SOC_TO_OCV_HP(SOC_HP), M[0]*SOC_TO_OCV_HE(SOC_HE_aged), M[1]*SOC_TO_OCV_HP(SOC_HP_aged)) # V
+    I = ca.vertcat(P_HE, P_HP, P_HE, P_HP) / V                                                                   # A
+    P_joule = ca.vertcat(cell_HE.resistance, cell_HP.resistance, cell_HE.resistance, cell_HP.resistance) * (I**2)  # W
+    I_max = ca.vertcat(cell_HE.dis_current*N_HE, cell_HP.dis_current*N_HP, cell_HE.dis_current*N_HE, cell_HP.dis_current*N_HP)
+    path = ca.Function("path", [x, u, P_k, M], [V, I, P_joule, I + P_joule/V - I_max])
+
+    # Both functions are evaluated on all stages at once, one call node in the expression graph instead of one per stage
+    x_all = ca.horzcat(*X[:-1])
+    u_all = ca.horzcat(*U)
+    x_next = dynamics.map(len(t))(x_all, u_all, P.reshape(1, -1), dt.reshape(1, -1), dt_used.reshape(1, -1), ca.vertcat(M_HE, M_HP))
+    V_all, I_all, P_joule_all, I_margin = path.map(len(t))(x_all, u_all, P.reshape(1, -1), ca.vertcat(M_HE, M_HP))
+
+    # Objective function and constraints, stage by stage. fatrop detects the stages from the order of the constraints, they are collected in stage order
+    # and added as one constraint: Opti analyses every constraint on its own, which for columns of the mapped calls means a pass over the whole graph
+    obj = 1000 * (ca.sum2(P_joule_all[0, :])/np.sum(P)) + (ca.sum2(P_joule_all[1, :])/np.sum(P))  # Minimize joule losses
+    g, lbg, ubg = [], [], []
+    def stage(expression, lower, upper):
+        g.append(expression)
+        lbg.append(np.broadcast_to(lower, expression.shape[0]))
+        ubg.append(np.broadcast_to(upper, expression.shape[0]))
+
+    for k in range(len(t)):
+        stage(X[k+1] - x_next[:, k], 0, 0)
+        if k == 0:
+            stage(ca.vertcat(X[0][0:4], X[0][10:12]), [0.9, 0.9, 0.9, 0.9, 0, 0], [0.9, 0.9, 0.9, 0.9, 0, 0])
+        stage(X[k][0:4], 0.1, 0.9)
+        stage(I_margin[:, k], -np.inf, 0)
+        if not bool_intercharge:
+            stage(ca.vertcat(U[k], P[k] - U[k]), 0, np.inf)
+    opti.subject_to(opti.bounded(np.concatenate(lbg), ca.vertcat(*g), np.concatenate(ubg)))
+
+    SOC_HE, SOC_HP, SOC_HE_aged, SOC_HP_aged, N_HE, N_HP, E_HE_aged, E_HP_aged, DOD_HE, DOD_HP, E_HE_used, E_HP_used = ca.vertsplit(X[-1])
+    obj += (M_HE*N_HE*cell_HE.cost) + (M_HP*N_HP*cell_HP.cost) # Total cost of battery cells
+
+    opti.subject_to(opti.bounded(0.1, X[-1][0:4], 0.9))
+    opti.subject_to(ca.vertcat(
+        E_HE_aged - (M_HE*N_HE*cell_HE.energy) * (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
+        E_HP_aged - (M_HP*N_HP*cell_HP.energy) * (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
+        DOD_HE - (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
+        DOD_HP - (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
+        ) == 0)
+    opti.subject_to(ca.vertcat(N_HE, N_HP) >= 0)
+    opti.subject_to(ca.vertcat(E_HE_used, E_HP_used, E_HE_aged, E_HP_aged, DOD_HE, DOD_HP) > 0)
+    opti.subject_to(ca.vertcat(DOD_HE, DOD_HP) < 100)
+
+    # Set initial values
+    opti.set_value(M_HE, V_bus/cell_HE.voltage)
+    opti.set_value(M_HP, V_bus/cell_HP.voltage)
+
+    if dict_initial != None:
+        N_HE_0 = dict_initial["N_HE"] if dict_initial["N_HE"] != 0 else 1e-9
+        N_HP_0 = dict_initial["N_HP"] if dict_initial["N_HP"] != 0 else 1e-9
+        E_HE_used_0 = np.append(0, np.cumsum(dict_initial["P_HE"]*dt_used)/3.6e6) # kWh
+        E_HP_used_0 = np.append(0, np.cumsum(dict_initial["P_HP"]*dt_used)/3.6e6) # kWh
+        DOD_HE_0 = E_HE_used_0[-1]/(V_bus/cell_HE.voltage*N_HE_0*cell_HE.energy)*100
+        DOD_HP_0 = E_HP_used_0[-1]/(V_bus/cell_HP.voltage*N_HP_0*cell_HP.energy)*100
+        for k in range(len(t)+1):
+            opti.set_initial(X[k], [dict_initial["SOC_HE"][k], dict_initial["SOC_HP"][k], dict_initial["SOC_HE_aged"][k], dict_initial["SOC_HP_aged"][k],
+                                    N_HE_0, N_HP_0, dict_initial["E_HE_aged"], dict_initial["E_HP_aged"], DOD_HE_0, DOD_HP_0, E_HE_used_0[k], E_HP_used_0[k]])
+            if k < len(t):
+                opti.set_initial(U[k], dict_initial["P_HE"][k])
+
+    # Start optimization
+    opti.minimize(obj)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
+    try:
+        sol, solver = ocp.solve(opti, solver)
+    except Exception:
+        opti.debug.show_infeasibilities()
+        print("[ERROR] Optimization Failed!")
+        return failure(opti, {}, {"t": t, "t_soc": t_soc, "P": P, "method": "optimal"}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
+
+    x = sol.value(ca.horzcat(*X)).T                         # States, one row per stage
+    P_HE = sol.value(ca.vertcat(*U))
+    P_HP = P - P_HE
+    V, I, P_joule, _ = path.map(len(t))(x[:-1].T, P_HE, P, ca.DM([sol.value(M_HE), sol.value(M_HP)]))
+    V, I, P_joule = np.array(V), np.array(I), np.array(P_joule)   # Rows: HE, HP, HE aged, HP aged
+
+    E_HE_losses = np.max(cumtrapz(P_joule[0]/1000, t/3600, initial=0)) # kWh
+    E_HP_losses = np.max(cumtrapz(P_joule[1]/1000, t/3600, initial=0)) # kWh
+    E_HE_used = np.max(cumtrapz(P_HE/1000, t/3600, initial=0))
+    E_HP_used = np.max(cumtrapz(P_HP/1000, t/3600, initial=0))
+
+    efficiency_HE = (E_HE_used / (E_HE_used + E_HE_losses)) * 100
+    efficiency_HP = (E_HP_used / (E_HP_used + E_HP_losses)) * 100
+    efficiency = (E_HE_used/(E_HE_used + E_HP_used)) * efficiency_HE + (E_HP_used/(E_HP_used + E_HE_used)) * efficiency_HP
+
+
+    # Place results in a dictionary
+    N_HE = x[-1, 4]
+    N_HP = x[-1, 5]
+    zero_HE = N_HE < 1e-3    # Check if there are HE cells in the solutions, to remove artifacts
+    zero_HP = N_HP < 1e-3    # Check if there are HP cells in the solutions, to remove artifacts
+
+    duration = (time.time() - start_time)*1000
+    print(f"Optimal solution found! \t[{duration:0.2f} ms]")
+
+    result = {
+        "t": t,
+        "t_soc": t_soc,
+        "P": P,
+        "P_HE": P_HE,
+        "P_HP": P_HP,
+        "P_HE_joule": P_joule[0],
+        "P_HP_joule": P_joule[1],
+        "SOC_HE": np.full(len(t_soc), 0.9) if zero_HE else x[:, 0],
+        "SOC_HP": np.full(len(t_soc), 0.9) if zero_HP else x[:, 1],
+        "V_HE": np.full(len(t), V[0, 0]) if zero_HE else V[0],
+        "V_HP": np.full(len(t), V[1, 0]) if zero_HP else V[1],
+        "I_HE": I[0],
+        "I_HP": I[1],
+        "M_HE": sol.value(M_HE),
+        "M_HP": sol.value(M_HP),
+        "N_HE": N_HE,
+        "N_HP": N_HP,
+        "cost": sol.value(M_HE) * N_HE * cell_HE.cost + sol.value(M_HP) * N_HP * cell_HP.cost,
+        "losses": E_HE_losses + E_HP_losses,
+        "efficiency": efficiency,
+        "P_HE_joule_aged": P_joule[2],
+        "P_HP_joule_aged": P_joule[3],
+        "SOC_HE_aged": x[:, 2],
+        "SOC_HP_aged": x[:, 3],
+        "V_HE_aged": V[2],
+        "V_HP_aged": V[3],
+        "I_HE_aged": I[2],
+        "I_HP_aged": I[3],
+        "E_HE": sol.value(M_HE) * N_HE * cell_HE.energy,
+        "E_HP": sol.value(M_HP) * N_HP * cell_HP.energy,
+        "E_HE_aged": x[-1, 6],
+        "E_HP_aged": x[-1, 7],
+        "DOD_HE": x[-1, 8],
+        "DOD_HP": x[-1, 9],
+        "I_HE_rated": N_HE*cell_HE.dis_current,
+        "I_HP_rated": N_HP*cell_HP.dis_current,
+        "iterations": sol.stats()["iter_count"],
+        "solver": solver,
+        "time_build": time_build,
+        "time_solve": time_solve,
+        "time": duration,
+        "method": "optimal"
+    }
+
+    return Result(result)
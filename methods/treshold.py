@@ -1,132 +1,136 @@
 import numpy as np
 from scipy.integrate import cumtrapz
+from scipy.optimize import minimize_scalar
 import time
 import casadi as ca
 
-def treshold(loads, cell_HE, cell_HP, V_bus, cycles):
-    start_time = time.time()
+from funcs import simulation
+from funcs import ocv
+from funcs import warmstart
+from funcs import multi
+from funcs import codegen
+from funcs.result import Result, SPLIT, failure
 
-    P = loads[0]["P"].values # W
-    t = loads[0]["t"].values # s
-    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
+def sweep(P, t, t_soc, limits, cell_HE, cell_HP, M_HE, M_HP, tol=1e-3, chunk=None):
+    '''
+    Rule-based sizing of both packs for every power treshold in limits (W), returns the cost curve and the number of parallel strings
 
-    ## -- Rule Based Initial Solution
-    P_HE = np.empty(len(t))
-    P_HP = np.empty(len(t))
-    P_HE_joule = np.empty(len(t))
-    P_HP_joule = np.empty(len(t))
-    I_HE_joule = np.empty(len(t))
-    I_HP_joule = np.empty(len(t))
-    SOC_HE = np.full(len(t_soc), 0.9)
-    SOC_HP = np.full(len(t_soc), 0.9)
-    V_HE = np.empty(len(t))
-    V_HP = np.empty(len(t))
-    I_HE = np.empty(len(t))
-    I_HP = np.empty(len(t))
-
-    #cost = np.empty(int(np.max(P)/1000))
-    resolution = 1000*3*2*2*2*2/8
-    resolution = int(np.max(P)/200)
-    cost = []
-    N_HE_list = []
-    N_HP_list = []
-    limit = []
+    All tresholds are evaluated at once as a 2D (tresholds x samples) array, split in chunks of tresholds to bound the memory use
+    '''
+    if chunk == None:
+        chunk = max(1, int(4e6 // len(t))) # Number of tresholds per chunk (~4e6 samples per array)
 
-    M_HE = V_bus/cell_HE.voltage
-    M_HP = V_bus/cell_HP.voltage
+    N_HE = np.empty(len(limits))
+    N_HP = np.empty(len(limits))
 
-    for P_limit in range(0, round(np.max(P))+resolution, resolution):
-        
-        for i in range(len(t)):
-            if P[i] > P_limit:
-                P_HE[i] = P_limit
-                P_HP[i] = P[i] - P_limit
-            else:
-                P_HE[i] = P[i]
-                P_HP[i] = 0
+    for i in range(0, len(limits), chunk):
+        P_limit = limits[i:i+chunk, None]
+        P_HE, P_HP = simulation.split(P, P_limit)
 
-        E_HE = cumtrapz(P_HE/1000, t/3600, initial=0) # kWh
-        E_HP = cumtrapz(P_HP/1000, t/3600, initial=0) # kWh
+        E_HE_req1 = np.max(cumtrapz(P_HE/1000, t/3600, initial=0, axis=-1), axis=-1)/0.8 # kWh
+        E_HP_req1 = np.max(cumtrapz(P_HP/1000, t/3600, initial=0, axis=-1), axis=-1)/0.8 # kWh
 
-        E_HE_req1 = np.max(E_HE)/0.8 # kWh
-        E_HP_req1 = np.max(E_HP)/0.8 # kWh
-        N_HE = E_HE_req1 / (M_HE * cell_HE.energy) 
-        N_HP = E_HP_req1 / (M_HP * cell_HP.energy) 
+        # Increase number of parallel strings until the current limits of both packs are not exceeded
+        N_HE[i:i+chunk], _ = simulation.size_strings(P_HE, t_soc, cell_HE, M_HE, E_HE_req1 / (M_HE * cell_HE.energy), tol=tol)
+        N_HP[i:i+chunk], _ = simulation.size_strings(P_HP, t_soc, cell_HP, M_HP, E_HP_req1 / (M_HP * cell_HP.energy), tol=tol)
 
-        while True:
-            E_HE = M_HE * N_HE * cell_HE.energy
-            E_HP = M_HP * N_HP * cell_HP.energy
+        progress = (min(i+chunk, len(limits))/len(limits)) * 100
+        print(f"Calculating rule-based...\t[{int(progress/4)*'='}{int((100-progress)/4)*' '}] \t{progress:.2f}%", end="\r", flush=True)
 
-            for i in range(len(t)):
-                SOC_HE[i+1] = SOC_HE[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE*3.6e6)) if E_HE_req1 != 0 else SOC_HE[i]
-                SOC_HP[i+1] = SOC_HP[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP*3.6e6)) if E_HP_req1 != 0 else SOC_HP[i]
+    cost = M_HE*N_HE*cell_HE.cost + M_HP*N_HP*cell_HP.cost
 
-                V_HE[i] = V_bus/cell_HE.voltage * np.interp(SOC_HE[i], cell_HE.OCV_SOC, cell_HE.OCV)
-                V_HP[i] = V_bus/cell_HP.voltage * np.interp(SOC_HP[i], cell_HP.OCV_SOC, cell_HP.OCV)
+    return cost, N_HE, N_HP
 
-                I_HE[i] = P_HE[i]/V_HE[i]
-                I_HP[i] = P_HP[i]/V_HP[i]
 
-                P_HE_joule[i] = cell_HE.resistance * (I_HE[i]**2)
-                P_HP_joule[i] = cell_HP.resistance * (I_HP[i]**2)
+def grid(P):
+    '''
+    Power tresholds (W) of the full scan, from 0 to the peak power in steps of 1/200 of it
+    '''
+    resolution = int(np.max(P)/200)
+    return np.arange(0, round(np.max(P))+resolution, resolution)
 
-                I_HE_joule[i] = P_HE_joule[i] / V_HE[i]
-                I_HP_joule[i] = P_HP_joule[i] / V_HP[i]
-            
-            if np.max(I_HE + I_HE_joule) > N_HE*cell_HE.dis_current: N_HE += 1e-1
-            if np.max(I_HP + I_HP_joule) > N_HP*cell_HP.dis_current: N_HP += 1e-1
-            if np.max(I_HE + I_HE_joule) <= N_HE*cell_HE.dis_current and np.max(I_HP + I_HP_joule) <= N_HP*cell_HP.dis_current: break
 
+def search_adaptive(P, t, t_soc, cell_HE, cell_HP, M_HE, M_HP, tol=1e-3, step=10, xatol=100, chunk=None):
+    '''
+    Scan of every step-th treshold of the full grid (see grid), then a bounded Brent minimization of the cost at BOL in the bracket around the cheapest
+    evaluated treshold, down to xatol (W)
 
-        # N_HE_req2 = (np.max(I_HE) + np.max(I_HE_joule)) / cell_HE.dis_current
-        # N_HP_req2 = (np.max(I_HP) + np.max(I_HP_joule)) / cell_HP.dis_current
+    When the coarse cost curve is not unimodal, the rest of the full grid is scanned as well (the coarse tresholds are not evaluated again) before the refinement
+    Returns every evaluated treshold (sorted) with its cost and number of parallel strings, and whether the coarse curve was unimodal
+    '''
+    limits = grid(P)
+    coarse = np.zeros(len(limits), dtype=bool)
+    coarse[::step] = True
+    coarse[-1] = True
 
-        cost.append(V_bus/cell_HE.voltage * N_HE * cell_HE.cost +
-                    V_bus/cell_HP.voltage * N_HP * cell_HP.cost)
-        
-        N_HE_list.append(N_HE)
-        N_HP_list.append(N_HP)
-        limit.append(P_limit)
+    cost = np.full(len(limits), np.nan)
+    N_HE = np.full(len(limits), np.nan)
+    N_HP = np.full(len(limits), np.nan)
+    cost[coarse], N_HE[coarse], N_HP[coarse] = sweep(P, t, t_soc, limits[coarse], cell_HE, cell_HP, M_HE, M_HP, tol=tol, chunk=chunk)
 
-        progress = (P_limit/(np.max(P)+resolution)) * 100
-        print(f"Calculating rule-based...\t[{int(progress/4)*'='}{int((100-progress)/4)*' '}] \t{progress:.2f}%", end="\r", flush=True)
+    # Unimodal if the cost never goes up and then down again
+    slope = np.sign(np.diff(cost[coarse]))
+    slope = slope[slope != 0]
+    unimodal = not np.any(np.diff(slope) < 0)
+    if not unimodal:
+        cost[~coarse], N_HE[~coarse], N_HP[~coarse] = sweep(P, t, t_soc, limits[~coarse], cell_HE, cell_HP, M_HE, M_HP, tol=tol, chunk=chunk)
 
+    evaluated = [(limits[~np.isnan(cost)], cost[~np.isnan(cost)], N_HE[~np.isnan(cost)], N_HP[~np.isnan(cost)])]
+    def evaluate(P_limit):
+        result = sweep(P, t, t_soc, np.array([P_limit]), cell_HE, cell_HP, M_HE, M_HP, tol=tol)
+        evaluated.append((np.array([P_limit]),) + result)
+        return result[0][0]
+
+    limit = evaluated[0][0]
+    index = np.argmin(evaluated[0][1])
+    bounds = (limit[max(index-1, 0)], limit[min(index+1, len(limit)-1)])
+    minimize_scalar(evaluate, bounds=bounds, method="bounded", options={"xatol": xatol})
+
+    # All evaluated tresholds, sorted
+    limit, cost, N_HE, N_HP = (np.concatenate(x) for x in zip(*evaluated))
+    order = np.argsort(limit, kind="stable")
+
+    return limit[order], cost[order], N_HE[order], N_HP[order], unimodal
+
+
+def treshold(loads, cell_HE, cell_HP, V_bus, cycles, tol=1e-3, chunk=None, search="scan", xatol=100):
+    start_time = time.time()
+
+    P = loads[0]["P"].values # W
+    t = loads[0]["t"].values # s
+    t_soc = np.append(t, t[-1] + (t[-1] - t[-2])) # s
+
+    M_HE = V_bus/cell_HE.voltage
+    M_HP = V_bus/cell_HP.voltage
+
+    ## -- Rule Based Initial Solution
+    # Both searches take the cheapest sizing at BOL: search="scan" evaluates the full grid, search="adaptive" refines a coarse scan (see search_adaptive)
+    if search == "adaptive":
+        limit, cost, N_HE_list, N_HP_list, _ = search_adaptive(P, t, t_soc, cell_HE, cell_HP, M_HE, M_HP, tol=tol, xatol=xatol, chunk=chunk)
+    else:
+        limit = grid(P)
+        cost, N_HE_list, N_HP_list = sweep(P, t, t_soc, limit, cell_HE, cell_HP, M_HE, M_HP, tol=tol, chunk=chunk)
+    evaluations = len(limit)
 
 
     # Find least expensive solution
-    index_min = cost.index(min(cost))
+    index_min = np.argmin(cost)
     #print(f"Treshold Limit: {limit[index_min]/1000:0.2f} kW")
 
     P_limit = limit[index_min]
-    for i in range(len(t)):
-        if P[i] > P_limit:
-            P_HE[i] = P_limit
-            P_HP[i] = P[i] - P_limit
-        else:
-            P_HE[i] = P[i]
-            P_HP[i] = 0
+    P_HE, P_HP = simulation.split(P, P_limit)
 
     E_HE = M_HE * N_HE_list[index_min] * cell_HE.energy
     E_HP = M_HP * N_HP_list[index_min] * cell_HP.energy
 
-    for i in range(len(t)):
-        SOC_HE[i+1] = SOC_HE[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE*3.6e6)) if E_HE != 0 else SOC_HE[i]
-        SOC_HP[i+1] = SOC_HP[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP*3.6e6)) if E_HP != 0 else SOC_HP[i]
-
-        V_HE[i] = V_bus/cell_HE.voltage * np.interp(SOC_HE[i], cell_HE.OCV_SOC, cell_HE.OCV)
-        V_HP[i] = V_bus/cell_HP.voltage * np.interp(SOC_HP[i], cell_HP.OCV_SOC, cell_HP.OCV)
-
-        I_HE[i] = P_HE[i]/V_HE[i]
-        I_HP[i] = P_HP[i]/V_HP[i]
-
-        P_HE_joule[i] = cell_HE.resistance * I_HE[i]**2
-        P_HP_joule[i] = cell_HP.resistance * I_HP[i]**2
+    sim_HE = simulation.simulate(P_HE, t_soc, E_HE, cell_HE, M_HE)
+    sim_HP = simulation.simulate(P_HP, t_soc, E_HP, cell_HP, M_HP)
 
 
 
     # Calculate cell degradation (aging)
-    DOD_HE = 100*(np.max(SOC_HE) - np.min(SOC_HE))   # Depth of Discharge [0-100]
-    DOD_HP = 100*(np.max(SOC_HP) - np.min(SOC_HP))   # Depth of Discharge [0-100]
+    DOD_HE = 100*(np.max(sim_HE["SOC"]) - np.min(sim_HE["SOC"]))   # Depth of Discharge [0-100]
+    DOD_HP = 100*(np.max(sim_HP["SOC"]) - np.min(sim_HP["SOC"]))   # Depth of Discharge [0-100]
     N_cycles_HE = cell_HE.aging[0]*np.exp(cell_HE.aging[1]*DOD_HE) + cell_HE.aging[2]*np.exp(cell_HE.aging[3]*DOD_HE) # Number of cycles which can be performed before initial energy of HE battery is shrinked by 20%
     N_cycles_HP = cell_HP.aging[0]*np.exp(cell_HP.aging[1]*DOD_HP) + cell_HP.aging[2]*np.exp(cell_HP.aging[3]*DOD_HP) # Number of cycles which can be performed before initial energy of HP battery is shrinked by 20%
     
@@ -143,44 +147,17 @@ def treshold(loads, cell_HE, cell_HP, V_bus, cycles):
     N_HE = E_HE / (M_HE * cell_HE.energy)
     N_HP = E_HP / (M_HP * cell_HP.energy)
 
-    SOC_HE_aged = np.full(len(t_soc), 0.9)
-    V_HE_aged = np.empty(len(t))
-    I_HE_aged = np.empty(len(t))
-    P_HE_joule_aged = np.empty(len(t))
-    I_HE_joule_aged = np.empty(len(t))
-
-    SOC_HP_aged = np.full(len(t_soc), 0.9)
-    V_HP_aged = np.empty(len(t))
-    I_HP_aged = np.empty(len(t))
-    P_HP_joule_aged = np.empty(len(t))
-    I_HP_joule_aged = np.empty(len(t))
-    # E_HE_used = np.zeros(len(t_soc))
-    # E_HP_used = np.zeros(len(t_soc))
-
+    sim_HE = simulation.simulate_life(P_HE, t_soc, E_HE, E_HE_aged, cell_HE, M_HE) # BOL and EOL in one pass
+    sim_HP = simulation.simulate_life(P_HP, t_soc, E_HP, E_HP_aged, cell_HP, M_HP)
 
-    for i in range(len(t)):
-        SOC_HE[i+1] = SOC_HE[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE*3.6e6)) if E_HE != 0 else SOC_HE[i]
-        SOC_HP[i+1] = SOC_HP[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP*3.6e6)) if E_HP != 0 else SOC_HP[i]
-        SOC_HE_aged[i+1] = SOC_HE_aged[i] - (P_HE[i] * (t_soc[i+1]-t_soc[i]) / (E_HE_aged*3.6e6)) if E_HE_aged != 0 else SOC_HE_aged[i]
-        SOC_HP_aged[i+1] = SOC_HP_aged[i] - (P_HP[i] * (t_soc[i+1]-t_soc[i]) / (E_HP_aged*3.6e6)) if E_HP_aged != 0 else SOC_HP_aged[i]
-
-        # E_HE_used[i+1] = E_HE_used[i] + (P_HE[i]*(t_soc[i+1]-t_soc[i])/3.6e6)
-        # E_HP_used[i+1] = E_HP_used[i] + (P_HP[i]*(t_soc[i+1]-t_soc[i])/3.6e6)
-
-        V_HE[i] = M_HE * np.interp(SOC_HE[i], cell_HE.OCV_SOC, cell_HE.OCV)
-        V_HP[i] = M_HP * np.interp(SOC_HP[i], cell_HP.OCV_SOC, cell_HP.OCV)
-        V_HE_aged[i] = M_HE * np.interp(SOC_HE_aged[i], cell_HE.OCV_SOC, cell_HE.OCV)
-        V_HP_aged[i] = M_HP * np.interp(SOC_HP_aged[i], cell_HP.OCV_SOC, cell_HP.OCV)
-
-        I_HE[i] = P_HE[i]/V_HE[i]
-        I_HP[i] = P_HP[i]/V_HP[i]
-        I_HE_aged[i] = P_HE[i]/V_HE_aged[i]
-        I_HP_aged[i] = P_HP[i]/V_HP_aged[i]
-
-        P_HE_joule[i] = cell_HE.resistance * I_HE[i]**2
-        P_HP_joule[i] = cell_HP.resistance * I_HP[i]**2
-        P_HE_joule_aged[i] = cell_HE.resistance * I_HE_aged[i]**2
-        P_HP_joule_aged[i] = cell_HP.resistance * I_HP_aged[i]**2
+    SOC_HE, SOC_HE_aged = sim_HE["SOC"]
+    V_HE, V_HE_aged = sim_HE["V"]
+    I_HE, I_HE_aged = sim_HE["I"]
+    P_HE_joule, P_HE_joule_aged = sim_HE["P_joule"]
+    SOC_HP, SOC_HP_aged = sim_HP["SOC"]
+    V_HP, V_HP_aged = sim_HP["V"]
+    I_HP, I_HP_aged = sim_HP["I"]
+    P_HP_joule, P_HP_joule_aged = sim_HP["P_joule"]
 
 
 
@@ -202,8 +179,6 @@ def treshold(loads, cell_HE, cell_HP, V_bus, cycles):
         "t": t,
         "t_soc": t_soc,
         "P": P,
-        "P_HE": P_HE,
-        "P_HP": P_HP,
         "P_HE_joule": P_HE_joule,
         "P_HP_joule": P_HP_joule,
         "SOC_HE": SOC_HE,
@@ -218,6 +193,9 @@ def treshold(loads, cell_HE, cell_HP, V_bus, cycles):
         "N_HP": N_HP,
         "cost": M_HE*N_HE*cell_HE.cost + M_HP*N_HP*cell_HP.cost,
         "limit": limit[index_min],
+        "limits": limit,
+        "cost_curve": cost,
+        "evaluations": evaluations,
         "losses": E_HE_losses + E_HP_losses,
         "efficiency": efficiency,
         "P_HE_joule_aged": P_HE_joule_aged,
@@ -240,14 +218,20 @@ def treshold(loads, cell_HE, cell_HP, V_bus, cycles):
         "method": treshold,
     }
 
-    return result
+    return Result(result, derived=SPLIT)
 
-def treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
+def treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None, condensed=False, compiled=False):
+    '''
+    condensed: only the sizes, the power treshold and the aging terms are decision variables, the trajectories are expressions of them
+    '''
+    multi.single(loads, "treshold_opti")
     start_time = time.time()
     if dict_initial == None:
         dict_initial = treshold(loads, cell_HE, cell_HP, V_bus, cycles)
 
+    start_build = time.time()
     opti = ca.Opti()
+    blocks = {}
 
     P = loads[0]["P"].values # W
     t = loads[0]["t"].values # s
@@ -259,112 +243,156 @@ def treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
 
     # Decision variables
     P_limit = opti.variable(1, 1)
-    P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
-    P_HP = opti.variable(len(t),1)      # Power from HP battery       [W]
-    P_HE_joule = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE = opti.variable(len(t), 1)
-    V_HP = opti.variable(len(t), 1)
-    I_HE = opti.variable(len(t), 1)
-    I_HP = opti.variable(len(t), 1)
-
-    P_HE_joule_aged = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
-    P_HP_joule_aged = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
-    N_HE_aged = opti.variable(1,1)           # Number of parallel HE strings []
-    N_HP_aged = opti.variable(1,1)           # Number of parallel HP strings []
-    SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
-    SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
-    V_HE_aged = opti.variable(len(t), 1)
-    V_HP_aged = opti.variable(len(t), 1)
-    I_HE_aged = opti.variable(len(t), 1)
-    I_HP_aged = opti.variable(len(t), 1)
-
-    E_HE_aged = opti.variable(1, 1)
-    E_HP_aged = opti.variable(1, 1)
-    DOD_HE = opti.variable(1, 1)
-    DOD_HP = opti.variable(1, 1)
-    E_HE_used = opti.variable(1, 1)
-    E_HP_used = opti.variable(1, 1)
+    if condensed:
+        N_HE = opti.variable(1,1)           # Number of parallel HE strings []
+        N_HP = opti.variable(1,1)           # Number of parallel HP strings []
+        E_HE_aged = opti.variable(1, 1)
+        E_HP_aged = opti.variable(1, 1)
+        DOD_HE = opti.variable(1, 1)
+        DOD_HP = opti.variable(1, 1)
+
+        dt = ca.DM(np.diff(t_soc)) # s
+        P_load = ca.DM(P)          # W
+        P_HE = ca.if_else(P_load > P_limit, P_limit, P_load)      # Power from HE battery       [W]
+        P_HP = ca.if_else(P_load > P_limit, P_load-P_limit, 0)    # Power from HP battery       [W]
+        E_HE_used = ca.dot(P_HE[:-1], dt[:-1]) / 3.6e6
+        E_HP_used = ca.dot(P_HP[:-1], dt[:-1]) / 3.6e6
+
+        sim_HE = simulation.expressions(P_HE, dt, M_HE*N_HE*cell_HE.energy, cell_HE, M_HE)
+        sim_HP = simulation.expressions(P_HP, dt, M_HP*N_HP*cell_HP.energy, cell_HP, M_HP)
+        sim_HE_aged = simulation.expressions(P_HE, dt, E_HE_aged, cell_HE, M_HE)
+        sim_HP_aged = simulation.expressions(P_HP, dt, E_HP_aged, cell_HP, M_HP)
+        SOC_HE, V_HE, I_HE, P_HE_joule = sim_HE["SOC"], sim_HE["V"], sim_HE["I"], sim_HE["P_joule"]
+        SOC_HP, V_HP, I_HP, P_HP_joule = sim_HP["SOC"], sim_HP["V"], sim_HP["I"], sim_HP["P_joule"]
+        SOC_HE_aged, V_HE_aged, I_HE_aged, P_HE_joule_aged = sim_HE_aged["SOC"], sim_HE_aged["V"], sim_HE_aged["I"], sim_HE_aged["P_joule"]
+        SOC_HP_aged, V_HP_aged, I_HP_aged, P_HP_joule_aged = sim_HP_aged["SOC"], sim_HP_aged["V"], sim_HP_aged["I"], sim_HP_aged["P_joule"]
+    else:
+        P_HE = opti.variable(len(t),1)      # Power from HE battery       [W]
+        P_HP = opti.variable(len(t),1)      # Power from HP battery       [W]
+        P_HE_joule = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
+        P_HP_joule = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
+        N_HE = opti.variable(1,1)           # Number of parallel HE strings []
+        N_HP = opti.variable(1,1)           # Number of parallel HP strings []
+        SOC_HE = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
+        SOC_HP = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
+        V_HE = opti.variable(len(t), 1)
+        V_HP = opti.variable(len(t), 1)
+        I_HE = opti.variable(len(t), 1)
+        I_HP = opti.variable(len(t), 1)
+
+        P_HE_joule_aged = opti.variable(len(t),1)      # Joule losses from HE battery       [W]
+        P_HP_joule_aged = opti.variable(len(t),1)      # Joule losses from HP battery       [W]
+        N_HE_aged = opti.variable(1,1)           # Number of parallel HE strings []
+        N_HP_aged = opti.variable(1,1)           # Number of parallel HP strings []
+        SOC_HE_aged = opti.variable(len(t)+1, 1)   # State of Charge of HE batttery [0-1]
+        SOC_HP_aged = opti.variable(len(t)+1, 1)   # State of Charge of HP batttery [0-1]
+        V_HE_aged = opti.variable(len(t), 1)
+        V_HP_aged = opti.variable(len(t), 1)
+        I_HE_aged = opti.variable(len(t), 1)
+        I_HP_aged = opti.variable(len(t), 1)
+
+        E_HE_aged = opti.variable(1, 1)
+        E_HP_aged = opti.variable(1, 1)
+        DOD_HE = opti.variable(1, 1)
+        DOD_HP = opti.variable(1, 1)
+        E_HE_used = opti.variable(1, 1)
+        E_HP_used = opti.variable(1, 1)
     
     # Objective function
     obj = (M_HE*N_HE*cell_HE.cost) + (M_HP*N_HP*cell_HP.cost)
 
     # Constraintss
-    opti.subject_to([
-        N_HE > 0, # May not be 0 to avoid division by 0
-        N_HP > 0,
+    warmstart.subject_to(opti, blocks, {
+        "N_HE_min": N_HE > 0, # May not be 0 to avoid division by 0
+        "N_HP_min": N_HP > 0,
         
-        SOC_HE <= 0.9,
-        SOC_HP <= 0.9,
-        SOC_HE >= 0.1,
-        SOC_HP >= 0.1,
-        SOC_HE_aged <= 0.9,
-        SOC_HP_aged <= 0.9,
-        SOC_HE_aged >= 0.1,
-        SOC_HP_aged >= 0.1,
-
-        E_HE_used > 0,
-        E_HP_used > 0,
-
-        E_HE_aged > 0,
-        E_HP_aged > 0,
-
-        DOD_HE < 100,
-        DOD_HP < 100,
-        DOD_HE > 0,
-        DOD_HP > 0,
-
-        P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
-        P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
-
-        E_HE_aged == (M_HE*N_HE*cell_HE.energy) * (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
-        E_HP_aged == (M_HP*N_HP*cell_HP.energy) * (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
-
-
-        DOD_HE == (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
-        DOD_HP == (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
-        ])
-
-    SOC_HE[0] = ca.DM(0.9)
-    SOC_HP[0] = ca.DM(0.9)
-    SOC_HE_aged[0] = ca.DM(0.9)
-    SOC_HP_aged[0] = ca.DM(0.9)
-    SOC_TO_OCV_HE = ca.interpolant('LUT', 'bspline', [cell_HE.OCV_SOC], cell_HE.OCV)
-    SOC_TO_OCV_HP = ca.interpolant('LUT', 'bspline', [cell_HP.OCV_SOC], cell_HP.OCV)
-
-    for i in range(len(t)):
-        opti.subject_to(P_HE[i] == ca.if_else(P[i] > P_limit, P_limit, P[i]))
-        opti.subject_to(P_HP[i] == ca.if_else(P[i] > P_limit, P[i]-P_limit, 0))
-
-        opti.subject_to(SOC_HE[i+1] == SOC_HE[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((M_HE*N_HE*cell_HE.energy*3.6e6))))
-        opti.subject_to(SOC_HP[i+1] == SOC_HP[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((M_HP*N_HP*cell_HP.energy*3.6e6))))
-        opti.subject_to(SOC_HE_aged[i+1] == SOC_HE_aged[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((E_HE_aged*3.6e6))))
-        opti.subject_to(SOC_HP_aged[i+1] == SOC_HP_aged[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((E_HP_aged*3.6e6))))
-
-
-        opti.subject_to(V_HE[i] == M_HE*SOC_TO_OCV_HE(SOC_HE[i]))
-        opti.subject_to(V_HP[i] == M_HP*SOC_TO_OCV_HP(SOC_HP[i]))
-        opti.subject_to(V_HE_aged[i] == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[i]))
-        opti.subject_to(V_HP_aged[i] == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[i]))
-
-        opti.subject_to(I_HE[i] == P_HE[i]/V_HE[i])
-        opti.subject_to(I_HP[i] == P_HP[i]/V_HP[i])
-        opti.subject_to(I_HE_aged[i] == P_HE[i]/V_HE_aged[i])
-        opti.subject_to(I_HP_aged[i] == P_HP[i]/V_HP_aged[i])
-
-        opti.subject_to(I_HE[i] + P_HE_joule[i]/V_HE[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP[i] + P_HP_joule[i]/V_HP[i] <= cell_HP.dis_current*N_HP)
-        opti.subject_to(I_HE_aged[i] + P_HE_joule_aged[i]/V_HE_aged[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP_aged[i] + P_HP_joule_aged[i]/V_HP_aged[i] <= cell_HP.dis_current*N_HP)
-
-    opti.subject_to(E_HE_used == sum(P_HE[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-    opti.subject_to(E_HP_used == sum(P_HP[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
+        "SOC_HE_max": SOC_HE <= 0.9,
+        "SOC_HP_max": SOC_HP <= 0.9,
+        "SOC_HE_min": SOC_HE >= 0.1,
+        "SOC_HP_min": SOC_HP >= 0.1,
+        "SOC_HE_aged_max": SOC_HE_aged <= 0.9,
+        "SOC_HP_aged_max": SOC_HP_aged <= 0.9,
+        "SOC_HE_aged_min": SOC_HE_aged >= 0.1,
+        "SOC_HP_aged_min": SOC_HP_aged >= 0.1,
+
+        "E_HE_used_min": E_HE_used > 0,
+        "E_HP_used_min": E_HP_used > 0,
+
+        "E_HE_aged_min": E_HE_aged > 0,
+        "E_HP_aged_min": E_HP_aged > 0,
+
+        "DOD_HE_max": DOD_HE < 100,
+        "DOD_HP_max": DOD_HP < 100,
+        "DOD_HE_min": DOD_HE > 0,
+        "DOD_HP_min": DOD_HP > 0,
+        })
+
+    if not condensed:
+        warmstart.subject_to(opti, blocks, {
+            "P_HE_joule": P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
+            "P_HP_joule": P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
+            "P_HE_joule_aged": P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
+            "P_HP_joule_aged": P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
+            })
+
+    warmstart.subject_to(opti, blocks, {
+        "E_HE_aged": E_HE_aged == (M_HE*N_HE*cell_HE.energy) * (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))),
+        "E_HP_aged": E_HP_aged == (M_HP*N_HP*cell_HP.energy) * (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))),
+
+
+        "DOD_HE": DOD_HE == (E_HE_used/(M_HE*N_HE*cell_HE.energy))*100,
+        "DOD_HP": DOD_HP == (E_HP_used/(M_HP*N_HP*cell_HP.energy))*100,
+        })
+
+    if not condensed:
+        SOC_HE[0] = ca.DM(0.9)
+        SOC_HP[0] = ca.DM(0.9)
+        SOC_HE_aged[0] = ca.DM(0.9)
+        SOC_HP_aged[0] = ca.DM(0.9)
+        SOC_TO_OCV_HE = ocv.lookup(cell_HE)
+        SOC_TO_OCV_HP = ocv.lookup(cell_HP)
+
+        dt = ca.DM(np.diff(t_soc)) # s
+        P_load = ca.DM(P)          # W
+        warmstart.subject_to(opti, blocks, {
+            "P_HE": P_HE == ca.if_else(P_load > P_limit, P_limit, P_load),
+            "P_HP": P_HP == ca.if_else(P_load > P_limit, P_load-P_limit, 0),
+            })
+
+        warmstart.subject_to(opti, blocks, {
+            "SOC_HE": SOC_HE[1:] == SOC_HE[:-1] - ((P_HE*dt)/((M_HE*N_HE*cell_HE.energy*3.6e6))),
+            "SOC_HP": SOC_HP[1:] == SOC_HP[:-1] - ((P_HP*dt)/((M_HP*N_HP*cell_HP.energy*3.6e6))),
+            "SOC_HE_aged": SOC_HE_aged[1:] == SOC_HE_aged[:-1] - ((P_HE*dt)/((E_HE_aged*3.6e6))),
+            "SOC_HP_aged": SOC_HP_aged[1:] == SOC_HP_aged[:-1] - ((P_HP*dt)/((E_HP_aged*3.6e6))),
+            })
+
+
+        warmstart.subject_to(opti, blocks, {
+            "V_HE": V_HE == M_HE*SOC_TO_OCV_HE(SOC_HE[:-1].T).T,
+            "V_HP": V_HP == M_HP*SOC_TO_OCV_HP(SOC_HP[:-1].T).T,
+            "V_HE_aged": V_HE_aged == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[:-1].T).T,
+            "V_HP_aged": V_HP_aged == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[:-1].T).T,
+            })
+
+        warmstart.subject_to(opti, blocks, {
+            "I_HE": I_HE == P_HE/V_HE,
+            "I_HP": I_HP == P_HP/V_HP,
+            "I_HE_aged": I_HE_aged == P_HE/V_HE_aged,
+            "I_HP_aged": I_HP_aged == P_HP/V_HP_aged,
+            })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE_max": I_HE + P_HE_joule/V_HE <= cell_HE.dis_current*N_HE,
+        "I_HP_max": I_HP + P_HP_joule/V_HP <= cell_HP.dis_current*N_HP,
+        "I_HE_aged_max": I_HE_aged + P_HE_joule_aged/V_HE_aged <= cell_HE.dis_current*N_HE,
+        "I_HP_aged_max": I_HP_aged + P_HP_joule_aged/V_HP_aged <= cell_HP.dis_current*N_HP,
+        })
+
+    if not condensed:
+        warmstart.subject_to(opti, blocks, {
+            "E_HE_used": E_HE_used == simulation.used(SOC_HE, M_HE*N_HE*cell_HE.energy),
+            "E_HP_used": E_HP_used == simulation.used(SOC_HP, M_HP*N_HP*cell_HP.energy),
+            })
 
     # Set initial values
     opti.set_value(M_HE, V_bus/cell_HE.voltage)
@@ -372,16 +400,20 @@ def treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
 
     if dict_initial != None:
         opti.set_initial(P_limit, dict_initial["limit"])
-        opti.set_initial(P_HE, dict_initial["P_HE"])
-        opti.set_initial(P_HP, dict_initial["P_HP"])
         opti.set_initial(N_HE, dict_initial["N_HE"] if dict_initial["N_HE"] != 0 else 1e-9)
         opti.set_initial(N_HP, dict_initial["N_HP"] if dict_initial["N_HP"] != 0 else 1e-9)
+        opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
+        opti.set_initial(E_HP_aged, dict_initial["E_HP_aged"])
+
+    if dict_initial != None and not condensed:
+        opti.set_initial(P_HE, dict_initial["P_HE"])
+        opti.set_initial(P_HP, dict_initial["P_HP"])
         opti.set_initial(SOC_HE, dict_initial["SOC_HE"])
         opti.set_initial(SOC_HP, dict_initial["SOC_HP"])
         opti.set_initial(V_HE, dict_initial["V_HE"])
         opti.set_initial(V_HP, dict_initial["V_HP"])
         opti.set_initial(I_HE, dict_initial["I_HE"])
-        opti.set_initial(I_HP, dict_initial["I_HE"])
+        opti.set_initial(I_HP, dict_initial["I_HP"])
         opti.set_initial(P_HE_joule, dict_initial["P_HE_joule"])
         opti.set_initial(P_HP_joule, dict_initial["P_HP_joule"])
         opti.set_initial(SOC_HE_aged, dict_initial["SOC_HE_aged"])
@@ -389,27 +421,29 @@ def treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
         opti.set_initial(V_HE_aged, dict_initial["V_HE_aged"])
         opti.set_initial(V_HP_aged, dict_initial["V_HP_aged"])
         opti.set_initial(I_HE_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(I_HP_aged, dict_initial["I_HE_aged"])
+        opti.set_initial(I_HP_aged, dict_initial["I_HP_aged"])
         opti.set_initial(P_HE_joule_aged, dict_initial["P_HE_joule_aged"])
         opti.set_initial(P_HP_joule_aged, dict_initial["P_HP_joule_aged"])
-        opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
-        opti.set_initial(E_HP_aged, dict_initial["E_HP_aged"])
         opti.set_initial(E_HE_used, dict_initial["E_HE_used"])
         opti.set_initial(E_HP_used, dict_initial["E_HP_used"])
 
 
     # Start optimization
     opti.minimize(obj)
-    options = {"ipopt": {"print_level": 1, "max_iter":3000}} #level5
+    warm = warmstart.initial(opti, blocks, dict_initial, "cost")
+    options = {"ipopt": {"print_level": 1, "max_iter":3000, **warm}} #level5
     opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
     try:
-        sol = opti.solve()
-    except:
+        sol = codegen.solve(opti, "ipopt", options) if compiled else opti.solve()
+    except Exception:
         opti.debug.show_infeasibilities()
         print("[ERROR] Optimization Failed!")
         # opti.debug.x_describe(index)
         # opti.debug.g_describe(index)
-        exit()
+        return failure(opti, blocks, {"t": t, "t_soc": t_soc, "P": P, "method": "optimal"}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
 
 
     zero_HE = sol.value(N_HE) < 1e-3    # Check if there are HE cells in the solutions, to remove artifacts
@@ -453,12 +487,16 @@ def treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
         "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
         "DOD_HE": sol.value(DOD_HE),
         "DOD_HP": sol.value(DOD_HP),
+        "iterations": sol.stats()["iter_count"],
+        "warm_start": warmstart.save(opti, sol, blocks, "cost", options["ipopt"]),
+        "time_build": time_build,
+        "time_solve": time_solve,
         "time": duration,
         "method": "optimal"
         #"limit": None
     }
 
-    return result
+    return Result(result)
 
 
 
@@ -472,12 +510,15 @@ def treshold_opti(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
 
 
 
-def treshold_opti2(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
+def treshold_opti2(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None, compiled=False):
+    multi.single(loads, "treshold_opti2")
     start_time = time.time()
     if dict_initial == None:
         dict_initial = treshold(loads, cell_HE, cell_HP, V_bus, cycles)
 
+    start_build = time.time()
     opti = ca.Opti()
+    blocks = {}
 
     P = loads[0]["P"].values # W
     t = loads[0]["t"].values # s
@@ -524,79 +565,92 @@ def treshold_opti2(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
     obj = (M_HE*N_HE*cell_HE.cost) + (M_HP*N_HP*cell_HP.cost)
 
     # Constraintss
-    opti.subject_to([
-        N_HE >= 0, # May not be 0 to avoid division by 0
-        N_HP >= 0,
+    warmstart.subject_to(opti, blocks, {
+        "N_HE_min": N_HE >= 0, # May not be 0 to avoid division by 0
+        "N_HP_min": N_HP >= 0,
         
-        SOC_HE <= 0.9,
-        SOC_HP <= 0.9,
-        SOC_HE >= 0.1,
-        SOC_HP >= 0.1,
-        SOC_HE_aged <= 0.9,
-        SOC_HP_aged <= 0.9,
-        SOC_HE_aged >= 0.1,
-        SOC_HP_aged >= 0.1,
+        "SOC_HE_max": SOC_HE <= 0.9,
+        "SOC_HP_max": SOC_HP <= 0.9,
+        "SOC_HE_min": SOC_HE >= 0.1,
+        "SOC_HP_min": SOC_HP >= 0.1,
+        "SOC_HE_aged_max": SOC_HE_aged <= 0.9,
+        "SOC_HP_aged_max": SOC_HP_aged <= 0.9,
+        "SOC_HE_aged_min": SOC_HE_aged >= 0.1,
+        "SOC_HP_aged_min": SOC_HP_aged >= 0.1,
 
-        E_HE_used >= 0,
-        E_HP_used >= 0,
+        "E_HE_used_min": E_HE_used >= 0,
+        "E_HP_used_min": E_HP_used >= 0,
 
-        E_HE_aged >= 0,
-        E_HP_aged >= 0,
+        "E_HE_aged_min": E_HE_aged >= 0,
+        "E_HP_aged_min": E_HP_aged >= 0,
 
-        DOD_HE < 100,
-        DOD_HP < 100,
-        DOD_HE > 0,
-        DOD_HP > 0,
+        "DOD_HE_max": DOD_HE < 100,
+        "DOD_HP_max": DOD_HP < 100,
+        "DOD_HE_min": DOD_HE > 0,
+        "DOD_HP_min": DOD_HP > 0,
 
-        P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
-        P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
-        P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
+        "P_HE_joule": P_HE_joule == cell_HE.resistance * (I_HE**2), # Calculate HE joule losses (R*I²)
+        "P_HP_joule": P_HP_joule == cell_HP.resistance * (I_HP**2), # Calculate HP joule losses (R*I²)
+        "P_HE_joule_aged": P_HE_joule_aged == cell_HE.resistance * (I_HE_aged**2), # Calculate HE joule losses (R*I²)
+        "P_HP_joule_aged": P_HP_joule_aged == cell_HP.resistance * (I_HP_aged**2), # Calculate HP joule losses (R*I²)
 
-        DOD_HE == ca.if_else((E_HE_used/(M_HE*N_HE*cell_HE.energy))*100, N_HE > 0, 0),
-        DOD_HP == ca.if_else((E_HP_used/(M_HP*N_HP*cell_HP.energy))*100, N_HP > 0, 0),
+        "DOD_HE": DOD_HE == ca.if_else((E_HE_used/(M_HE*N_HE*cell_HE.energy))*100, N_HE > 0, 0),
+        "DOD_HP": DOD_HP == ca.if_else((E_HP_used/(M_HP*N_HP*cell_HP.energy))*100, N_HP > 0, 0),
 
-        E_HE_aged == ca.if_else((M_HE*N_HE*cell_HE.energy) * (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))), N_HE > 0, 0),
-        E_HP_aged == ca.if_else((M_HP*N_HP*cell_HP.energy) * (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))), N_HP > 0, 0),
+        "E_HE_aged": E_HE_aged == ca.if_else((M_HE*N_HE*cell_HE.energy) * (1 - 0.2 * (cycles[0]/(cell_HE.aging[0]*ca.exp(cell_HE.aging[1]*DOD_HE)+cell_HE.aging[2]*ca.exp(cell_HE.aging[3]*DOD_HE)))), N_HE > 0, 0),
+        "E_HP_aged": E_HP_aged == ca.if_else((M_HP*N_HP*cell_HP.energy) * (1 - 0.2 * (cycles[0]/(cell_HP.aging[0]*ca.exp(cell_HP.aging[1]*DOD_HP)+cell_HP.aging[2]*ca.exp(cell_HP.aging[3]*DOD_HP)))), N_HP > 0, 0),
 
 
         
-        ])
+        })
 
     SOC_HE[0] = ca.DM(0.9)
     SOC_HP[0] = ca.DM(0.9)
     SOC_HE_aged[0] = ca.DM(0.9)
     SOC_HP_aged[0] = ca.DM(0.9)
-    SOC_TO_OCV_HE = ca.interpolant('LUT', 'bspline', [cell_HE.OCV_SOC], cell_HE.OCV)
-    SOC_TO_OCV_HP = ca.interpolant('LUT', 'bspline', [cell_HP.OCV_SOC], cell_HP.OCV)
-
-    for i in range(len(t)):
-        opti.subject_to(P_HE[i] == ca.if_else(P[i] > P_limit, P_limit, P[i]))
-        opti.subject_to(P_HP[i] == ca.if_else(P[i] > P_limit, P[i]-P_limit, 0))
-
-        opti.subject_to(SOC_HE[i+1] == ca.if_else(SOC_HE[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((M_HE*N_HE*cell_HE.energy*3.6e6))), N_HE > 0, SOC_HE[i]))
-        opti.subject_to(SOC_HP[i+1] == ca.if_else(SOC_HP[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((M_HP*N_HP*cell_HP.energy*3.6e6))), N_HP > 0, SOC_HP[i]))
-        opti.subject_to(SOC_HE_aged[i+1] == ca.if_else(SOC_HE_aged[i] - ((P_HE[i]*(t_soc[i+1]-t_soc[i]))/((E_HE_aged*3.6e6))), N_HE > 0, 0))
-        opti.subject_to(SOC_HP_aged[i+1] == ca.if_else(SOC_HP_aged[i] - ((P_HP[i]*(t_soc[i+1]-t_soc[i]))/((E_HP_aged*3.6e6))), N_HP > 0, 0))
-
-
-        opti.subject_to(V_HE[i] == M_HE*SOC_TO_OCV_HE(SOC_HE[i]))
-        opti.subject_to(V_HP[i] == M_HP*SOC_TO_OCV_HP(SOC_HP[i]))
-        opti.subject_to(V_HE_aged[i] == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[i]))
-        opti.subject_to(V_HP_aged[i] == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[i]))
-
-        opti.subject_to(I_HE[i] == ca.if_else(P_HE[i]/V_HE[i], N_HE > 0, 0))
-        opti.subject_to(I_HP[i] == ca.if_else(P_HP[i]/V_HP[i], N_HP > 0, 0))
-        opti.subject_to(I_HE_aged[i] == ca.if_else(P_HE[i]/V_HE_aged[i], N_HE > 0, 0))
-        opti.subject_to(I_HP_aged[i] == ca.if_else(P_HP[i]/V_HP_aged[i], N_HP > 0, 0))
-
-        opti.subject_to(I_HE[i] + P_HE_joule[i]/V_HE[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP[i] + P_HP_joule[i]/V_HP[i] <= cell_HP.dis_current*N_HP)
-        opti.subject_to(I_HE_aged[i] + P_HE_joule_aged[i]/V_HE_aged[i] <= cell_HE.dis_current*N_HE)
-        opti.subject_to(I_HP_aged[i] + P_HP_joule_aged[i]/V_HP_aged[i] <= cell_HP.dis_current*N_HP)
-
-    opti.subject_to(E_HE_used == sum(P_HE[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
-    opti.subject_to(E_HP_used == sum(P_HP[i] * (t_soc[i+1] - t_soc[i]) / 3.6e6 for i in range(len(t)-1)))
+    SOC_TO_OCV_HE = ocv.lookup(cell_HE)
+    SOC_TO_OCV_HP = ocv.lookup(cell_HP)
+
+    dt = ca.DM(np.diff(t_soc)) # s
+    P_load = ca.DM(P)          # W
+    warmstart.subject_to(opti, blocks, {
+        "P_HE": P_HE == ca.if_else(P_load > P_limit, P_limit, P_load),
+        "P_HP": P_HP == ca.if_else(P_load > P_limit, P_load-P_limit, 0),
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "SOC_HE": SOC_HE[1:] == ca.if_else(SOC_HE[:-1] - ((P_HE*dt)/((M_HE*N_HE*cell_HE.energy*3.6e6))), N_HE > 0, SOC_HE[:-1]),
+        "SOC_HP": SOC_HP[1:] == ca.if_else(SOC_HP[:-1] - ((P_HP*dt)/((M_HP*N_HP*cell_HP.energy*3.6e6))), N_HP > 0, SOC_HP[:-1]),
+        "SOC_HE_aged": SOC_HE_aged[1:] == ca.if_else(SOC_HE_aged[:-1] - ((P_HE*dt)/((E_HE_aged*3.6e6))), N_HE > 0, 0),
+        "SOC_HP_aged": SOC_HP_aged[1:] == ca.if_else(SOC_HP_aged[:-1] - ((P_HP*dt)/((E_HP_aged*3.6e6))), N_HP > 0, 0),
+        })
+
+
+    warmstart.subject_to(opti, blocks, {
+        "V_HE": V_HE == M_HE*SOC_TO_OCV_HE(SOC_HE[:-1].T).T,
+        "V_HP": V_HP == M_HP*SOC_TO_OCV_HP(SOC_HP[:-1].T).T,
+        "V_HE_aged": V_HE_aged == M_HE*SOC_TO_OCV_HE(SOC_HE_aged[:-1].T).T,
+        "V_HP_aged": V_HP_aged == M_HP*SOC_TO_OCV_HP(SOC_HP_aged[:-1].T).T,
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE": I_HE == ca.if_else(P_HE/V_HE, N_HE > 0, 0),
+        "I_HP": I_HP == ca.if_else(P_HP/V_HP, N_HP > 0, 0),
+        "I_HE_aged": I_HE_aged == ca.if_else(P_HE/V_HE_aged, N_HE > 0, 0),
+        "I_HP_aged": I_HP_aged == ca.if_else(P_HP/V_HP_aged, N_HP > 0, 0),
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "I_HE_max": I_HE + P_HE_joule/V_HE <= cell_HE.dis_current*N_HE,
+        "I_HP_max": I_HP + P_HP_joule/V_HP <= cell_HP.dis_current*N_HP,
+        "I_HE_aged_max": I_HE_aged + P_HE_joule_aged/V_HE_aged <= cell_HE.dis_current*N_HE,
+        "I_HP_aged_max": I_HP_aged + P_HP_joule_aged/V_HP_aged <= cell_HP.dis_current*N_HP,
+        })
+
+    warmstart.subject_to(opti, blocks, {
+        "E_HE_used": E_HE_used == simulation.used(SOC_HE, M_HE*N_HE*cell_HE.energy),
+        "E_HP_used": E_HP_used == simulation.used(SOC_HP, M_HP*N_HP*cell_HP.energy),
+        })
 
     # Set initial values
     opti.set_value(M_HE, V_bus/cell_HE.voltage)
@@ -613,7 +667,7 @@ def treshold_opti2(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
         opti.set_initial(V_HE, dict_initial["V_HE"])
         opti.set_initial(V_HP, dict_initial["V_HP"])
         opti.set_initial(I_HE, dict_initial["I_HE"])
-        opti.set_initial(I_HP, dict_initial["I_HE"])
+        opti.set_initial(I_HP, dict_initial["I_HP"])
         opti.set_initial(P_HE_joule, dict_initial["P_HE_joule"])
         opti.set_initial(P_HP_joule, dict_initial["P_HP_joule"])
         opti.set_initial(SOC_HE_aged, dict_initial["SOC_HE_aged"])
@@ -621,7 +675,7 @@ def treshold_opti2(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
         opti.set_initial(V_HE_aged, dict_initial["V_HE_aged"])
         opti.set_initial(V_HP_aged, dict_initial["V_HP_aged"])
         opti.set_initial(I_HE_aged, dict_initial["I_HE_aged"])
-        opti.set_initial(I_HP_aged, dict_initial["I_HE_aged"])
+        opti.set_initial(I_HP_aged, dict_initial["I_HP_aged"])
         opti.set_initial(P_HE_joule_aged, dict_initial["P_HE_joule_aged"])
         opti.set_initial(P_HP_joule_aged, dict_initial["P_HP_joule_aged"])
         opti.set_initial(E_HE_aged, dict_initial["E_HE_aged"])
@@ -632,16 +686,20 @@ def treshold_opti2(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
 
     # Start optimization
     opti.minimize(obj)
-    options = {"ipopt": {"print_level": 1, "max_iter":3000}} #level5
+    warm = warmstart.initial(opti, blocks, dict_initial, "cost")
+    options = {"ipopt": {"print_level": 1, "max_iter":3000, **warm}} #level5
     opti.solver('ipopt', options)
+    time_build = (time.time() - start_build)*1000
+    start_solve = time.time()
     try:
-        sol = opti.solve()
-    except:
+        sol = codegen.solve(opti, "ipopt", options) if compiled else opti.solve()
+    except Exception:
         opti.debug.show_infeasibilities()
         print("[ERROR] Optimization Failed!")
         # opti.debug.x_describe(index)
         # opti.debug.g_describe(index)
-        exit()
+        return failure(opti, blocks, {"t": t, "t_soc": t_soc, "P": P, "method": "optimal"}, start_time, time_build)
+    time_solve = (time.time() - start_solve)*1000
 
 
     zero_HE = sol.value(N_HE) < 1e-3    # Check if there are HE cells in the solutions, to remove artifacts
@@ -685,10 +743,14 @@ def treshold_opti2(loads, cell_HE, cell_HP, V_bus, cycles, dict_initial=None):
         "I_HP_rated": sol.value(N_HP)*cell_HP.dis_current,
         "DOD_HE": sol.value(DOD_HE),
         "DOD_HP": sol.value(DOD_HP),
+        "iterations": sol.stats()["iter_count"],
+        "warm_start": warmstart.save(opti, sol, blocks, "cost", options["ipopt"]),
+        "time_build": time_build,
+        "time_solve": time_solve,
         "time": duration,
         "method": "optimal"
         #"limit": None
     }
 
-    return result
+    return Result(result)
 